@@ -2,18 +2,30 @@
 Face Recognition API Endpoints
 """
 
-import base64
-import io
+import asyncio
+import json
 import logging
-from typing import Optional
+import time
+from typing import AsyncIterator, List, Optional
 
 import face_recognition
 import numpy as np
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from pydantic import BaseModel
-from PIL import Image
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 from core.config import settings
+from core.ndjson import ndjson_lines
+from engine.face_compute import (
+    FaceComputeBusy,
+    InvalidImage,
+    edge_density,
+    encode_image,
+    face_pool,
+    locate_faces
+)
+from engine.face_encoding import format_encoding, parse_encoding, parse_encodings
+from engine.face_index import face_index
 
 logger = logging.getLogger(__name__)
 
@@ -21,16 +33,23 @@ router = APIRouter()
 
 
 class FaceVerificationRequest(BaseModel):
-    """Face verification request"""
-    stored_face: str  # Base64 encoded face encoding
+    """Face verification request (one of stored_face, stored_faces or user_id)"""
+    stored_face: Optional[str] = None  # Base64 encoded face encoding
+    stored_faces: Optional[List[str]] = None  # Base64 encoded reference encodings
+    user_id: Optional[int] = None  # Compare with the references enrolled in the face index
     provided_face: str  # Base64 encoded face encoding
 
 
 class FaceVerificationResponse(BaseModel):
-    """Face verification response"""
+    """Face verification response (distance and confidence of the best reference)"""
     match: bool
     confidence: float
     distance: float
+    best_reference: int
+    references: int
+    matched_references: int
+    mean_distance: float
+    max_distance: float
 
 
 class FaceQualityRequest(BaseModel):
@@ -57,49 +76,107 @@ class FaceEncodingResponse(BaseModel):
     face_count: int
 
 
-def decode_base64_image(base64_string: str) -> np.ndarray:
-    """Decode base64 string to numpy array"""
+class FaceIdentifyRequest(BaseModel):
+    """Face identification request"""
+    encoding: str  # Base64 encoded face encoding
+    limit: int = 5
+    exclude_user_id: Optional[int] = None
+
+
+class FaceEnrollRequest(BaseModel):
+    """Face index enrollment request"""
+    user_id: int
+    encoding: str  # Base64 encoded face encoding(s), comma-separated like users.face_encoding_data
+
+
+class FaceBatchItem(BaseModel):
+    """One line of an NDJSON batch encoding request"""
+    id: Optional[str] = None
+    image_base64: str
+
+
+async def run_face_task(task, *args):
+    """
+    Run a face task in the face compute pool
+    
+    A full pool answers 503 with Retry-After; undecodable images answer 400.
+    """
     try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        image_data = base64.b64decode(base64_string)
-        image = Image.open(io.BytesIO(image_data))
-        return np.array(image)
-    except Exception as e:
-        logger.error(f"Error decoding base64 image: {e}")
+        return await face_pool.run(task, *args)
+    except FaceComputeBusy as e:
+        logger.warning(f"Face compute pool full: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Face service busy, retry later",
+            headers={"Retry-After": str(settings.FACE_RETRY_AFTER_SECONDS)}
+        )
+    except InvalidImage as e:
+        logger.error(f"Error decoding image: {e}")
         raise HTTPException(status_code=400, detail="Invalid image data")
 
 
 def encode_face_encoding(encoding: np.ndarray) -> str:
-    """Encode face encoding to base64 string"""
-    encoding_bytes = encoding.tobytes()
-    return base64.b64encode(encoding_bytes).decode('utf-8')
+    """Encode face encoding to base64 string in FACE_ENCODING_FORMAT"""
+    return format_encoding(encoding)
 
 
 def decode_face_encoding(encoding_string: str) -> np.ndarray:
-    """Decode base64 string to face encoding"""
+    """Decode base64 string (any encoding format) to face encoding"""
     try:
-        encoding_bytes = base64.b64decode(encoding_string)
-        return np.frombuffer(encoding_bytes, dtype=np.float64)
-    except Exception as e:
+        return parse_encoding(encoding_string)
+    except ValueError as e:
         logger.error(f"Error decoding face encoding: {e}")
         raise HTTPException(status_code=400, detail="Invalid face encoding")
 
 
+def decode_face_encodings(encoding_strings: List[str]) -> np.ndarray:
+    """Decode base64 strings (each possibly comma-separated) to an (R, 128) matrix"""
+    try:
+        return np.concatenate([parse_encodings(encoding_string) for encoding_string in encoding_strings])
+    except ValueError as e:
+        logger.error(f"Error decoding face encodings: {e}")
+        raise HTTPException(status_code=400, detail="Invalid face encoding")
+
+
+def check_reference_count(count: int) -> None:
+    """Reject more reference encodings than a user may have (FACE_MAX_REFERENCES)"""
+    if count > settings.FACE_MAX_REFERENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{count} reference encodings, at most {settings.FACE_MAX_REFERENCES}"
+        )
+
+
 @router.post("/verify", response_model=FaceVerificationResponse)
 async def verify_face(request: FaceVerificationRequest):
     """
-    Verify if two face encodings match
+    Verify if a face encoding matches one or more reference encodings
     """
+    sources = [request.stored_face, request.stored_faces, request.user_id]
+    if sum(source is not None for source in sources) != 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Provide exactly one of stored_face, stored_faces or user_id"
+        )
+    
+    # Decode face encodings
+    provided_encoding = decode_face_encoding(request.provided_face)
+    if request.user_id is not None:
+        stored_encodings = face_index.references(request.user_id)
+        if stored_encodings is None:
+            raise HTTPException(status_code=404, detail="Face encoding not found")
+    else:
+        references = request.stored_faces if request.stored_faces is not None else [request.stored_face]
+        # Checked before decoding too, so a huge list is not decoded first
+        check_reference_count(len(references))
+        stored_encodings = decode_face_encodings(references)
+        check_reference_count(len(stored_encodings))
+    
     try:
-        # Decode face encodings
-        stored_encoding = decode_face_encoding(request.stored_face)
-        provided_encoding = decode_face_encoding(request.provided_face)
-        
-        # Calculate face distance
-        distance = face_recognition.face_distance([stored_encoding], [provided_encoding])[0]
+        # Distances to every reference in one call
+        distances = face_recognition.face_distance(stored_encodings, provided_encoding)
+        best = int(np.argmin(distances))
+        distance = float(distances[best])
         
         # Check if faces match
         match = distance <= settings.FACE_RECOGNITION_TOLERANCE
@@ -107,12 +184,20 @@ async def verify_face(request: FaceVerificationRequest):
         # Calculate confidence (inverse of distance)
         confidence = max(0, 1 - distance)
         
-        logger.info(f"Face verification: match={match}, distance={distance:.4f}")
+        logger.info(
+            f"Face verification: match={match}, distance={distance:.4f}, "
+            f"references={len(distances)}"
+        )
         
         return FaceVerificationResponse(
             match=bool(match),
             confidence=float(confidence),
-            distance=float(distance)
+            distance=distance,
+            best_reference=best,
+            references=len(distances),
+            matched_references=int((distances <= settings.FACE_RECOGNITION_TOLERANCE).sum()),
+            mean_distance=float(distances.mean()),
+            max_distance=float(distances.max())
         )
         
     except Exception as e:
@@ -126,66 +211,190 @@ async def encode_face(request: FaceEncodingRequest):
     Extract face encoding from image
     """
     try:
-        # Decode image
-        image = decode_base64_image(request.image_base64)
-        
-        # Detect faces
-        face_locations = face_recognition.face_locations(
-            image, 
-            model=settings.FACE_DETECTION_MODEL
+        # Detection and encoding run in the face compute pool
+        result = await run_face_task(
+            encode_image,
+            request.image_base64,
+            settings.FACE_DETECTION_MODEL
         )
         
-        if not face_locations:
-            return FaceEncodingResponse(
-                encoding="",
-                face_detected=False,
-                face_count=0
-            )
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(image, face_locations)
-        
-        if not face_encodings:
+        if result["encoding"] is None:
             return FaceEncodingResponse(
                 encoding="",
                 face_detected=False,
-                face_count=len(face_locations)
+                face_count=result["face_count"]
             )
         
         # Encode the first face
-        encoding = encode_face_encoding(face_encodings[0])
+        encoding = encode_face_encoding(result["encoding"])
         
         return FaceEncodingResponse(
             encoding=encoding,
             face_detected=True,
-            face_count=len(face_locations)
+            face_count=result["face_count"]
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Face encoding error: {e}")
         raise HTTPException(status_code=500, detail="Face encoding failed")
 
 
+class BatchEntry:
+    """One image of a batch: base64 text or an uploaded file, or a parse error"""
+
+    def __init__(self, index: int, item_id: Optional[str], payload=None, error: Optional[str] = None):
+        self.index = index
+        self.item_id = item_id
+        self.payload = payload
+        self.error = error
+
+
+async def read_batch(request: Request) -> List[BatchEntry]:
+    """
+    Batch entries of a multipart or NDJSON request
+    
+    Multipart file parts are raw images identified by their filename, text
+    parts base64 images identified by their field name. NDJSON lines are
+    {"id": ..., "image_base64": ...}; a malformed line becomes an entry
+    with an error instead of failing the batch.
+    """
+    max_items = settings.FACE_BATCH_MAX_ITEMS
+    content_type = request.headers.get("content-type", "")
+    entries = []
+    
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form(max_files=max_items, max_fields=max_items)
+        for index, (name, value) in enumerate(form.multi_items()):
+            if isinstance(value, str):
+                entries.append(BatchEntry(index, name, value))
+            else:
+                entries.append(BatchEntry(index, value.filename or name, value))
+        return entries
+    
+    # Read line by line, stopping as soon as a limit is crossed
+    async for _, line in ndjson_lines(request, settings.FACE_BATCH_MAX_BYTES):
+        index = len(entries)
+        if index == max_items:
+            raise HTTPException(status_code=400, detail=f"Batch exceeds {max_items} images")
+        try:
+            item = FaceBatchItem.model_validate_json(line)
+            entries.append(BatchEntry(index, item.id, item.image_base64))
+        except ValidationError as e:
+            entries.append(BatchEntry(index, None, error=e.errors()[0]["msg"]))
+    return entries
+
+
+async def encode_entry(entry: BatchEntry, model: str) -> dict:
+    """Result line of one batch entry; failures are reported, not raised"""
+    result = {"index": entry.index, "id": entry.item_id}
+    if entry.error is not None:
+        return {**result, "error": entry.error}
+    
+    try:
+        if isinstance(entry.payload, str):
+            faces = await face_pool.run(encode_image, entry.payload, model, wait=True)
+        else:
+            faces = await face_pool.run(encode_image, await entry.payload.read(), model, wait=True)
+    except InvalidImage as e:
+        logger.error(f"Error decoding batch image {entry.index}: {e}")
+        return {**result, "error": "Invalid image data"}
+    except Exception as e:
+        logger.error(f"Batch face encoding error on image {entry.index}: {e}")
+        return {**result, "error": "Face encoding failed"}
+    finally:
+        # Release the image as soon as it has been processed
+        entry.payload = None
+    
+    encoding = faces["encoding"]
+    return {
+        **result,
+        "encoding": encode_face_encoding(encoding) if encoding is not None else "",
+        "face_detected": encoding is not None,
+        "face_count": faces["face_count"]
+    }
+
+
+async def encode_entries(entries: List[BatchEntry], model: str, concurrency: int) -> AsyncIterator[dict]:
+    """
+    Yield result lines in completion order, keeping at most ``concurrency``
+    images in the face compute pool
+    """
+    pending = set()
+    try:
+        for entry in entries:
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(encode_entry(entry, model)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Client gone: drop the images still waiting for a worker
+        for task in pending:
+            task.cancel()
+
+
+@router.post("/encode/batch")
+async def encode_face_batch(request: Request):
+    """
+    Extract face encodings from many images
+    
+    Accepts multipart/form-data (one image per part) or NDJSON
+    ({"id": ..., "image_base64": ...} per line, FACE_BATCH_MAX_BYTES at most),
+    at most FACE_BATCH_MAX_ITEMS images. Decoding, detection and encoding run
+    in the face compute pool, each image waiting there for a free slot.
+    The response is NDJSON: one line per image in completion order, carrying
+    its index and id and either the encoding or an error, then a summary line.
+    """
+    started = time.perf_counter()
+    entries = await read_batch(request)
+    concurrency = settings.FACE_BATCH_CONCURRENCY or 2 * face_pool.workers
+    
+    async def body():
+        counts = {"encoded": 0, "no_face": 0, "failed": 0}
+        async for result in encode_entries(entries, settings.FACE_DETECTION_MODEL, concurrency):
+            if "error" in result:
+                counts["failed"] += 1
+            elif result["face_detected"]:
+                counts["encoded"] += 1
+            else:
+                counts["no_face"] += 1
+            yield json.dumps(result) + "\n"
+        
+        yield json.dumps({
+            "total": len(entries),
+            **counts,
+            "timings": {"total_ms": round((time.perf_counter() - started) * 1000, 3)}
+        }) + "\n"
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
 @router.post("/quality", response_model=FaceQualityResponse)
 async def check_face_quality(request: FaceQualityRequest):
     """
     Check face image quality
     """
     try:
-        # Decode image
-        image = decode_base64_image(request.face_data)
+        # Decoding and detection run in the face compute pool
+        faces = await run_face_task(locate_faces, request.face_data)
         
         issues = []
         quality_score = 1.0
         
         # Check image size
-        height, width = image.shape[:2]
+        height, width = faces["height"], faces["width"]
         if width < 200 or height < 200:
             issues.append("Image resolution too low")
             quality_score -= 0.3
         
         # Detect faces
-        face_locations = face_recognition.face_locations(image)
+        face_locations = faces["face_locations"]
         
         if not face_locations:
             issues.append("No face detected")
@@ -212,6 +421,8 @@ async def check_face_quality(request: FaceQualityRequest):
             issues=issues
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Face quality check error: {e}")
         raise HTTPException(status_code=500, detail="Face quality check failed")
@@ -223,15 +434,11 @@ async def detect_spoofing(image_base64: str = Form(...)):
     Detect if image is a spoofing attempt (photo of photo, screen, etc.)
     """
     try:
-        # Decode image
-        image = decode_base64_image(image_base64)
-        
         # Simple spoofing detection based on image analysis
         # In production, use a dedicated anti-spoofing model
         
-        # Check for screen artifacts (simplified)
-        gray = np.mean(image, axis=2)
-        edges = np.abs(np.diff(gray, axis=0)).mean() + np.abs(np.diff(gray, axis=1)).mean()
+        # Check for screen artifacts (simplified), off the event loop
+        edges = await run_face_task(edge_density, image_base64)
         
         # High edge density might indicate a screen
         is_spoof = edges > 50  # Threshold
@@ -242,6 +449,85 @@ async def detect_spoofing(image_base64: str = Form(...)):
             "edge_density": float(edges)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Spoofing detection error: {e}")
         raise HTTPException(status_code=500, detail="Spoofing detection failed")
+
+
+@router.post("/identify")
+async def identify_face(request: FaceIdentifyRequest):
+    """
+    Find the enrolled accounts whose face matches an encoding
+    
+    Returns up to ``limit`` accounts within FACE_RECOGNITION_TOLERANCE,
+    closest first.
+    """
+    if not 1 <= request.limit <= settings.FACE_IDENTIFY_MAX_RESULTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {settings.FACE_IDENTIFY_MAX_RESULTS}"
+        )
+    encoding = decode_face_encoding(request.encoding)
+    
+    try:
+        matches = face_index.identify(encoding, request.limit, exclude_id=request.exclude_user_id)
+        
+        logger.info(f"Face identification: {len(matches)} matches among {len(face_index)} encodings")
+        
+        return {
+            "match": bool(matches),
+            "matches": [
+                {
+                    "user_id": match.user_id,
+                    "distance": match.distance,
+                    "confidence": max(0.0, 1 - match.distance)
+                }
+                for match in matches
+            ],
+            "searched_users": len(face_index),
+            "approximate": face_index.approximate
+        }
+        
+    except Exception as e:
+        logger.error(f"Face identification error: {e}")
+        raise HTTPException(status_code=500, detail="Face identification failed")
+
+
+@router.post("/enroll")
+async def enroll_face(request: FaceEnrollRequest):
+    """
+    Insert or replace a user's reference encodings in the face index
+    """
+    try:
+        face_index.enroll(request.user_id, decode_face_encodings([request.encoding]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"enrolled": request.user_id, "total_users": len(face_index)}
+
+
+@router.delete("/enroll/{user_id}")
+async def remove_face(user_id: int):
+    """
+    Remove a user's encoding from the face index
+    """
+    if not face_index.remove(user_id):
+        raise HTTPException(status_code=404, detail="Face encoding not found")
+    return {"removed": user_id, "total_users": len(face_index)}
+
+
+@router.get("/index/stats")
+async def get_face_index_stats():
+    """
+    Get face index statistics
+    """
+    return face_index.snapshot()
+
+
+@router.get("/pool/stats")
+async def get_face_pool_stats():
+    """
+    Get face compute pool statistics
+    """
+    return face_pool.snapshot()
@@ -2,14 +2,34 @@
 Matching Algorithm API Endpoints
 """
 
+import asyncio
+import json
 import logging
+import math
+import time
+from collections import defaultdict
 from typing import List, Optional
 
 import numpy as np
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, PrivateAttr, ValidationError
 
 from core.config import settings
+from core.database import engine
+from core.ndjson import ndjson_lines
+from engine.batch import BatchScores, location_score, personality_score, score_candidates
+from engine.blocking import overlap_shortlist
+from engine.cache import compatibility_cache
+from engine.features import common_tokens, compile_profile
+from engine.feed import FeedCache, MatchFeed
+from engine.filters import AttributeIndex
+from engine.groups import form_groups
+from engine.match_writer import MatchWriter, WriterBackpressure
+from engine.store import ProfileStore
+from engine.parallel import parallel_top_k, run_in_pool
+from engine.reciprocal import ProfileMatrix, mutual_top_k
+from engine.streaming import StreamingTopK
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +47,35 @@ class UserProfile(BaseModel):
     dream_countries: List[str] = []
     location: Optional[str] = None
     age: Optional[int] = None
+    gender: Optional[str] = None
+    looking_for: Optional[str] = None  # FRIENDSHIP, DATING, PROFESSIONAL, TRAVEL_COMPANION, ALL
+    
+    # Memoized matching data, filled lazily by engine.features / engine.cache
+    _features: Optional[object] = PrivateAttr(default=None)
+    _fingerprint: Optional[str] = PrivateAttr(default=None)
+    
+    def model_copy(self, *, update=None, deep=False):
+        # Memos describe the original content, which update may change
+        copied = super().model_copy(update=update, deep=deep)
+        object.__setattr__(copied, '__pydantic_private__', {'_features': None, '_fingerprint': None})
+        return copied
+    
+    def __getstate__(self):
+        # Features hold process-local vocabulary ids; workers recompile them
+        state = super().__getstate__()
+        state['__pydantic_private__'] = {**(state.get('__pydantic_private__') or {}), '_features': None}
+        return state
+
+
+# Server-resident candidate pool, loaded at startup (see main.lifespan)
+profile_store = ProfileStore(UserProfile)
+
+# First pages of match feeds, dropped whenever the writer touches the user
+feed_cache = FeedCache(settings.MATCHING_FEED_CACHE_SIZE, settings.MATCHING_FEED_CACHE_TTL_SECONDS)
+match_feed = MatchFeed(engine, feed_cache if settings.MATCHING_FEED_CACHE_SIZE > 0 else None)
+
+# Buffered writer persisting results into terrabond_ai.matches
+match_writer = MatchWriter(engine, on_flush=feed_cache.invalidate_rows)
 
 
 class CompatibilityRequest(BaseModel):
@@ -35,13 +84,17 @@ class CompatibilityRequest(BaseModel):
     user2: UserProfile
 
 
-class CompatibilityResponse(BaseModel):
-    """Compatibility calculation response"""
+class CompatibilityScores(BaseModel):
+    """Numeric compatibility scores, without explanations"""
     compatibility_score: float
     personality_compatibility: float
     interests_compatibility: float
     travel_compatibility: float
     location_compatibility: float
+
+
+class CompatibilityResponse(CompatibilityScores):
+    """Compatibility calculation response"""
     match_reasons: List[str]
     common_interests: List[str]
     common_destinations: List[str]
@@ -56,80 +109,59 @@ class MatchingPreferences(BaseModel):
     preferred_destinations: List[str] = []
     languages: List[str] = []
     looking_for: str = "ALL"  # FRIENDSHIP, DATING, PROFESSIONAL, TRAVEL_COMPANION, ALL
+    max_distance_km: Optional[float] = None
+
+
+class ReciprocalRequest(BaseModel):
+    """Users to match with each other, inline or from the profile store"""
+    users: List[UserProfile] = []
+    user_ids: List[int] = []
+
+
+class TravelOffer(BaseModel):
+    """travel_offers fields used for group formation"""
+    id: int
+    max_participants: int
+    current_participants: int = 0
+    destination: Optional[str] = None
+    country: Optional[str] = None
+
+
+class GroupRequest(BaseModel):
+    offer: TravelOffer
+    candidates: List[UserProfile]
+
+
+class MatchStreamHeader(BaseModel):
+    """First line of a streamed find-matches request"""
+    user: UserProfile
+    preferences: Optional[MatchingPreferences] = None
 
 
 def calculate_personality_compatibility(user1: UserProfile, user2: UserProfile) -> float:
     """
     Calculate personality compatibility using MBTI and Big Five traits
     """
-    score = 0.5  # Base score
-    
-    # MBTI compatibility
-    if user1.personality_type and user2.personality_type:
-        mbti1 = user1.personality_type
-        mbti2 = user2.personality_type
-        
-        # Complementary types score higher
-        complementary_pairs = [
-            ('INTJ', 'ENFP'), ('INTJ', 'ENTP'),
-            ('INTP', 'ENFJ'), ('INTP', 'ENTJ'),
-            ('ENTJ', 'INFP'), ('ENTJ', 'INTP'),
-            ('ENTP', 'INFJ'), ('ENTP', 'INTJ'),
-            ('INFJ', 'ENFP'), ('INFJ', 'ENTP'),
-            ('INFP', 'ENFJ'), ('INFP', 'ENTJ'),
-            ('ENFJ', 'INFP'), ('ENFJ', 'ISFP'),
-            ('ENFP', 'INFJ'), ('ENFP', 'INTJ'),
-            ('ISTJ', 'ESFP'), ('ISTJ', 'ESTP'),
-            ('ISFJ', 'ESFP'), ('ISFJ', 'ESTP'),
-            ('ESTJ', 'ISFP'), ('ESTJ', 'ISTP'),
-            ('ESFJ', 'ISFP'), ('ESFJ', 'ISTP'),
-            ('ISTP', 'ESFJ'), ('ISTP', 'ESTJ'),
-            ('ISFP', 'ESFJ'), ('ISFP', 'ESTJ'),
-            ('ESTP', 'ISFJ'), ('ESTP', 'ISTJ'),
-            ('ESFP', 'ISFJ'), ('ESFP', 'ISTJ')
-        ]
-        
-        if (mbti1, mbti2) in complementary_pairs or (mbti2, mbti1) in complementary_pairs:
-            score += 0.3
-        elif mbti1 == mbti2:
-            score += 0.2
-        else:
-            score += 0.1
-    
-    # Big Five traits compatibility
-    if user1.personality_traits and user2.personality_traits:
-        traits1 = user1.personality_traits
-        traits2 = user2.personality_traits
-        
-        # Calculate similarity for each trait
-        trait_diffs = []
-        for trait in ['openness', 'conscientiousness', 'extraversion', 'agreeableness']:
-            if trait in traits1 and trait in traits2:
-                trait_diffs.append(abs(traits1[trait] - traits2[trait]))
-        
-        if trait_diffs:
-            avg_diff = sum(trait_diffs) / len(trait_diffs)
-            score += (1 - avg_diff) * 0.2
-    
-    return min(1.0, score)
+    return personality_score(compile_profile(user1), compile_profile(user2))
 
 
 def calculate_interests_compatibility(user1: UserProfile, user2: UserProfile) -> tuple:
     """
     Calculate interests compatibility and return common interests
     """
-    interests1 = set(user1.interests)
-    interests2 = set(user2.interests)
+    features1 = compile_profile(user1)
+    features2 = compile_profile(user2)
     
-    if not interests1 or not interests2:
+    if not features1.sizes['interests'] or not features2.sizes['interests']:
         return 0.3, []
     
-    common = interests1.intersection(interests2)
-    union = interests1.union(interests2)
+    common_interests = common_tokens(features1, features2, 'interests')
+    common_count = len(common_interests)
+    union_count = features1.sizes['interests'] + features2.sizes['interests'] - common_count
     
-    jaccard_score = len(common) / len(union) if union else 0
+    jaccard_score = common_count / union_count if union_count else 0
     
-    return jaccard_score, list(common)
+    return jaccard_score, common_interests
 
 
 def calculate_travel_compatibility(user1: UserProfile, user2: UserProfile) -> tuple:
@@ -138,37 +170,30 @@ def calculate_travel_compatibility(user1: UserProfile, user2: UserProfile) -> tu
     """
     score = 0.0
     reasons = []
+    features1 = compile_profile(user1)
+    features2 = compile_profile(user2)
     
     # Travel styles compatibility
-    styles1 = set(user1.travel_styles)
-    styles2 = set(user2.travel_styles)
-    
-    if styles1 and styles2:
-        common_styles = styles1.intersection(styles2)
-        if common_styles:
-            score += len(common_styles) / max(len(styles1), len(styles2)) * 0.4
-            reasons.append(f"{len(common_styles)} styles de voyage communs")
+    common_styles = common_tokens(features1, features2, 'travel_styles')
+    if common_styles:
+        common_count = len(common_styles)
+        score += common_count / max(features1.sizes['travel_styles'], features2.sizes['travel_styles']) * 0.4
+        reasons.append(f"{common_count} styles de voyage communs")
     
     # Languages compatibility
-    languages1 = set(user1.languages)
-    languages2 = set(user2.languages)
-    
-    if languages1 and languages2:
-        common_languages = languages1.intersection(languages2)
-        if common_languages:
-            score += len(common_languages) / max(len(languages1), len(languages2)) * 0.3
-            reasons.append(f"{len(common_languages)} langues communes")
+    common_languages = common_tokens(features1, features2, 'languages')
+    if common_languages:
+        common_count = len(common_languages)
+        score += common_count / max(features1.sizes['languages'], features2.sizes['languages']) * 0.3
+        reasons.append(f"{common_count} langues communes")
     
     # Dream destinations compatibility
-    destinations1 = set(user1.dream_countries)
-    destinations2 = set(user2.dream_countries)
-    
-    common_destinations = []
-    if destinations1 and destinations2:
-        common_destinations = list(destinations1.intersection(destinations2))
-        if common_destinations:
-            score += len(common_destinations) / max(len(destinations1), len(destinations2)) * 0.3
-            reasons.append(f"{len(common_destinations)} destinations de rêve communes")
+    common_destinations = common_tokens(features1, features2, 'dream_countries')
+    if common_destinations:
+        score += len(common_destinations) / max(
+            features1.sizes['dream_countries'], features2.sizes['dream_countries']
+        ) * 0.3
+        reasons.append(f"{len(common_destinations)} destinations de rêve communes")
     
     return min(1.0, score), reasons, common_destinations
 
@@ -177,17 +202,44 @@ def calculate_location_compatibility(user1: UserProfile, user2: UserProfile) ->
     """
     Calculate location compatibility
     """
-    if not user1.location or not user2.location:
-        return 0.5
+    return location_score(compile_profile(user1), compile_profile(user2))
+
+
+def build_compatibility_response(
+    overall_score: float,
+    personality_score: float,
+    interests_score: float,
+    travel_score: float,
+    location_score: float,
+    travel_reasons: List[str],
+    common_interests: List[str],
+    common_destinations: List[str]
+) -> CompatibilityResponse:
+    """
+    Build the API response (rounded scores and match reasons) from raw scores
+    """
+    # Generate match reasons
+    match_reasons = travel_reasons.copy()
     
-    if user1.location == user2.location:
-        return 1.0
+    if personality_score > 0.7:
+        match_reasons.append("Personnalités complémentaires")
     
-    # Same country check (simplified)
-    if user1.location.split(',')[-1].strip() == user2.location.split(',')[-1].strip():
-        return 0.7
+    if interests_score > 0.5:
+        match_reasons.append(f"{len(common_interests)} intérêts communs")
     
-    return 0.3
+    if location_score > 0.5:
+        match_reasons.append("Proximité géographique")
+    
+    return CompatibilityResponse(
+        compatibility_score=round(overall_score * 100, 2),
+        personality_compatibility=round(personality_score * 100, 2),
+        interests_compatibility=round(interests_score * 100, 2),
+        travel_compatibility=round(travel_score * 100, 2),
+        location_compatibility=round(location_score * 100, 2),
+        match_reasons=match_reasons,
+        common_interests=common_interests,
+        common_destinations=common_destinations
+    )
 
 
 @router.post("/compatibility", response_model=CompatibilityResponse)
@@ -195,6 +247,11 @@ async def calculate_compatibility(request: CompatibilityRequest):
     """
     Calculate compatibility score between two users
     """
+    if settings.MATCHING_CACHE_ENABLED:
+        cached = await compatibility_cache.get(request.user1, request.user2)
+        if cached is not None:
+            return CompatibilityResponse(**cached)
+    
     try:
         # Calculate individual compatibility scores
         personality_score = calculate_personality_compatibility(request.user1, request.user2)
@@ -212,67 +269,660 @@ async def calculate_compatibility(request: CompatibilityRequest):
             location_score * settings.MATCHING_WEIGHT_LOCATION
         )
         
-        # Generate match reasons
-        match_reasons = travel_reasons.copy()
-        
-        if personality_score > 0.7:
-            match_reasons.append("Personnalités complémentaires")
-        
-        if interests_score > 0.5:
-            match_reasons.append(f"{len(common_interests)} intérêts communs")
-        
-        if location_score > 0.5:
-            match_reasons.append("Proximité géographique")
-        
-        return CompatibilityResponse(
-            compatibility_score=round(overall_score * 100, 2),
-            personality_compatibility=round(personality_score * 100, 2),
-            interests_compatibility=round(interests_score * 100, 2),
-            travel_compatibility=round(travel_score * 100, 2),
-            location_compatibility=round(location_score * 100, 2),
-            match_reasons=match_reasons,
-            common_interests=common_interests,
-            common_destinations=common_destinations
+        response = build_compatibility_response(
+            overall_score, personality_score, interests_score, travel_score, location_score,
+            travel_reasons, common_interests, common_destinations
         )
         
     except Exception as e:
         logger.error(f"Compatibility calculation error: {e}")
         raise HTTPException(status_code=500, detail="Compatibility calculation failed")
+    
+    if settings.MATCHING_CACHE_ENABLED:
+        await compatibility_cache.set(request.user1, request.user2, response.model_dump())
+    
+    return response
+
+
+def explain_match(user: UserProfile, candidate: UserProfile, scores: BatchScores, position: int) -> CompatibilityResponse:
+    """
+    Build the full response (reasons, common items) for one batch-scored candidate
+    """
+    _, common_interests = calculate_interests_compatibility(user, candidate)
+    _, travel_reasons, common_destinations = calculate_travel_compatibility(user, candidate)
+    
+    return build_compatibility_response(
+        float(scores.total[position]),
+        float(scores.personality[position]),
+        float(scores.interests[position]),
+        float(scores.travel[position]),
+        float(scores.location[position]),
+        travel_reasons,
+        common_interests,
+        common_destinations
+    )
+
+
+def match_scores(scores: BatchScores, position: int) -> CompatibilityScores:
+    """
+    Rounded numeric scores for one batch-scored candidate
+    """
+    return CompatibilityScores(
+        compatibility_score=round(float(scores.total[position]) * 100, 2),
+        personality_compatibility=round(float(scores.personality[position]) * 100, 2),
+        interests_compatibility=round(float(scores.interests[position]) * 100, 2),
+        travel_compatibility=round(float(scores.travel[position]) * 100, 2),
+        location_compatibility=round(float(scores.location[position]) * 100, 2)
+    )
+
+
+async def rank_matches(
+    user: UserProfile,
+    pool: List[UserProfile],
+    limit: int,
+    include_explanations: bool = True
+) -> tuple:
+    """
+    Score a user against a candidate pool and build the top matches
+    
+    Returns the matches and the number of candidates that were fully scored.
+    Without explanations, matches only carry the numeric scores.
+    """
+    # Vectorized top-k: candidates whose upper bound cannot reach the
+    # current k-th score are never fully scored. Pools above
+    # MATCHING_SHARD_SIZE are sharded over the matching process pool,
+    # smaller ones are ranked in a thread.
+    result = await parallel_top_k(user, pool, limit)
+    ranked = [pool[index] for index in result.indices]
+    
+    return build_matches(user, ranked, result.scores, include_explanations), result.scored
+
+
+def build_matches(
+    user: UserProfile,
+    ranked: List[UserProfile],
+    scores: BatchScores,
+    include_explanations: bool = True
+) -> List[dict]:
+    """
+    Build match entries for ranked candidates and their batch scores
+    """
+    matches = []
+    
+    # Only the returned candidates need reasons and common items
+    for rank, candidate in enumerate(ranked):
+        if include_explanations:
+            compatibility = explain_match(user, candidate, scores, rank)
+        else:
+            compatibility = match_scores(scores, rank)
+        matches.append({"user_id": candidate.id, "compatibility": compatibility})
+    
+    return matches
+
+
+def without_explanations(matches: List[dict]) -> List[dict]:
+    """
+    Drop reasons and common items from explained matches
+    """
+    return [
+        {
+            "user_id": match["user_id"],
+            "compatibility": CompatibilityScores(**match["compatibility"].model_dump(
+                include=set(CompatibilityScores.model_fields)
+            ))
+        }
+        for match in matches
+    ]
+
+
+async def persist_matches(user_id: int, matches: List[dict]) -> None:
+    """
+    Queue match results for the matches table
+    """
+    try:
+        for match in matches:
+            await match_writer.put(
+                user_id, match["user_id"], match["compatibility"],
+                timeout=settings.MATCHING_WRITER_PUT_TIMEOUT
+            )
+    except WriterBackpressure as e:
+        logger.warning(f"Match persistence backlog: {e}")
+        raise HTTPException(status_code=503, detail="Match persistence backlog, retry later")
+
+
+async def finish_matches(user_id: int, matches: List[dict], persist: bool, include_explanations: bool) -> List[dict]:
+    """
+    Queue matches for the matches table when asked, and return them with
+    explanations only if they were requested
+    """
+    if persist:
+        await persist_matches(user_id, matches)
+        if not include_explanations:
+            matches = without_explanations(matches)
+    return matches
+
+
+def check_preferences(user: UserProfile, preferences: Optional[MatchingPreferences]) -> None:
+    """
+    Reject preferences that cannot be applied to this user
+    """
+    if preferences is not None and preferences.max_distance_km is not None:
+        if math.isnan(compile_profile(user).latitude):
+            raise HTTPException(status_code=400, detail="User location could not be resolved")
+
+
+def narrow_pool(
+    user: UserProfile,
+    candidates: List[UserProfile],
+    min_overlap: int,
+    preferences: Optional[MatchingPreferences]
+) -> tuple:
+    """
+    Drop the user, then candidates sharing fewer than min_overlap tokens
+    with them (when min_overlap > 0) and candidates not satisfying the
+    preferences
+    
+    Returns the remaining pool and the numbers of pruned and filtered candidates.
+    """
+    pool = [candidate for candidate in candidates if candidate.id != user.id]
+    pruned = filtered = 0
+    
+    if pool and min_overlap > 0:
+        shortlist = overlap_shortlist(
+            compile_profile(user), [compile_profile(candidate) for candidate in pool], min_overlap
+        )
+        pruned = len(pool) - len(shortlist)
+        pool = [pool[position] for position in shortlist]
+    
+    if pool and preferences is not None:
+        allowed = AttributeIndex(pool).mask(preferences, user)
+        filtered = len(pool) - int(allowed.sum())
+        pool = [candidate for candidate, keep in zip(pool, allowed) if keep]
+    
+    return pool, pruned, filtered
+
+
+def unique_profiles(profiles: List[UserProfile]) -> List[UserProfile]:
+    """
+    Profiles in order, keeping the first one of each id
+    """
+    unique, seen = [], set()
+    for profile in profiles:
+        if profile.id not in seen:
+            seen.add(profile.id)
+            unique.append(profile)
+    return unique
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 3)
 
 
 @router.post("/find-matches")
-async def find_matches(user: UserProfile, candidates: List[UserProfile], limit: int = 10):
+async def find_matches(
+    user: UserProfile,
+    candidates: List[UserProfile],
+    limit: int = 10,
+    min_overlap: int = 0,
+    persist: bool = False,
+    preferences: Optional[MatchingPreferences] = None,
+    include_explanations: bool = True
+):
     """
     Find best matches for a user from a list of candidates
+    
+    When min_overlap > 0, candidates sharing fewer interests, travel styles,
+    languages or dream countries with the user are pruned before scoring. Candidates not satisfying the optional
+    preferences are filtered out before scoring as well. With persist=true
+    the returned matches are also queued for the matches table, and with
+    include_explanations=false they only carry numeric scores.
     """
     try:
-        matches = []
+        started = time.perf_counter()
+        check_preferences(user, preferences)
+        pool, pruned, filtered = narrow_pool(user, candidates, min_overlap, preferences)
+        if pruned:
+            logger.info(f"Blocking pruned {pruned} candidates (min_overlap={min_overlap})")
+        filter_ms = elapsed_ms(started)
         
-        for candidate in candidates:
-            if candidate.id == user.id:
-                continue
-            
-            request = CompatibilityRequest(user1=user, user2=candidate)
-            compatibility = await calculate_compatibility(request)
-            
-            matches.append({
-                "user_id": candidate.id,
-                "compatibility": compatibility
-            })
+        started = time.perf_counter()
+        # Persisted rows always need their reasons and common items
+        matches, scored = await rank_matches(user, pool, limit, include_explanations or persist)
+        scoring_ms = elapsed_ms(started)
+        matches = await finish_matches(user.id, matches, persist, include_explanations)
         
-        # Sort by compatibility score
-        matches.sort(key=lambda x: x["compatibility"].compatibility_score, reverse=True)
+        return {
+            "matches": matches,
+            "total_candidates": len(candidates),
+            "pruned_candidates": pruned,
+            "filtered_candidates": filtered,
+            "scored_candidates": scored,
+            "timings": {"filter_ms": filter_ms, "scoring_ms": scoring_ms}
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Find matches error: {e}")
+        raise HTTPException(status_code=500, detail="Find matches failed")
+
+
+def parse_line(model, number: int, line: bytes):
+    try:
+        return model.model_validate_json(line)
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise HTTPException(status_code=400, detail=f"Line {number}: {error['msg']}")
+
+
+@router.post("/find-matches/stream")
+async def find_matches_stream(
+    request: Request,
+    limit: int = 10,
+    min_overlap: int = 0,
+    persist: bool = False,
+    include_explanations: bool = True
+):
+    """
+    Find best matches for a user from candidates sent as NDJSON
+    
+    The first line holds the user and optional preferences
+    ({"user": ..., "preferences": ...}), every following line one candidate
+    profile. Candidates are ranked in chunks of MATCHING_STREAM_CHUNK_SIZE,
+    in a thread, while they are read, keeping only the current top matches. The
+    response is NDJSON too: a summary line, then one line per match.
+    """
+    lines = ndjson_lines(request, settings.MATCHING_STREAM_MAX_BYTES, settings.MATCHING_STREAM_MAX_LINE_BYTES)
+    header = None
+    async for number, line in lines:
+        header = parse_line(MatchStreamHeader, number, line)
+        break
+    if header is None:
+        raise HTTPException(status_code=400, detail="Missing user line")
+    user, preferences = header.user, header.preferences
+    check_preferences(user, preferences)
+    
+    try:
+        started = time.perf_counter()
+        ranking = StreamingTopK(user, limit)
+        total = pruned = filtered = 0
+        
+        def rank_chunk(chunk: List[UserProfile]) -> None:
+            nonlocal pruned, filtered
+            pool, chunk_pruned, chunk_filtered = narrow_pool(user, chunk, min_overlap, preferences)
+            pruned += chunk_pruned
+            filtered += chunk_filtered
+            ranking.push(pool)
+        
+        chunk = []
+        async for number, line in lines:
+            chunk.append(parse_line(UserProfile, number, line))
+            if len(chunk) >= settings.MATCHING_STREAM_CHUNK_SIZE:
+                total += len(chunk)
+                await asyncio.to_thread(rank_chunk, chunk)
+                chunk = []
+        total += len(chunk)
+        await asyncio.to_thread(rank_chunk, chunk)
+        
+        ranked, scores = ranking.result()
+        # Persisted rows always need their reasons and common items
+        matches = build_matches(user, ranked, scores, include_explanations or persist)
+        matches = await finish_matches(user.id, matches, persist, include_explanations)
+        
+        summary = {
+            "total_candidates": total,
+            "pruned_candidates": pruned,
+            "filtered_candidates": filtered,
+            "scored_candidates": ranking.scored,
+            "timings": {"total_ms": elapsed_ms(started)}
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Find matches stream error: {e}")
+        raise HTTPException(status_code=500, detail="Find matches failed")
+    
+    def body():
+        yield json.dumps(summary) + "\n"
+        for match in matches:
+            yield json.dumps({
+                "user_id": match["user_id"],
+                "compatibility": match["compatibility"].model_dump()
+            }) + "\n"
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.post("/find-matches/reciprocal")
+async def find_reciprocal_matches(
+    request: ReciprocalRequest,
+    limit: int = 10,
+    persist: bool = False,
+    include_explanations: bool = True
+):
+    """
+    Find the pairs of users that are in each other's top matches
+    
+    Every user is ranked against all the others (inline users first, then
+    user_ids, in order); a pair is returned when each side has the other
+    among its best ``limit`` matches. Each pair is scored once, through
+    blocked pairwise computation. With persist=true the pairs are queued
+    for the matches table.
+    """
+    users = list(request.users)
+    for user_id in request.user_ids:
+        profile = profile_store.get_profile(user_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"User profile {user_id} not found")
+        users.append(profile)
+    
+    try:
+        started = time.perf_counter()
+        pool = unique_profiles(users)
+        # Keep pairwise scoring off the event loop; worker processes only
+        # receive the matrix columns
+        if len(pool) > settings.MATCHING_RECIPROCAL_PROCESS_SIZE:
+            matrix = await asyncio.to_thread(ProfileMatrix, pool)
+            result = await run_in_pool(mutual_top_k, matrix, limit)
+        else:
+            result = await asyncio.to_thread(mutual_top_k, pool, limit)
+        scoring_ms = elapsed_ms(started)
+        
+        partners = defaultdict(list)
+        for (first, second), ranks in zip(result.pairs.tolist(), result.ranks.tolist()):
+            partners[first].append((second, ranks))
+        
+        pairs = []
+        for first, entries in partners.items():
+            user = pool[first]
+            ranked = [pool[second] for second, _ in entries]
+            # Persisted rows always need their reasons and common items
+            matches = build_matches(
+                user, ranked, score_candidates(user, ranked), include_explanations or persist
+            )
+            matches = await finish_matches(user.id, matches, persist, include_explanations)
+            for match, (_, (rank1, rank2)) in zip(matches, entries):
+                pairs.append({
+                    "user1_id": user.id,
+                    "user2_id": match["user_id"],
+                    "rank1": rank1 + 1,
+                    "rank2": rank2 + 1,
+                    "compatibility": match["compatibility"]
+                })
         
         return {
-            "matches": matches[:limit],
-            "total_candidates": len(candidates)
+            "pairs": pairs,
+            "total_users": len(pool),
+            "scored_pairs": result.scored,
+            "timings": {"scoring_ms": scoring_ms}
         }
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Reciprocal matching error: {e}")
+        raise HTTPException(status_code=500, detail="Reciprocal matching failed")
+
+
+async def find_matches_in_store(
+    user_id: int,
+    limit: int,
+    min_overlap: int,
+    persist: bool,
+    ann: bool,
+    preferences: Optional[MatchingPreferences] = None,
+    include_explanations: bool = True
+) -> dict:
+    """
+    Rank the server-resident pool for a stored user
+    """
+    user = profile_store.get(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User profile not found")
+    if ann and profile_store.ann is None:
+        raise HTTPException(status_code=400, detail="ANN index disabled")
+    check_preferences(user, preferences)
+    
+    try:
+        started = time.perf_counter()
+        total = len(profile_store) - 1
+        if ann:
+            pool = profile_store.nearest(
+                user,
+                max(settings.MATCHING_ANN_CANDIDATES, limit),
+                exclude_id=user_id,
+                min_overlap=min_overlap,
+                preferences=preferences
+            )
+        else:
+            pool = profile_store.candidates(
+                exclude_id=user_id, min_overlap=min_overlap, user=user, preferences=preferences
+            )
+        filter_ms = elapsed_ms(started)
+        
+        started = time.perf_counter()
+        # Persisted rows always need their reasons and common items
+        matches, scored = await rank_matches(user, pool, limit, include_explanations or persist)
+        scoring_ms = elapsed_ms(started)
+        matches = await finish_matches(user.id, matches, persist, include_explanations)
+        
+        return {
+            "matches": matches,
+            "total_candidates": total,
+            "pruned_candidates": total - len(pool),
+            "scored_candidates": scored,
+            "timings": {"filter_ms": filter_ms, "scoring_ms": scoring_ms}
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Find matches error: {e}")
         raise HTTPException(status_code=500, detail="Find matches failed")
 
 
+@router.get("/find-matches/{user_id}")
+async def find_matches_for_user(
+    user_id: int,
+    limit: int = 10,
+    min_overlap: int = 0,
+    persist: bool = False,
+    ann: bool = False,
+    include_explanations: bool = True
+):
+    """
+    Find best matches for a stored user against the server-resident pool.
+    With ann=true only the MATCHING_ANN_CANDIDATES nearest profiles from
+    the ANN index are scored.
+    """
+    return await find_matches_in_store(
+        user_id, limit, min_overlap, persist, ann, include_explanations=include_explanations
+    )
+
+
+@router.post("/find-matches/{user_id}")
+async def find_matches_for_user_with_preferences(
+    user_id: int,
+    preferences: MatchingPreferences,
+    limit: int = 10,
+    min_overlap: int = 0,
+    persist: bool = False,
+    ann: bool = False,
+    include_explanations: bool = True
+):
+    """
+    Same as GET /find-matches/{user_id}, with candidates pre-filtered on
+    the given matching preferences before scoring
+    """
+    return await find_matches_in_store(
+        user_id, limit, min_overlap, persist, ann, preferences, include_explanations
+    )
+
+
+@router.post("/groups")
+async def form_travel_groups(
+    request: GroupRequest,
+    max_groups: Optional[int] = Query(None, ge=1),
+    time_budget_ms: Optional[float] = None
+):
+    """
+    Propose groups of compatible travellers for a travel offer
+    
+    The candidates are split into disjoint groups filling the offer's free
+    seats (max_participants - current_participants), maximizing the mean
+    pairwise compatibility inside each group. Greedy groups are improved
+    by local search for at most time_budget_ms (default
+    MATCHING_GROUP_TIME_BUDGET_MS), then the best groups found so far are
+    returned; converged tells whether the search reached a local optimum.
+    """
+    offer = request.offer
+    seats = offer.max_participants - offer.current_participants
+    if seats <= 0:
+        raise HTTPException(status_code=400, detail="Travel offer is full")
+    pool = unique_profiles(request.candidates)
+    if len(pool) > settings.MATCHING_GROUP_MAX_POOL:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many candidates (max {settings.MATCHING_GROUP_MAX_POOL})"
+        )
+    
+    try:
+        started = time.perf_counter()
+        # CPU-bound, bounded by the time budget: keep it off the event loop
+        result = await asyncio.to_thread(form_groups, pool, seats, max_groups, time_budget_ms)
+        
+        groups = [
+            {
+                "user_ids": [pool[position].id for position in members],
+                "mean_compatibility": round(float(score) * 100, 2)
+            }
+            for members, score in zip(result.groups, result.scores)
+        ]
+        
+        return {
+            "offer_id": offer.id,
+            "group_size": min(seats, len(pool)),
+            "groups": groups,
+            "unassigned": len(pool) - sum(len(members) for members in result.groups),
+            "iterations": result.iterations,
+            "converged": result.converged,
+            "timings": {"total_ms": elapsed_ms(started)}
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Group formation error: {e}")
+        raise HTTPException(status_code=500, detail="Group formation failed")
+
+
+@router.put("/profiles")
+async def upsert_profiles(profiles: List[UserProfile]):
+    """
+    Insert or update profiles in the server-resident pool
+    """
+    count = profile_store.upsert_many(profiles)
+    return {"upserted": count, "total_profiles": len(profile_store)}
+
+
+@router.delete("/profiles/{user_id}")
+async def delete_profile(user_id: int):
+    """
+    Remove a profile from the server-resident pool
+    """
+    if not profile_store.delete(user_id):
+        raise HTTPException(status_code=404, detail="User profile not found")
+    return {"deleted": user_id, "total_profiles": len(profile_store)}
+
+
+@router.get("/profiles/stats")
+async def get_profile_store_stats():
+    """
+    Get server-resident pool statistics
+    """
+    return {
+        "loaded": profile_store.loaded,
+        "total_profiles": len(profile_store),
+        "ann_profiles": len(profile_store.ann) if profile_store.ann is not None else 0
+    }
+
+
+@router.get("/profiles/{user_id}", response_model=UserProfile)
+async def get_profile(user_id: int):
+    """
+    Get a profile from the server-resident pool
+    """
+    profile = profile_store.get_profile(user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User profile not found")
+    return profile
+
+
+@router.get("/ann/recall")
+async def get_ann_recall(
+    k: int = Query(10, ge=1, le=settings.MATCHING_ANN_CANDIDATES),
+    queries: int = Query(100, ge=1, le=1000),
+    probes: Optional[int] = Query(None, ge=1)
+):
+    """
+    Measure ANN recall@k against brute force on sampled stored profiles
+    
+    Every query is an exact scan of the store, so the work runs in a thread.
+    """
+    if profile_store.ann is None:
+        raise HTTPException(status_code=400, detail="ANN index disabled")
+    return await asyncio.to_thread(profile_store.ann.recall, k, queries=queries, probes=probes)
+
+
+@router.get("/feed/{user_id}")
+async def get_match_feed(user_id: int, limit: int = 20, cursor: Optional[str] = None):
+    """
+    Page through a user's persisted matches, best first
+    
+    Matches come from the matches table only (never scored live), ordered
+    by compatibility_score DESC, id. Pass the returned next_cursor to get
+    the following page; it is null on the last page.
+    """
+    if not 1 <= limit <= settings.MATCHING_FEED_MAX_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {settings.MATCHING_FEED_MAX_LIMIT}"
+        )
+    
+    try:
+        return await match_feed.page(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Match feed error: {e}")
+        raise HTTPException(status_code=500, detail="Match feed failed")
+
+
+@router.get("/feed-cache/stats")
+async def get_feed_cache_stats():
+    """
+    Get match feed first-page cache statistics
+    """
+    return feed_cache.snapshot()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get compatibility cache hit/miss counters
+    """
+    return compatibility_cache.snapshot()
+
+
+@router.get("/writer/stats")
+async def get_writer_stats():
+    """
+    Get match persistence buffer statistics
+    """
+    return match_writer.snapshot()
+
+
 @router.get("/criteria")
 async def get_matching_criteria():
     """
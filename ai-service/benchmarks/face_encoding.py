@@ -0,0 +1,120 @@
+"""
+Face encoding format benchmark
+
+Encodes seeded synthetic face encodings in every format of
+engine/face_encoding.py and reports, per format, the stored size, the
+encode/decode time, the drift of pairwise distances against float64, and
+the verification accuracy at FACE_RECOGNITION_TOLERANCE (plus decisions
+flipped compared with float64).
+
+dlib is not needed: identities are random 128-d centers and samples are
+noisy copies, scaled so same-person distances mostly sit around 0.4 and
+different-person distances around 0.9, like face_recognition encodings.
+
+Usage (from ai-service/):
+    python -m benchmarks.face_encoding [--identities 1000] [--samples 4] [--seed 42]
+
+Exits with status 1 when the legacy float64 format does not round-trip
+exactly.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from core.config import settings
+from engine.face_encoding import FACE_ENCODING_SIZE, FORMATS, LEGACY_FORMAT, format_encoding, parse_encoding
+
+# Per-dimension spread of identity centers and (median) of samples around
+# them; the sample spread varies per identity so that some genuine pairs
+# land near the tolerance, like poorly lit or aged photos
+CENTER_SCALE = 0.056
+SAMPLE_SCALE = 0.025
+SAMPLE_SCALE_SIGMA = 0.35
+
+
+def synthetic_encodings(identities: int, samples: int, seed: int) -> np.ndarray:
+    """(identities, samples, 128) encodings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, CENTER_SCALE, (identities, 1, FACE_ENCODING_SIZE))
+    spread = rng.lognormal(np.log(SAMPLE_SCALE), SAMPLE_SCALE_SIGMA, (identities, 1, 1))
+    return centers + spread * rng.normal(0, 1, (identities, samples, FACE_ENCODING_SIZE))
+
+
+def pairs(identities: int, samples: int, seed: int) -> tuple:
+    """(first, second, same person) flat sample indices: all genuine pairs and as many impostor pairs"""
+    first, second = np.triu_indices(samples, 1)
+    offsets = np.arange(identities)[:, None] * samples
+    genuine_first = (offsets + first).ravel()
+    genuine_second = (offsets + second).ravel()
+
+    rng = np.random.default_rng(seed + 1)
+    impostor_first = rng.integers(identities * samples, size=len(genuine_first))
+    impostor_second = rng.integers(identities * samples, size=len(genuine_first))
+    different = impostor_first // samples != impostor_second // samples
+    impostor_first, impostor_second = impostor_first[different], impostor_second[different]
+
+    return (
+        np.concatenate([genuine_first, impostor_first]),
+        np.concatenate([genuine_second, impostor_second]),
+        np.concatenate([np.ones(len(genuine_first), bool), np.zeros(len(impostor_first), bool)])
+    )
+
+
+def round_trip(encodings: np.ndarray, encoding_format: str) -> tuple:
+    """(decoded encodings, base64 texts, encode us, decode us) for one format"""
+    started = time.perf_counter()
+    texts = [format_encoding(encoding, encoding_format) for encoding in encodings]
+    encode_us = (time.perf_counter() - started) / len(encodings) * 1e6
+
+    started = time.perf_counter()
+    decoded = np.stack([parse_encoding(text) for text in texts])
+    decode_us = (time.perf_counter() - started) / len(encodings) * 1e6
+    return decoded, texts, encode_us, decode_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Size and distance drift of face encoding formats")
+    parser.add_argument("--identities", type=int, default=1000)
+    parser.add_argument("--samples", type=int, default=4, help="encodings per identity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tolerance", type=float, default=settings.FACE_RECOGNITION_TOLERANCE)
+    args = parser.parse_args()
+
+    encodings = synthetic_encodings(args.identities, args.samples, args.seed).reshape(-1, FACE_ENCODING_SIZE)
+    first, second, same = pairs(args.identities, args.samples, args.seed)
+    reference = np.linalg.norm(encodings[first] - encodings[second], axis=1)
+    reference_match = reference <= args.tolerance
+    print(
+        f"{len(encodings)} encodings, {same.sum()} genuine and {(~same).sum()} impostor pairs, "
+        f"tolerance {args.tolerance}"
+    )
+    print(
+        f"{'format':<8} {'bytes':>6} {'text':>6} {'encode us':>10} {'decode us':>10} "
+        f"{'max drift':>10} {'p99 drift':>10} {'accuracy':>9} {'flipped':>8}"
+    )
+
+    failed = False
+    for encoding_format in FORMATS:
+        decoded, texts, encode_us, decode_us = round_trip(encodings, encoding_format)
+        distances = np.linalg.norm(decoded[first] - decoded[second], axis=1)
+        drift = np.abs(distances - reference)
+        match = distances <= args.tolerance
+        text_size = len(texts[0])
+        payload_size = len(texts[0]) * 3 // 4 - texts[0].count('=')
+        print(
+            f"{encoding_format:<8} {payload_size:>6} {text_size:>6} {encode_us:>10.1f} {decode_us:>10.1f} "
+            f"{drift.max():>10.2e} {np.percentile(drift, 99):>10.2e} "
+            f"{(match == same).mean():>9.2%} {int((match != reference_match).sum()):>8}"
+        )
+        if encoding_format == LEGACY_FORMAT and not np.array_equal(decoded, encodings):
+            print("legacy: float64 encodings do not round-trip exactly")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
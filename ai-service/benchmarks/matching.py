@@ -0,0 +1,231 @@
+"""
+Matching benchmark
+
+Times calculate_compatibility per pair and find_matches at several pool
+sizes on seeded synthetic profiles, measures the peak traced memory of
+find_matches, checks that the batch path ranks and scores exactly like
+the original per-pair scorers (benchmarks/reference.py), and compares
+everything against a baseline JSON. Runs offline: the compatibility cache
+is disabled and nothing touches the database.
+
+Absolute timings depend on the host, so the baseline keeps each pool
+size's speedup (per-pair time for the whole pool / find_matches time)
+rather than milliseconds, and timing changes are only reported.
+
+Pools are ranked in-process (sharding off). With --shard-size, pools
+larger than it are also ranked sharded over the matching process pool, to
+tune MATCHING_SHARD_SIZE for this host.
+
+Usage (from ai-service/):
+    python -m benchmarks.matching [--sizes 1000 10000 100000] [--seed 42]
+        [--shard-size 20000] [--baseline benchmarks/baseline.json] [--update-baseline]
+
+Exits with status 1 when the top matches differ from the baseline or when
+batch and reference (or sharded and in-process) results disagree. A
+speedup more than --tolerance below the baseline is printed as a warning.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from core.config import settings
+from api.matching import CompatibilityRequest, calculate_compatibility, find_matches
+from benchmarks import reference
+from benchmarks.synthetic import generate_profiles
+from engine.features import feature_cache
+from engine.parallel import shutdown_pool
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def time_pairs(user, candidates, repeat: int) -> float:
+    """Best-of-repeat microseconds per calculate_compatibility call, after one warm-up pass"""
+    async def run():
+        for candidate in candidates:
+            await calculate_compatibility(CompatibilityRequest(user1=user, user2=candidate))
+
+    # Compiles the profiles and warms the interpreter caches
+    asyncio.run(run())
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        asyncio.run(run())
+        runs.append((time.perf_counter() - started) / len(candidates) * 1e6)
+    return min(runs)
+
+
+def time_find_matches(user, candidates, limit: int, repeat: int) -> tuple:
+    """(best-of-repeat milliseconds, last result) of find_matches, after one warm-up call"""
+    result = asyncio.run(find_matches(user, candidates, limit))
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = asyncio.run(find_matches(user, candidates, limit))
+        runs.append((time.perf_counter() - started) * 1000)
+    return min(runs), result
+
+
+def peak_memory_mb(user, candidates, limit: int) -> float:
+    """Peak traced memory of one find_matches call (worker processes excluded)"""
+    tracemalloc.start()
+    asyncio.run(find_matches(user, candidates, limit))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def per_pair_top(user, candidates, limit: int) -> list:
+    """Legacy ranking: reference scorers per pair, stable sort on the score"""
+    scored = [(candidate.id, reference.compatibility(user, candidate)) for candidate in candidates]
+    scored.sort(key=lambda item: item[1]["compatibility_score"], reverse=True)
+    return scored[:limit]
+
+
+def check_parity(user, candidates, limit: int) -> bool:
+    """
+    Whether find_matches ranks and scores like the reference scorers.
+    Locations are compared as strings there, so geo scoring is turned off
+    and the profiles are compiled afresh.
+    """
+    geo_enabled = settings.MATCHING_GEO_ENABLED
+    settings.MATCHING_GEO_ENABLED = False
+    feature_cache.clear()
+    try:
+        user = user.model_copy()
+        candidates = [candidate.model_copy() for candidate in candidates]
+        for profile in [user] + candidates:
+            profile.__pydantic_private__.pop('_features', None)
+        batch = asyncio.run(find_matches(user, candidates, limit))
+    finally:
+        settings.MATCHING_GEO_ENABLED = geo_enabled
+        feature_cache.clear()
+
+    batch_top = []
+    for match in batch["matches"]:
+        response = match["compatibility"].model_dump()
+        response["common_interests"] = sorted(response["common_interests"])
+        response["common_destinations"] = sorted(response["common_destinations"])
+        batch_top.append((match["user_id"], response))
+    return batch_top == per_pair_top(user, candidates, limit)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> tuple:
+    """
+    (problems, warnings) against the baseline: differing top matches are
+    problems, speedups more than ``tolerance`` below the baseline warnings
+    """
+    problems, warnings = [], []
+    if baseline.get('seed') != results['seed'] or baseline.get('limit') != results['limit']:
+        return [f"baseline was recorded with seed={baseline.get('seed')} limit={baseline.get('limit')}"], []
+
+    for size, entry in results['find_matches'].items():
+        previous = baseline.get('find_matches', {}).get(size)
+        if previous is None:
+            continue
+        if entry['top'] != previous['top']:
+            problems.append(f"find_matches {size}: top matches differ from baseline")
+        if previous.get('speedup') and entry['speedup'] < previous['speedup'] * (1 - tolerance):
+            warnings.append(
+                f"find_matches {size}: {entry['speedup']:.1f}x per-pair vs baseline {previous['speedup']:.1f}x"
+            )
+    return problems, warnings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Matching benchmark on synthetic profiles")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--pairs", type=int, default=2000, help="pairs timed with calculate_compatibility")
+    parser.add_argument("--parity-size", type=int, default=1000, help="pool checked against the per-pair path")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--shard-size", type=int, default=0, help="also time sharded ranking at this shard size")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="speedup drop vs baseline that is reported")
+    args = parser.parse_args()
+
+    # Measure computation, not cache hits, and stay offline
+    settings.MATCHING_CACHE_ENABLED = False
+    settings.MATCHING_SHARD_SIZE = 0
+
+    user = generate_profiles(1, args.seed + 1, start_id=0)[0]
+    pool_size = max(args.sizes + [args.pairs, args.parity_size])
+    candidates = generate_profiles(pool_size, args.seed)
+
+    results = {"seed": args.seed, "limit": args.limit, "find_matches": {}}
+    us_per_pair = time_pairs(user, candidates[:args.pairs], args.repeat)
+    print(f"calculate_compatibility: {us_per_pair:.1f} us/pair")
+
+    failed = False
+    if not check_parity(user, candidates[:args.parity_size], args.limit):
+        print(f"parity: find_matches differs from the reference scorers on {args.parity_size} candidates")
+        failed = True
+    else:
+        print(f"parity: find_matches matches the reference scorers on {args.parity_size} candidates")
+
+    try:
+        for size in args.sizes:
+            pool = candidates[:size]
+            elapsed, result = time_find_matches(user, pool, args.limit, args.repeat)
+            peak = peak_memory_mb(user, pool, args.limit)
+            speedup = us_per_pair * size / 1000 / elapsed
+            results["find_matches"][str(size)] = {
+                "speedup": round(speedup, 1),
+                "peak_mb": round(peak, 2),
+                "scored": result["scored_candidates"],
+                "top": [
+                    [match["user_id"], match["compatibility"].compatibility_score]
+                    for match in result["matches"]
+                ]
+            }
+            print(
+                f"find_matches {size:>7}: {elapsed:9.1f} ms ({speedup:6.1f}x per-pair)  "
+                f"peak {peak:8.1f} MB  scored {result['scored_candidates']}"
+            )
+
+            if args.shard_size and size > args.shard_size:
+                settings.MATCHING_SHARD_SIZE = args.shard_size
+                try:
+                    sharded_ms, sharded = time_find_matches(user, pool, args.limit, args.repeat)
+                finally:
+                    settings.MATCHING_SHARD_SIZE = 0
+                results["find_matches"][str(size)]["sharded_speedup"] = round(elapsed / sharded_ms, 2)
+                if sharded["matches"] != result["matches"]:
+                    print(f"sharding: ranking differs from in-process on {size} candidates")
+                    failed = True
+                print(
+                    f"  sharded by {args.shard_size}: {sharded_ms:9.1f} ms "
+                    f"({'faster' if sharded_ms < elapsed else 'slower'} than in-process)"
+                )
+    finally:
+        shutdown_pool()
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            problems, warnings = compare(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"regression: {problem}")
+        for warning in warnings:
+            print(f"warning (timing, advisory): {warning}")
+        if not problems:
+            print("baseline: same top matches")
+        failed = failed or bool(problems)
+    else:
+        print(f"no baseline at {args.baseline} (use --update-baseline)")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
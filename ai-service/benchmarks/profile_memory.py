@@ -0,0 +1,67 @@
+"""
+Profile memory benchmark
+
+Measures the bytes held per profile as a UserProfile (what the profile
+store used to keep, including its memoized compiled view) and as a
+CompiledProfile (what it keeps now). Vocabularies are warmed up first,
+since interned tokens are shared by every profile, and the shared
+feature cache is kept out of the measurements.
+
+Usage (from ai-service/):
+    python -m benchmarks.profile_memory [--count 100000] [--seed 42]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from api.matching import UserProfile
+from benchmarks.synthetic import generate_fields
+from engine.features import build_features, feature_cache
+
+
+def measure(build, items) -> int:
+    """Bytes still allocated by ``build`` over ``items`` once it returned"""
+    feature_cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    built = [build(item) for item in items]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return current
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bytes per profile, UserProfile vs CompiledProfile")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    fields = generate_fields(args.count, args.seed)
+    profiles = [UserProfile(**item) for item in fields]
+
+    # Intern every token before measuring
+    for profile in profiles:
+        build_features(profile, intern=True)
+
+    def user_profile(item):
+        # Memoized like compile_profile does, without a feature cache entry
+        profile = UserProfile(**item)
+        profile.__pydantic_private__['_features'] = build_features(profile)
+        return profile
+
+    results = {
+        "UserProfile": measure(lambda item: UserProfile(**item), fields),
+        "UserProfile + compiled memo": measure(user_profile, fields),
+        "CompiledProfile": measure(lambda profile: build_features(profile, intern=True), profiles),
+    }
+
+    baseline = results["UserProfile + compiled memo"]
+    print(f"{args.count} profiles")
+    for name, total in results.items():
+        print(f"  {name:<28} {total / args.count:>8.0f} bytes/profile  ({total / baseline:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Reference scorers for the benchmark parity check
+
+A frozen copy of the original set-based per-pair scorers, independent of
+the compiled profiles and kernels they were replaced by, so the parity
+check compares the engine with the behavior it must keep rather than with
+itself. Locations are compared as strings, as they were before the
+gazetteer: run the parity check with MATCHING_GEO_ENABLED off.
+"""
+
+from core.config import settings
+
+COMPLEMENTARY_PAIRS = [
+    ('INTJ', 'ENFP'), ('INTJ', 'ENTP'),
+    ('INTP', 'ENFJ'), ('INTP', 'ENTJ'),
+    ('ENTJ', 'INFP'), ('ENTJ', 'INTP'),
+    ('ENTP', 'INFJ'), ('ENTP', 'INTJ'),
+    ('INFJ', 'ENFP'), ('INFJ', 'ENTP'),
+    ('INFP', 'ENFJ'), ('INFP', 'ENTJ'),
+    ('ENFJ', 'INFP'), ('ENFJ', 'ISFP'),
+    ('ENFP', 'INFJ'), ('ENFP', 'INTJ'),
+    ('ISTJ', 'ESFP'), ('ISTJ', 'ESTP'),
+    ('ISFJ', 'ESFP'), ('ISFJ', 'ESTP'),
+    ('ESTJ', 'ISFP'), ('ESTJ', 'ISTP'),
+    ('ESFJ', 'ISFP'), ('ESFJ', 'ISTP'),
+    ('ISTP', 'ESFJ'), ('ISTP', 'ESTJ'),
+    ('ISFP', 'ESFJ'), ('ISFP', 'ESTJ'),
+    ('ESTP', 'ISFJ'), ('ESTP', 'ISTJ'),
+    ('ESFP', 'ISFJ'), ('ESFP', 'ISTJ')
+]
+
+
+def personality(user1, user2) -> float:
+    score = 0.5
+    if user1.personality_type and user2.personality_type:
+        mbti1 = user1.personality_type
+        mbti2 = user2.personality_type
+        if (mbti1, mbti2) in COMPLEMENTARY_PAIRS or (mbti2, mbti1) in COMPLEMENTARY_PAIRS:
+            score += 0.3
+        elif mbti1 == mbti2:
+            score += 0.2
+        else:
+            score += 0.1
+
+    if user1.personality_traits and user2.personality_traits:
+        traits1 = user1.personality_traits
+        traits2 = user2.personality_traits
+        trait_diffs = []
+        for trait in ['openness', 'conscientiousness', 'extraversion', 'agreeableness']:
+            if trait in traits1 and trait in traits2:
+                trait_diffs.append(abs(traits1[trait] - traits2[trait]))
+        if trait_diffs:
+            avg_diff = sum(trait_diffs) / len(trait_diffs)
+            score += (1 - avg_diff) * 0.2
+
+    return min(1.0, score)
+
+
+def interests(user1, user2) -> tuple:
+    interests1 = set(user1.interests)
+    interests2 = set(user2.interests)
+    if not interests1 or not interests2:
+        return 0.3, []
+    common = interests1.intersection(interests2)
+    union = interests1.union(interests2)
+    jaccard_score = len(common) / len(union) if union else 0
+    return jaccard_score, list(common)
+
+
+def travel(user1, user2) -> tuple:
+    score = 0.0
+    reasons = []
+
+    styles1 = set(user1.travel_styles)
+    styles2 = set(user2.travel_styles)
+    if styles1 and styles2:
+        common_styles = styles1.intersection(styles2)
+        if common_styles:
+            score += len(common_styles) / max(len(styles1), len(styles2)) * 0.4
+            reasons.append(f"{len(common_styles)} styles de voyage communs")
+
+    languages1 = set(user1.languages)
+    languages2 = set(user2.languages)
+    if languages1 and languages2:
+        common_languages = languages1.intersection(languages2)
+        if common_languages:
+            score += len(common_languages) / max(len(languages1), len(languages2)) * 0.3
+            reasons.append(f"{len(common_languages)} langues communes")
+
+    destinations1 = set(user1.dream_countries)
+    destinations2 = set(user2.dream_countries)
+    common_destinations = []
+    if destinations1 and destinations2:
+        common_destinations = list(destinations1.intersection(destinations2))
+        if common_destinations:
+            score += len(common_destinations) / max(len(destinations1), len(destinations2)) * 0.3
+            reasons.append(f"{len(common_destinations)} destinations de rêve communes")
+
+    return min(1.0, score), reasons, common_destinations
+
+
+def location(user1, user2) -> float:
+    if not user1.location or not user2.location:
+        return 0.5
+    if user1.location == user2.location:
+        return 1.0
+    if user1.location.split(',')[-1].strip() == user2.location.split(',')[-1].strip():
+        return 0.7
+    return 0.3
+
+
+def compatibility(user1, user2) -> dict:
+    """Original /compatibility response as a dict, common lists sorted (sets had no order)"""
+    personality_score = personality(user1, user2)
+    interests_score, common_interests = interests(user1, user2)
+    travel_score, match_reasons, common_destinations = travel(user1, user2)
+    location_score = location(user1, user2)
+    overall_score = (
+        personality_score * settings.MATCHING_WEIGHT_PERSONALITY +
+        interests_score * settings.MATCHING_WEIGHT_INTERESTS +
+        travel_score * settings.MATCHING_WEIGHT_TRAVEL +
+        location_score * settings.MATCHING_WEIGHT_LOCATION
+    )
+
+    if personality_score > 0.7:
+        match_reasons.append("Personnalités complémentaires")
+    if interests_score > 0.5:
+        match_reasons.append(f"{len(common_interests)} intérêts communs")
+    if location_score > 0.5:
+        match_reasons.append("Proximité géographique")
+
+    return {
+        "compatibility_score": round(overall_score * 100, 2),
+        "personality_compatibility": round(personality_score * 100, 2),
+        "interests_compatibility": round(interests_score * 100, 2),
+        "travel_compatibility": round(travel_score * 100, 2),
+        "location_compatibility": round(location_score * 100, 2),
+        "match_reasons": match_reasons,
+        "common_interests": sorted(common_interests),
+        "common_destinations": sorted(common_destinations)
+    }
@@ -0,0 +1,133 @@
+"""
+Seeded synthetic profiles for benchmarks
+
+Distributions are meant to look like the real user base rather than
+uniform noise: MBTI types follow published population frequencies, Big
+Five traits are normal around 0.5, interests, languages, destinations and
+home cities are long-tailed (a few very popular values, many rare ones),
+and home cities come from the bundled gazetteer so distance scoring is
+exercised. A few profiles have missing or unresolvable fields, like real
+data does.
+"""
+
+import csv
+import os
+import random
+from typing import Dict, List, Sequence
+
+from api.matching import UserProfile
+from engine.geo import DATA_DIR
+
+# Approximate share of the population per MBTI type
+MBTI_FREQUENCIES = {
+    'ISFJ': 13.8, 'ESFJ': 12.0, 'ISTJ': 11.6, 'ISFP': 8.8, 'ESTJ': 8.7, 'ESFP': 8.5,
+    'ENFP': 8.1, 'ISTP': 5.4, 'INFP': 4.4, 'ESTP': 4.3, 'INTP': 3.3, 'ENTP': 3.2,
+    'ENFJ': 2.5, 'INTJ': 2.1, 'ENTJ': 1.8, 'INFJ': 1.5,
+}
+
+TRAIT_NAMES = ('openness', 'conscientiousness', 'extraversion', 'agreeableness')
+
+INTERESTS = [
+    'photography', 'hiking', 'food', 'history', 'beaches', 'museums', 'music', 'nightlife',
+    'architecture', 'nature', 'culture', 'wine', 'diving', 'surfing', 'yoga', 'art',
+    'shopping', 'camping', 'cycling', 'skiing', 'festivals', 'street food', 'wildlife',
+    'climbing', 'sailing', 'road trips', 'cooking', 'languages', 'volunteering', 'dance',
+    'theatre', 'cinema', 'reading', 'running', 'fishing', 'kayaking', 'meditation',
+    'gaming', 'football', 'tennis', 'golf', 'coffee', 'tea', 'markets', 'castles',
+    'deserts', 'mountains', 'islands', 'lakes', 'caves', 'temples', 'gardens',
+    'vintage', 'fashion', 'design', 'astronomy', 'birdwatching', 'horse riding',
+    'scuba', 'backpacking',
+]
+
+TRAVEL_STYLES = ['culture', 'adventure', 'beach', 'backpacking', 'road_trip', 'luxury', 'eco', 'city_break']
+
+LANGUAGES = ['fr', 'en', 'ar', 'es', 'de', 'it', 'pt', 'nl', 'tr', 'zh', 'ja', 'ru']
+
+GENDERS = ['MALE', 'FEMALE', 'OTHER']
+GENDER_WEIGHTS = [48, 48, 4]
+
+LOOKING_FOR = ['TRAVEL_COMPANION', 'FRIENDSHIP', 'DATING', 'PROFESSIONAL', 'ALL']
+LOOKING_FOR_WEIGHTS = [40, 25, 15, 5, 15]
+
+
+def zipf_weights(count: int, exponent: float = 1.0) -> List[float]:
+    """Long-tailed weights: the value of rank r gets 1 / r^exponent"""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def _read_rows(path: str, *columns: str) -> List[tuple]:
+    with open(path, newline='', encoding='utf-8') as f:
+        return [tuple(row[column] for column in columns) for row in csv.DictReader(f)]
+
+
+class ProfileGenerator:
+    """Deterministic stream of synthetic UserProfile fields for one seed"""
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.cities = [
+            f"{city}, {country}"
+            for city, country in _read_rows(os.path.join(DATA_DIR, 'gazetteer.csv'), 'city', 'country')
+        ]
+        self.countries = [country for country, in _read_rows(os.path.join(DATA_DIR, 'countries.csv'), 'country')]
+        self._mbti = list(MBTI_FREQUENCIES)
+        self._mbti_weights = list(MBTI_FREQUENCIES.values())
+        self._interest_weights = zipf_weights(len(INTERESTS), 0.8)
+        self._style_weights = zipf_weights(len(TRAVEL_STYLES), 0.7)
+        self._language_weights = zipf_weights(len(LANGUAGES), 1.2)
+        self._city_weights = zipf_weights(len(self.cities), 1.0)
+        self._country_weights = zipf_weights(len(self.countries), 0.9)
+
+    def _sample(self, values: Sequence[str], weights: Sequence[float], count: int) -> List[str]:
+        """Up to ``count`` distinct values drawn by weight"""
+        chosen: Dict[str, None] = {}
+        for _ in range(count * 3):
+            if len(chosen) == count:
+                break
+            chosen[self.rng.choices(values, weights)[0]] = None
+        return list(chosen)
+
+    def _traits(self) -> Dict[str, float]:
+        traits = {}
+        for trait in TRAIT_NAMES:
+            # Some users skip individual questions of the test
+            if self.rng.random() < 0.95:
+                traits[trait] = round(min(1.0, max(0.0, self.rng.gauss(0.5, 0.15))), 2)
+        return traits
+
+    def _location(self):
+        roll = self.rng.random()
+        if roll < 0.06:
+            return None
+        if roll < 0.10:
+            # Free-text locations the gazetteer cannot resolve
+            return f"Village {self.rng.randint(1, 500)}, {self.rng.choices(self.countries, self._country_weights)[0]}"
+        return self.rng.choices(self.cities, self._city_weights)[0]
+
+    def fields(self, user_id: int) -> dict:
+        """UserProfile fields of one random profile"""
+        rng = self.rng
+        return {
+            "id": user_id,
+            "personality_type": rng.choices(self._mbti, self._mbti_weights)[0] if rng.random() < 0.85 else None,
+            "personality_traits": (self._traits() or None) if rng.random() < 0.75 else None,
+            "interests": self._sample(INTERESTS, self._interest_weights, rng.randint(0, 12)),
+            "travel_styles": self._sample(TRAVEL_STYLES, self._style_weights, rng.randint(0, 3)),
+            "languages": self._sample(LANGUAGES, self._language_weights, rng.randint(1, 3)),
+            "dream_countries": self._sample(self.countries, self._country_weights, rng.randint(0, 6)),
+            "location": self._location(),
+            "age": min(75, 18 + int(rng.gammavariate(2.5, 5))) if rng.random() < 0.95 else None,
+            "gender": rng.choices(GENDERS, GENDER_WEIGHTS)[0],
+            "looking_for": rng.choices(LOOKING_FOR, LOOKING_FOR_WEIGHTS)[0],
+        }
+
+
+def generate_fields(count: int, seed: int = 42, start_id: int = 1) -> List[dict]:
+    """Fields of ``count`` synthetic profiles with ids from ``start_id``"""
+    generator = ProfileGenerator(seed)
+    return [generator.fields(user_id) for user_id in range(start_id, start_id + count)]
+
+
+def generate_profiles(count: int, seed: int = 42, start_id: int = 1) -> List[UserProfile]:
+    """``count`` synthetic UserProfile instances"""
+    return [UserProfile(**fields) for fields in generate_fields(count, seed, start_id)]
@@ -15,6 +15,13 @@ engine = create_async_engine(
     poolclass=NullPool
 )
 
+# Read-only engine for the auth database (users, interests, languages...)
+auth_engine = create_async_engine(
+    settings.AUTH_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"),
+    echo=settings.DEBUG,
+    poolclass=NullPool
+)
+
 # Create async session
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -0,0 +1,48 @@
+"""
+NDJSON request bodies
+
+Bodies are read from the request stream chunk by chunk and split into
+lines, so a large upload is never held as one bytes object and an
+oversized one, or an overlong line, is rejected as soon as it crosses its
+limit.
+"""
+
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+
+
+async def ndjson_lines(
+    request: Request,
+    max_bytes: Optional[int] = None,
+    max_line_bytes: Optional[int] = None
+) -> AsyncIterator[tuple]:
+    """
+    Yield (line number, line) for the non-blank lines of an NDJSON body
+
+    A body larger than ``max_bytes``, or a line longer than
+    ``max_line_bytes``, answers 413.
+    """
+    buffer = b""
+    number = 0
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            _check_line(number, line, max_line_bytes)
+            if line.strip():
+                yield number, line
+        # A partial line is only held up to the limit, not until the body ends
+        _check_line(number + 1, buffer, max_line_bytes)
+    if buffer.strip():
+        yield number + 1, buffer
+
+
+def _check_line(number: int, line: bytes, max_line_bytes: Optional[int]) -> None:
+    if max_line_bytes is not None and len(line) > max_line_bytes:
+        raise HTTPException(status_code=413, detail=f"Line {number} exceeds {max_line_bytes} bytes")
@@ -0,0 +1,364 @@
+"""
+Approximate nearest-neighbour candidate generation
+
+Each profile becomes a dense float32 vector: its four Big Five traits
+followed by a signed feature-hashing embedding of its interests and dream
+countries. An IVF index (k-means coarse quantizer + inverted lists, pure
+NumPy) returns a few hundred nearest profiles, which are then re-ranked
+with the exact compatibility scoring. AnnIndex itself only sees vectors
+and also backs the face identification index.
+
+The quantizer is never trained on the search path: inserts that make the
+index due for (re)training start it in a background thread, and searches
+keep using the previous centroids (or brute force) until it is done.
+"""
+
+import logging
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from engine.features import compile_profile
+from engine.vocabulary import vocabularies
+
+logger = logging.getLogger(__name__)
+
+# Missing traits sit at the middle of the 0-1 scale
+DEFAULT_TRAIT = 0.5
+
+
+def _hash_embedding(tokens, dimensions: int) -> np.ndarray:
+    """Signed feature hashing of a token list, L2 normalized"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in set(tokens):
+        digest = zlib.crc32(token.encode('utf-8'))
+        vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _tokens(compiled, field: str) -> List[str]:
+    """Every token of a set field, including those without a bit"""
+    return vocabularies[field].tokens(compiled.bits(field)) + sorted(compiled.extra(field))
+
+
+def profile_vector(profile, dimensions: int = None) -> np.ndarray:
+    """Dense vector of a profile: traits + hashed interests + hashed destinations"""
+    dimensions = dimensions or settings.MATCHING_ANN_HASH_DIMENSIONS
+    compiled = compile_profile(profile)
+    trait_vector = np.nan_to_num(np.array(compiled.trait_values(), dtype=np.float32), nan=DEFAULT_TRAIT)
+    return np.concatenate([
+        trait_vector,
+        _hash_embedding(_tokens(compiled, 'interests'), dimensions),
+        _hash_embedding(_tokens(compiled, 'dream_countries'), dimensions)
+    ])
+
+
+def _kmeans(vectors: np.ndarray, clusters: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd k-means returning the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(vectors, centroids, 1)[:, 0]
+        for cluster in range(clusters):
+            members = vectors[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                centroids[cluster] = vectors[rng.integers(len(vectors))]
+    return centroids
+
+
+def _squared_norms(vectors: np.ndarray) -> np.ndarray:
+    return (vectors ** 2).sum(axis=1)
+
+
+def _squared_distances(queries: np.ndarray, vectors: np.ndarray, norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Squared L2 distances between query rows and vector rows (one GEMM);
+    ``norms`` are the squared norms of the vector rows, when cached
+    """
+    if norms is None:
+        norms = _squared_norms(vectors)
+    return _squared_norms(queries)[:, None] - 2 * queries @ vectors.T + norms[None, :]
+
+
+def _smallest(distances: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest distances of each row, smallest first"""
+    k = min(k, distances.shape[1])
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def _nearest(queries: np.ndarray, vectors: np.ndarray, k: int, norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """Indices of the k nearest vector rows for each query row, closest first"""
+    return _smallest(_squared_distances(queries, vectors, norms), k)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, centroid_norms: np.ndarray) -> np.ndarray:
+    """Nearest centroid of every vector, in chunks to bound the distance matrix"""
+    if not len(vectors):
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([
+        _nearest(vectors[start:start + 8192], centroids, 1, centroid_norms)[:, 0]
+        for start in range(0, len(vectors), 8192)
+    ])
+
+
+class AnnIndex:
+    """
+    IVF index over profile vectors with incremental inserts.
+
+    Below ``min_train_size`` vectors (MATCHING_ANN_MIN_TRAIN_SIZE), or
+    until the first training finishes, the index answers by brute force.
+    Inserts after training go straight to their nearest list; the
+    quantizer is retrained in the background once the index has doubled
+    since the last training.
+
+    Squared norms of the rows and centroids are kept next to them, so a
+    query only computes its own. Removed rows stay in place until they
+    make up MATCHING_ANN_COMPACT_FRACTION of the rows; the live ones are
+    then moved together.
+    """
+
+    def __init__(self, lists: int = None, probes: int = None, min_train_size: int = None):
+        self.lists = lists or settings.MATCHING_ANN_LISTS
+        self.probes = probes or settings.MATCHING_ANN_PROBES
+        self.min_train_size = min_train_size or settings.MATCHING_ANN_MIN_TRAIN_SIZE
+        self._vectors: Optional[np.ndarray] = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._live = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._rows: Dict[int, int] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_norms: Optional[np.ndarray] = None
+        self._assignment = np.zeros(0, dtype=np.int64)
+        self._lists: List[List[int]] = []
+        self._trained_size = 0
+        self._compactions = 0
+        self._lock = threading.RLock()
+        # Held for a whole training; k-means itself runs without _lock
+        self._training = threading.Lock()
+        self._training_scheduled = False
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def trained(self) -> bool:
+        """Whether searches probe the inverted lists instead of scanning every vector"""
+        return self._centroids is not None
+
+    def _grow(self, dimensions: int) -> None:
+        capacity = max(1024, 2 * len(self._ids))
+        vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        live = np.zeros(capacity, dtype=bool)
+        assignment = np.full(capacity, -1, dtype=np.int64)
+        if self._vectors is not None:
+            vectors[:self._size] = self._vectors[:self._size]
+            norms[:self._size] = self._norms[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            live[:self._size] = self._live[:self._size]
+            assignment[:self._size] = self._assignment[:self._size]
+        self._vectors, self._norms, self._ids = vectors, norms, ids
+        self._live, self._assignment = live, assignment
+
+    def add(self, user_id: int, vector: np.ndarray) -> None:
+        """Insert or replace the vector of a user"""
+        with self._lock:
+            self.remove(user_id)
+            if self._vectors is None or self._size == len(self._ids):
+                self._grow(len(vector))
+            row = self._size
+            self._size += 1
+            self._vectors[row] = vector
+            self._norms[row] = _squared_norms(self._vectors[row:row + 1])[0]
+            self._ids[row] = user_id
+            self._live[row] = True
+            self._rows[user_id] = row
+            if self._centroids is not None:
+                cluster = int(_nearest(vector[None, :], self._centroids, 1, self._centroid_norms)[0, 0])
+                self._assignment[row] = cluster
+                self._lists[cluster].append(row)
+            if self._due_for_training() and not self._training_scheduled:
+                self._training_scheduled = True
+                threading.Thread(target=self._train_in_background, name='ann-train', daemon=True).start()
+
+    def get(self, user_id: int) -> Optional[np.ndarray]:
+        """Copy of the vector of a user, or None"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            return None if row is None else self._vectors[row].copy()
+
+    def remove(self, user_id: int) -> bool:
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return False
+            self._live[row] = False
+            if self._size - len(self._rows) >= settings.MATCHING_ANN_COMPACT_FRACTION * self._size:
+                self._compact()
+            return True
+
+    def _compact(self) -> None:
+        """Move the live rows together, in order, and drop the removed ones"""
+        rows = np.flatnonzero(self._live[:self._size])
+        count = len(rows)
+        for array in (self._vectors, self._norms, self._ids, self._assignment):
+            array[:count] = array[rows]
+        self._live[:count] = True
+        self._live[count:self._size] = False
+        self._assignment[count:self._size] = -1
+        self._size = count
+        self._compactions += 1
+        self._rows = {user_id: row for row, user_id in enumerate(self._ids[:count].tolist())}
+        if self._centroids is not None:
+            self._lists = [[] for _ in range(self.lists)]
+            for row, cluster in enumerate(self._assignment[:count].tolist()):
+                self._lists[cluster].append(row)
+
+    def train(self) -> None:
+        """
+        (Re)build the coarse quantizer over the live vectors. k-means runs
+        on a snapshot without blocking searches, which keep using the
+        previous centroids until the new ones are swapped in.
+        """
+        with self._training:
+            with self._lock:
+                rows = np.flatnonzero(self._live[:self._size])
+                if len(rows) < max(self.min_train_size, self.lists):
+                    return
+                vectors = self._vectors[rows]
+                size, compactions = self._size, self._compactions
+
+            sample = vectors
+            if len(rows) > 256 * self.lists:
+                sample = vectors[np.random.default_rng(0).choice(len(rows), 256 * self.lists, replace=False)]
+            centroids = _kmeans(sample, self.lists, settings.MATCHING_ANN_TRAIN_ITERATIONS)
+            centroid_norms = _squared_norms(centroids)
+            assignment = _assign(vectors, centroids, centroid_norms)
+
+            with self._lock:
+                if compactions == self._compactions:
+                    # Rows appended meanwhile are new; removed ones are dropped below
+                    added = np.arange(size, self._size)
+                    rows = np.concatenate([rows, added])
+                    assignment = np.concatenate([
+                        assignment, _assign(self._vectors[added], centroids, centroid_norms)
+                    ])
+                    live = self._live[rows]
+                    rows, assignment = rows[live], assignment[live]
+                else:
+                    rows = np.flatnonzero(self._live[:self._size])
+                    assignment = _assign(self._vectors[rows], centroids, centroid_norms)
+                self._centroids, self._centroid_norms = centroids, centroid_norms
+                self._assignment[:self._size] = -1
+                self._assignment[rows] = assignment
+                self._lists = [[] for _ in range(self.lists)]
+                for row, cluster in zip(rows.tolist(), assignment.tolist()):
+                    self._lists[cluster].append(row)
+                self._trained_size = len(rows)
+
+    def _due_for_training(self) -> bool:
+        return len(self) >= max(self.min_train_size, self.lists) and (
+            self._centroids is None or len(self) >= 2 * self._trained_size
+        )
+
+    def _train_in_background(self) -> None:
+        try:
+            self.train()
+        except Exception as e:
+            logger.error(f"ANN index training failed: {e}")
+        finally:
+            with self._lock:
+                self._training_scheduled = False
+
+    def _top_rows(self, rows: Optional[np.ndarray], vector: np.ndarray, k: int, exclude_id: Optional[int]) -> np.ndarray:
+        """Rows of the k nearest live vectors among ``rows`` (every row when None), closest first"""
+        if rows is None:
+            # Exact search: one matrix-vector pass over the contiguous block
+            keep = self._live[:self._size].copy()
+            if exclude_id is not None:
+                keep &= self._ids[:self._size] != exclude_id
+            if not keep.any():
+                return np.zeros(0, dtype=np.int64)
+            distances = _squared_distances(vector[None, :], self._vectors[:self._size], self._norms[:self._size])
+            distances[0, ~keep] = np.inf
+            return _smallest(distances, min(k, int(keep.sum())))[0]
+        rows = rows[self._live[rows]]
+        if exclude_id is not None:
+            rows = rows[self._ids[rows] != exclude_id]
+        if not len(rows):
+            return rows
+        return rows[_nearest(vector[None, :], self._vectors[rows], k, self._norms[rows])[0]]
+
+    def _candidate_rows(self, vector: np.ndarray, probes: Optional[int]) -> Optional[np.ndarray]:
+        """Rows in the probed inverted lists, or None when the index answers exactly"""
+        if self._centroids is None:
+            return None
+        probes = min(probes or self.probes, self.lists)
+        clusters = _nearest(vector[None, :], self._centroids, probes, self._centroid_norms)[0]
+        return np.fromiter(
+            (row for cluster in clusters for row in self._lists[cluster]), dtype=np.int64
+        )
+
+    def search(self, vector: np.ndarray, k: int, exclude_id: Optional[int] = None, probes: int = None) -> List[int]:
+        """User ids of the (approximately) k nearest profiles, closest first"""
+        with self._lock:
+            if not self._size:
+                return []
+            rows = self._top_rows(self._candidate_rows(vector, probes), vector, k, exclude_id)
+            return self._ids[rows].tolist()
+
+    def neighbours(
+        self,
+        vector: np.ndarray,
+        k: int,
+        exclude_id: Optional[int] = None,
+        probes: int = None
+    ) -> Tuple[List[int], np.ndarray]:
+        """Like search(), with the Euclidean distance of each returned vector"""
+        with self._lock:
+            if not self._size:
+                return [], np.zeros(0, dtype=np.float32)
+            rows = self._top_rows(self._candidate_rows(vector, probes), vector, k, exclude_id)
+            # Direct differences: the expanded form used for ranking loses
+            # precision on near-duplicates
+            distances = np.linalg.norm(self._vectors[rows] - vector, axis=1)
+            return self._ids[rows].tolist(), distances
+
+    def brute_force(self, vector: np.ndarray, k: int, exclude_id: Optional[int] = None) -> List[int]:
+        """Exact k nearest profiles"""
+        with self._lock:
+            return self._ids[self._top_rows(None, vector, k, exclude_id)].tolist()
+
+    def recall(self, k: int, queries: int = 100, probes: int = None, seed: int = 0) -> dict:
+        """Mean recall@k of search() against brute force over sampled stored profiles"""
+        with self._lock:
+            live_ids = list(self._rows)
+            if not live_ids:
+                return {"recall": 0.0, "queries": 0, "k": k}
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(live_ids, min(queries, len(live_ids)), replace=False)
+            hits = 0
+            total = 0
+            for user_id in sample.tolist():
+                vector = self._vectors[self._rows[user_id]]
+                exact = set(self.brute_force(vector, k, user_id))
+                approximate = set(self.search(vector, k, user_id, probes))
+                hits += len(exact & approximate)
+                total += len(exact)
+            return {
+                "recall": round(hits / total, 4) if total else 0.0,
+                "queries": len(sample),
+                "k": k,
+                "probes": min(probes or self.probes, self.lists),
+                "trained": self.trained
+            }
@@ -0,0 +1,91 @@
+"""
+Inverted-index candidate generation (blocking)
+
+Maps every interned token to the positions of the candidates holding it,
+so a shortlist of candidates sharing at least ``min_overlap`` tokens with
+the user can be produced without touching the others. The index pays off
+for the persistent profile store; a one-off request pool is blocked with
+overlap_shortlist instead, one AND + popcount pass over its bitset columns.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from engine.features import CompiledProfile
+from engine.vocabulary import SET_FIELDS, bit_ids, pack_bitsets, popcount_rows, vocabularies
+
+
+class InvertedIndex:
+    """Posting lists from (field, token id) to candidate positions"""
+
+    def __init__(self, candidate_features: Sequence[CompiledProfile] = (), fields: Sequence[str] = SET_FIELDS):
+        self.fields = tuple(fields)
+        self._size = 0
+        self._postings: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        self._arrays: Dict[Tuple[str, int], np.ndarray] = {}
+        for features in candidate_features:
+            self.add(features)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, features: CompiledProfile) -> int:
+        """Index a candidate and return its position"""
+        position = self._size
+        for field in self.fields:
+            for token_id in bit_ids(features.bits(field)):
+                key = (field, token_id)
+                self._postings[key].append(position)
+                self._arrays.pop(key, None)
+        self._size += 1
+        return position
+
+    def posting(self, field: str, token_id: int) -> np.ndarray:
+        """Positions of the candidates holding a token"""
+        key = (field, token_id)
+        array = self._arrays.get(key)
+        if array is None:
+            array = np.asarray(self._postings.get(key, ()), dtype=np.int64)
+            self._arrays[key] = array
+        return array
+
+    def overlap_counts(self, user_features: CompiledProfile) -> np.ndarray:
+        """Number of tokens every candidate shares with the user, over all fields"""
+        counts = np.zeros(self._size, dtype=np.int32)
+        for field in self.fields:
+            for token_id in bit_ids(user_features.bits(field)):
+                # A posting never repeats a position, so fancy += is exact
+                counts[self.posting(field, token_id)] += 1
+        return counts
+
+    def shortlist(self, user_features: CompiledProfile, min_overlap: int = 1) -> np.ndarray:
+        """Positions (ascending) of candidates sharing at least ``min_overlap`` tokens"""
+        if min_overlap <= 0:
+            return np.arange(self._size)
+        return np.flatnonzero(self.overlap_counts(user_features) >= min_overlap)
+
+
+def overlap_shortlist(
+    user_features: CompiledProfile,
+    candidate_features: Sequence[CompiledProfile],
+    min_overlap: int = 1
+) -> np.ndarray:
+    """InvertedIndex(candidate_features).shortlist without building the index"""
+    if min_overlap <= 0:
+        return np.arange(len(candidate_features))
+    counts = np.zeros(len(candidate_features), dtype=np.int64)
+    for field in SET_FIELDS:
+        user_bits = user_features.bits(field)
+        if user_bits:
+            words = vocabularies[field].word_count()
+            matrix = pack_bitsets((features.bits(field) for features in candidate_features), words)
+            counts += popcount_rows(matrix & pack_bitsets([user_bits], words))
+        user_extra = user_features.extra(field)
+        if user_extra:
+            # Tokens without a bit can only be shared with other request profiles
+            for position, features in enumerate(candidate_features):
+                if features.extras is not None:
+                    counts[position] += len(user_extra & features.extra(field))
+    return np.flatnonzero(counts >= min_overlap)
@@ -0,0 +1,206 @@
+"""
+Two-tier compatibility result cache
+
+Results of /compatibility are cached under an order-independent pair of
+profile content fingerprints plus the current matching weights. A bounded
+in-process LRU sits in front of Redis; both tiers expire entries after
+MATCHING_CACHE_TTL_SECONDS. When a user's fingerprint changes, every
+entry computed from the old profile content is dropped. Current
+fingerprints are remembered for at most MATCHING_CACHE_SIZE users (least
+recently seen first out); entries of a forgotten user are never looked up
+again after a change and simply age out.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+import redis.asyncio as redis
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds to stop calling Redis after a connection error
+REDIS_RETRY_DELAY = 30
+
+
+def profile_fingerprint(profile) -> str:
+    """Stable content hash of a profile (memoized on pydantic models)"""
+    private = getattr(profile, '__pydantic_private__', None)
+    if private and private.get('_fingerprint'):
+        return private['_fingerprint']
+
+    content = profile.model_dump_json(exclude={'id'})
+    fingerprint = hashlib.blake2b(content.encode('utf-8'), digest_size=12).hexdigest()
+    if private is not None:
+        private['_fingerprint'] = fingerprint
+    return fingerprint
+
+
+def weights_fingerprint() -> str:
+    """Short hash of the MATCHING_WEIGHT_* and MATCHING_GEO_* values results depend on"""
+    weights = (
+        settings.MATCHING_WEIGHT_PERSONALITY,
+        settings.MATCHING_WEIGHT_INTERESTS,
+        settings.MATCHING_WEIGHT_TRAVEL,
+        settings.MATCHING_WEIGHT_LOCATION,
+        settings.MATCHING_GEO_ENABLED,
+        settings.MATCHING_GEO_NEAR_KM,
+        settings.MATCHING_GEO_REGION_KM
+    )
+    return hashlib.blake2b(repr(weights).encode('utf-8'), digest_size=4).hexdigest()
+
+
+class CompatibilityCache:
+    """In-process LRU in front of Redis, with hit/miss counters"""
+
+    def __init__(self, maxsize: int, ttl: int, redis_url: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_fingerprint: Dict[str, Set[str]] = {}
+        self._fingerprints: "OrderedDict[int, str]" = OrderedDict()
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "redis_errors": 0
+        }
+
+    def _key(self, fingerprint1: str, fingerprint2: str) -> str:
+        low, high = sorted((fingerprint1, fingerprint2))
+        return f"compat:{weights_fingerprint()}:{low}:{high}"
+
+    def _client(self):
+        if not self.redis_url or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.from_url(self.redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        return self._redis
+
+    def _redis_failed(self, error: Exception) -> None:
+        self.stats["redis_errors"] += 1
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_DELAY
+        logger.warning(f"Compatibility cache Redis error, using local tier only: {error}")
+
+    async def _track(self, user_id: int, fingerprint: str) -> None:
+        """Remember a user's current fingerprint, invalidating the previous one"""
+        previous = self._fingerprints.get(user_id)
+        self._fingerprints[user_id] = fingerprint
+        self._fingerprints.move_to_end(user_id)
+        while len(self._fingerprints) > self.maxsize:
+            self._fingerprints.popitem(last=False)
+        if previous is None or previous == fingerprint:
+            return
+
+        self.stats["invalidations"] += 1
+        for key in list(self._keys_by_fingerprint.get(previous, ())):
+            self._drop_local(key)
+
+        client = self._client()
+        if client is not None:
+            try:
+                index_key = f"compat:fp:{previous}"
+                keys = await client.smembers(index_key)
+                await client.delete(index_key, *keys)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def _store_local(self, key: str, value: dict, fingerprints) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        for fingerprint in fingerprints:
+            self._keys_by_fingerprint.setdefault(fingerprint, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._drop_local(next(iter(self._entries)))
+
+    def _drop_local(self, key: str) -> None:
+        """Remove a local entry and its fingerprint index references"""
+        self._entries.pop(key, None)
+        for fingerprint in key.rsplit(':', 2)[1:]:
+            keys = self._keys_by_fingerprint.get(fingerprint)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_fingerprint[fingerprint]
+
+    async def get(self, user1, user2) -> Optional[dict]:
+        """Cached result for a pair of profiles, or None"""
+        fingerprint1 = profile_fingerprint(user1)
+        fingerprint2 = profile_fingerprint(user2)
+        await self._track(user1.id, fingerprint1)
+        await self._track(user2.id, fingerprint2)
+        key = self._key(fingerprint1, fingerprint2)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["local_hits"] += 1
+                return entry[1]
+            self._drop_local(key)
+
+        client = self._client()
+        if client is not None:
+            try:
+                payload = await client.get(key)
+                if payload is not None:
+                    value = json.loads(payload)
+                    self._store_local(key, value, (fingerprint1, fingerprint2))
+                    self.stats["redis_hits"] += 1
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, user1, user2, value: dict) -> None:
+        """Cache a result for a pair of profiles in both tiers"""
+        fingerprints = (profile_fingerprint(user1), profile_fingerprint(user2))
+        key = self._key(*fingerprints)
+        self._store_local(key, value, fingerprints)
+
+        client = self._client()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.set(key, json.dumps(value), ex=self.ttl)
+                    for fingerprint in fingerprints:
+                        pipe.sadd(f"compat:fp:{fingerprint}", key)
+                        pipe.expire(f"compat:fp:{fingerprint}", self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                self._redis_failed(e)
+
+    def snapshot(self) -> dict:
+        """Counters and sizes for monitoring"""
+        lookups = self.stats["local_hits"] + self.stats["redis_hits"] + self.stats["misses"]
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self._entries),
+            "tracked_profiles": len(self._fingerprints),
+            "redis_enabled": bool(self.redis_url)
+        }
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+compatibility_cache = CompatibilityCache(
+    maxsize=settings.MATCHING_CACHE_SIZE,
+    ttl=settings.MATCHING_CACHE_TTL_SECONDS,
+    redis_url=settings.REDIS_URL if settings.MATCHING_CACHE_REDIS else None
+)
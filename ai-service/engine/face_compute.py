@@ -0,0 +1,197 @@
+"""
+Face compute pool
+
+dlib face detection and encoding take hundreds of milliseconds per photo
+and hold the GIL, so they run in a dedicated executor instead of on the
+event loop. By default that is a process pool whose workers import
+face_recognition (and so load the dlib models) once at startup;
+FACE_EXECUTOR=thread uses threads instead.
+
+Admission is bounded: at most FACE_WORKERS tasks run and FACE_QUEUE_SIZE
+more wait. Anything beyond that is rejected right away with FaceComputeBusy
+so a sign-up spike gets fast 503s instead of stalling the whole service.
+Batch images are admitted against the same limit but wait for a free
+slot instead of being rejected.
+
+Tasks take raw image bytes (or base64 text) and decode them in the worker
+as well.
+
+A worker dying (dlib crash, OOM kill) breaks a process pool for good; the
+broken pool is then replaced by a fresh one and the task retried once.
+"""
+
+import asyncio
+import base64
+import io
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import face_recognition
+import numpy as np
+from PIL import Image
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FaceComputeBusy(Exception):
+    """Raised when the face compute queue is full"""
+
+
+class InvalidImage(ValueError):
+    """Raised when image bytes cannot be decoded"""
+
+
+def _init_worker() -> None:
+    # Importing this module loaded the dlib models; run the detector once
+    # so the first real request does not pay for its warm-up
+    face_recognition.face_locations(np.zeros((32, 32, 3), dtype=np.uint8))
+
+
+def decode_base64(data: str) -> bytes:
+    """Decode a base64 string (or data URL); raises InvalidImage when invalid"""
+    try:
+        # Remove data URL prefix if present
+        if ',' in data:
+            data = data.split(',')[1]
+        return base64.b64decode(data)
+    except Exception as e:
+        raise InvalidImage(f"Invalid base64 data: {e}")
+
+
+def load_image(data) -> np.ndarray:
+    """Decode image bytes or base64 text to a pixel array; raises InvalidImage when invalid"""
+    if isinstance(data, str):
+        data = decode_base64(data)
+    try:
+        return np.array(Image.open(io.BytesIO(data)))
+    except Exception as e:
+        raise InvalidImage(f"Invalid image data: {e}")
+
+
+def encode_image(data, model: str) -> dict:
+    """Face count and encoding of the first face (None when there is none)"""
+    image = load_image(data)
+    face_locations = face_recognition.face_locations(image, model=model)
+    encodings = face_recognition.face_encodings(image, face_locations) if face_locations else []
+    return {
+        "face_count": len(face_locations),
+        "encoding": encodings[0] if encodings else None
+    }
+
+
+def locate_faces(data) -> dict:
+    """Image size and face locations, for quality checks"""
+    image = load_image(data)
+    height, width = image.shape[:2]
+    return {
+        "height": height,
+        "width": width,
+        "face_locations": face_recognition.face_locations(image)
+    }
+
+
+def edge_density(data) -> float:
+    """Mean absolute gray-level gradient, high for screens and printed photos"""
+    image = load_image(data)
+    gray = np.mean(image, axis=2)
+    return float(np.abs(np.diff(gray, axis=0)).mean() + np.abs(np.diff(gray, axis=1)).mean())
+
+
+class FaceComputePool:
+    """Bounded executor for face tasks"""
+
+    def __init__(self, workers: int = None, queue_size: int = None, kind: str = None):
+        self.workers = workers or settings.FACE_WORKERS
+        self.queue_size = settings.FACE_QUEUE_SIZE if queue_size is None else queue_size
+        self.kind = kind or settings.FACE_EXECUTOR
+        self._executor: Optional[Executor] = None
+        self._in_flight = 0
+        self._slot_freed: Optional[asyncio.Condition] = None
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0, "restarts": 0}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="face")
+            else:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+            logger.info(f"Started face compute {self.kind} pool with {self.workers} workers")
+        return self._executor
+
+    def _full(self) -> bool:
+        return self._in_flight >= self.workers + self.queue_size
+
+    async def run(self, task, *args, wait: bool = False):
+        """
+        Run ``task(*args)`` in the pool.
+
+        Raises FaceComputeBusy at once when workers + queue are all taken,
+        or with ``wait`` (batch images) waits until a slot frees up.
+        A broken process pool is restarted and the task retried once.
+        """
+        if self._full():
+            if not wait:
+                self.stats["rejected"] += 1
+                raise FaceComputeBusy(f"{self._in_flight} face tasks in flight")
+            if self._slot_freed is None:
+                self._slot_freed = asyncio.Condition()
+            async with self._slot_freed:
+                await self._slot_freed.wait_for(lambda: not self._full())
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    result = await loop.run_in_executor(executor, task, *args)
+                    break
+                except BrokenProcessPool:
+                    # Retried once on a fresh pool; a task that breaks that one too fails
+                    self._discard(executor)
+                    if attempt:
+                        raise
+            self.stats["completed"] += 1
+            return result
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            if self._slot_freed is not None:
+                async with self._slot_freed:
+                    self._slot_freed.notify_all()
+
+    def _discard(self, executor: Executor) -> None:
+        """Drop a broken executor, unless a concurrent task already replaced it"""
+        if self._executor is executor:
+            logger.warning("Face compute pool is broken, restarting it")
+            self.stats["restarts"] += 1
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """Stop the workers, if they were started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "executor": self.kind
+        }
+
+
+face_pool = FaceComputePool()
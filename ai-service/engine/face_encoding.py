@@ -0,0 +1,103 @@
+"""
+Face encoding wire and storage format
+
+Encodings travel and are stored (users.face_encoding_data) as base64 text.
+The original format is the 1024 raw bytes of 128 little-endian float64
+values, with no header. The versioned formats start with one format byte
+followed by the values:
+
+    0x01  float32  128 x 4 bytes                         (513 bytes)
+    0x02  float16  128 x 2 bytes                         (257 bytes)
+    0x03  int8     float32 scale + 128 x 1 byte          (133 bytes)
+
+int8 is symmetric scalar quantization: value = int8 * scale, with
+scale = max |value| / 127 per encoding. A payload of exactly 1024 bytes is
+always the legacy format, so both are decoded without being told which is
+which. New encodings are written in FACE_ENCODING_FORMAT.
+"""
+
+import base64
+import binascii
+from typing import Dict
+
+import numpy as np
+
+from core.config import settings
+
+# face_recognition (dlib) encodings are 128-d
+FACE_ENCODING_SIZE = 128
+
+# Several references of one user (lighting, age...) are stored as
+# comma-separated encodings
+REFERENCE_SEPARATOR = ','
+
+LEGACY_FORMAT = 'float64'
+LEGACY_DTYPE = np.dtype('<f8')
+LEGACY_SIZE = FACE_ENCODING_SIZE * LEGACY_DTYPE.itemsize
+
+# Format byte and value type of the versioned formats
+FORMAT_CODES: Dict[str, int] = {'float32': 0x01, 'float16': 0x02, 'int8': 0x03}
+FLOAT_DTYPES = {0x01: np.dtype('<f4'), 0x02: np.dtype('<f2')}
+SCALE_DTYPE = np.dtype('<f4')
+
+FORMATS = (LEGACY_FORMAT, *FORMAT_CODES)
+
+
+def format_encoding(encoding: np.ndarray, encoding_format: str = None) -> str:
+    """Base64 text of a face encoding in ``encoding_format`` (FACE_ENCODING_FORMAT)"""
+    encoding_format = encoding_format or settings.FACE_ENCODING_FORMAT
+    encoding = np.asarray(encoding, dtype=np.float64)
+    if encoding_format == LEGACY_FORMAT:
+        payload = encoding.astype(LEGACY_DTYPE).tobytes()
+    elif encoding_format == 'int8':
+        scale = float(np.abs(encoding).max()) / 127 or 1.0
+        values = np.clip(np.rint(encoding / scale), -127, 127).astype(np.int8)
+        payload = bytes([FORMAT_CODES['int8']]) + SCALE_DTYPE.type(scale).tobytes() + values.tobytes()
+    elif encoding_format in FORMAT_CODES:
+        code = FORMAT_CODES[encoding_format]
+        payload = bytes([code]) + encoding.astype(FLOAT_DTYPES[code]).tobytes()
+    else:
+        raise ValueError(f"Unknown face encoding format: {encoding_format}")
+    return base64.b64encode(payload).decode('ascii')
+
+
+def _values(payload: bytes) -> np.ndarray:
+    if len(payload) == LEGACY_SIZE:
+        return np.frombuffer(payload, dtype=LEGACY_DTYPE)
+    if not payload:
+        raise ValueError("Empty face encoding")
+
+    code, body = payload[0], payload[1:]
+    if code in FLOAT_DTYPES:
+        dtype = FLOAT_DTYPES[code]
+        if len(body) != FACE_ENCODING_SIZE * dtype.itemsize:
+            raise ValueError(f"Face encoding has {len(body) // dtype.itemsize} values, expected {FACE_ENCODING_SIZE}")
+        return np.frombuffer(body, dtype=dtype)
+    if code == FORMAT_CODES['int8']:
+        if len(body) != SCALE_DTYPE.itemsize + FACE_ENCODING_SIZE:
+            raise ValueError(f"Face encoding has {len(body) - SCALE_DTYPE.itemsize} values, expected {FACE_ENCODING_SIZE}")
+        scale = float(np.frombuffer(body[:SCALE_DTYPE.itemsize], dtype=SCALE_DTYPE)[0])
+        if not np.isfinite(scale):
+            raise ValueError("Invalid int8 face encoding scale")
+        return np.frombuffer(body[SCALE_DTYPE.itemsize:], dtype=np.int8) * scale
+    raise ValueError(f"Unknown face encoding format byte: {code:#04x} ({len(payload)} bytes)")
+
+
+def parse_encoding(value: str) -> np.ndarray:
+    """float64 face encoding of base64 text in any format; raises ValueError when invalid"""
+    try:
+        payload = base64.b64decode(value)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid face encoding: {e}")
+    encoding = _values(payload).astype(np.float64)
+    if not np.isfinite(encoding).all():
+        raise ValueError("Face encoding has non-finite values")
+    return encoding
+
+
+def parse_encodings(value: str) -> np.ndarray:
+    """(R, 128) reference encodings of a comma-separated value; raises ValueError"""
+    encodings = [parse_encoding(part) for part in value.split(REFERENCE_SEPARATOR) if part.strip()]
+    if not encodings:
+        raise ValueError("Empty face encoding")
+    return np.stack(encodings)
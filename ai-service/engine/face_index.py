@@ -0,0 +1,170 @@
+"""
+Face identification index
+
+Keeps the face encoding of every enrolled account (users.face_encoding_data
+in terrabond_auth) in one contiguous float32 matrix, so a probe encoding is
+compared with all accounts at once instead of calling verify per account,
+e.g. to catch a banned user registering again. The matrix lives in an
+AnnIndex: below FACE_INDEX_MIN_TRAIN_SIZE encodings identification is one
+exact matrix-vector distance pass, above it only FACE_INDEX_PROBES of the
+FACE_INDEX_LISTS inverted lists are scanned. The index is loaded at
+startup and kept current through enroll/remove calls.
+
+A user may have up to FACE_MAX_REFERENCES reference encodings. Each one is
+a row of the matrix under the key user_id * FACE_MAX_REFERENCES + r, and
+identification reports every user once, at their closest reference.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from core.config import settings
+from engine.ann import AnnIndex
+from engine.face_encoding import FACE_ENCODING_SIZE, parse_encodings
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS_QUERY = text("""
+    SELECT id, face_encoding_data
+    FROM users
+    WHERE face_encoding_data IS NOT NULL AND face_encoding_data <> ''
+""")
+
+
+class FaceMatch(NamedTuple):
+    """An enrolled account close to a probe encoding"""
+    user_id: int
+    distance: float
+
+
+def _new_index() -> AnnIndex:
+    return AnnIndex(
+        lists=settings.FACE_INDEX_LISTS,
+        probes=settings.FACE_INDEX_PROBES,
+        min_train_size=settings.FACE_INDEX_MIN_TRAIN_SIZE
+    )
+
+
+class FaceIndex:
+    """1:N face search over enrolled reference encodings, keyed by user id"""
+
+    def __init__(self):
+        self.max_references = settings.FACE_MAX_REFERENCES
+        self._index = _new_index()
+        # Number of reference encodings per user; the vectors live in the index only
+        self._references: Dict[int, int] = {}
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._references)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._references
+
+    @property
+    def approximate(self) -> bool:
+        return self._index.trained
+
+    def references(self, user_id: int) -> Optional[np.ndarray]:
+        """(R, 128) float32 reference encodings of a user, or None"""
+        count = self._references.get(user_id)
+        if count is None:
+            return None
+        return np.stack([self._index.get(user_id * self.max_references + reference) for reference in range(count)])
+
+    def _checked(self, encodings: np.ndarray) -> np.ndarray:
+        encodings = np.atleast_2d(encodings)
+        if encodings.shape[1:] != (FACE_ENCODING_SIZE,):
+            raise ValueError(f"Face encoding has {encodings.shape[-1]} values, expected {FACE_ENCODING_SIZE}")
+        if len(encodings) > self.max_references:
+            raise ValueError(f"{len(encodings)} reference encodings, at most {self.max_references}")
+        return encodings.astype(np.float32)
+
+    def _add(self, index: AnnIndex, user_id: int, encodings: np.ndarray) -> None:
+        for reference, encoding in enumerate(encodings):
+            index.add(user_id * self.max_references + reference, encoding)
+
+    def enroll(self, user_id: int, encodings: np.ndarray) -> None:
+        """Replace the reference encodings of a user (one (128,) or several (R, 128))"""
+        encodings = self._checked(encodings)
+        self.remove(user_id)
+        self._add(self._index, user_id, encodings)
+        self._references[user_id] = len(encodings)
+
+    def remove(self, user_id: int) -> bool:
+        count = self._references.pop(user_id, None)
+        if count is None:
+            return False
+        for reference in range(count):
+            self._index.remove(user_id * self.max_references + reference)
+        return True
+
+    def identify(
+        self,
+        encoding: np.ndarray,
+        limit: int,
+        tolerance: float = None,
+        exclude_id: Optional[int] = None
+    ) -> List[FaceMatch]:
+        """Up to ``limit`` users within ``tolerance`` of an encoding, closest first"""
+        tolerance = settings.FACE_RECOGNITION_TOLERANCE if tolerance is None else tolerance
+        # Enough rows for ``limit`` distinct users besides the excluded one
+        keys, distances = self._index.neighbours(
+            encoding.astype(np.float32), (limit + 1) * self.max_references
+        )
+        matches = []
+        seen = set()
+        for key, distance in zip(keys, distances):
+            user_id = key // self.max_references
+            if distance > tolerance or len(matches) == limit:
+                break
+            if user_id == exclude_id or user_id in seen:
+                continue
+            seen.add(user_id)
+            matches.append(FaceMatch(user_id, float(distance)))
+        return matches
+
+    async def load(self, auth_engine) -> int:
+        """
+        (Re)load every stored encoding from terrabond_auth and return the
+        number of users. The new index is built aside and swapped in, so
+        identification keeps working meanwhile.
+        """
+        index = _new_index()
+        references = {}
+        invalid = 0
+        async with auth_engine.connect() as conn:
+            result = await conn.stream(ENCODINGS_QUERY)
+            async for user_id, value in result:
+                try:
+                    encodings = self._checked(parse_encodings(value))
+                except ValueError:
+                    invalid += 1
+                    continue
+                self._add(index, user_id, encodings)
+                references[user_id] = len(encodings)
+        await asyncio.to_thread(index.train)
+
+        self._index, self._references = index, references
+        self.loaded = True
+        if invalid:
+            logger.warning(f"Face index skipped {invalid} invalid encodings")
+        logger.info(f"Face index loaded {len(self._index)} encodings of {len(self)} users")
+        return len(self)
+
+    def snapshot(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "users": len(self),
+            "encodings": len(self._index),
+            "approximate": self.approximate,
+            "lists": self._index.lists,
+            "probes": self._index.probes
+        }
+
+
+face_index = FaceIndex()
@@ -0,0 +1,239 @@
+"""
+Compiled profiles
+
+A profile is compiled once into a compact, slotted scoring view: set
+fields become bitsets over the global vocabularies, the Big Five traits a
+packed float array, the personality type and location vocabulary ids.
+Compiled profiles are cached per user id and reused across requests for
+as long as the profile content does not change, and the profile store
+keeps only compiled profiles. UserProfile conversion happens at the API
+boundary.
+"""
+
+import math
+import struct
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Dict, FrozenSet, List, Tuple
+
+from core.config import settings
+from engine.geo import resolve_location
+from engine.vocabulary import NO_EXTRAS, NO_TOKEN, SET_FIELDS, locations, personality_types, vocabularies
+
+TRAIT_NAMES = ('openness', 'conscientiousness', 'extraversion', 'agreeableness')
+
+# Traits are packed as little-endian float64, NaN marking a missing trait
+TRAITS_FORMAT = '<4d'
+NO_TRAITS = struct.pack(TRAITS_FORMAT, *([math.nan] * len(TRAIT_NAMES)))
+
+# Identical size dicts are shared between profiles
+_shared_sizes: Dict[Tuple[int, ...], Dict[str, int]] = {}
+
+
+def _country(location: str) -> str:
+    """Country part of a "city, country" location, for unresolved locations"""
+    return location.split(',')[-1].strip()
+
+
+class CompiledProfile:
+    """
+    Compact scoring view of a profile.
+
+    Set fields hold bitsets and ``sizes`` their distinct token counts;
+    ``extras`` is None, or maps a set field to its tokens that got no bit
+    because the vocabulary was full (request profiles only);
+    ``traits`` is NO_TRAITS or TRAITS_FORMAT bytes in TRAIT_NAMES order;
+    ``mbti``, ``location`` and ``country`` are ids (NO_TOKEN when missing).
+    Locations resolved by the gazetteer also carry ``latitude``,
+    ``longitude`` and the gazetteer's ``geo_country`` id; otherwise those
+    are NaN, NaN and NO_TOKEN.
+    """
+
+    __slots__ = (
+        'id', 'interests', 'travel_styles', 'languages', 'dream_countries', 'sizes', 'extras',
+        'mbti', 'traits', 'location', 'country', 'latitude', 'longitude', 'geo_country',
+        'age', 'gender', 'looking_for'
+    )
+
+    def bits(self, field: str) -> int:
+        return getattr(self, field)
+
+    def extra(self, field: str) -> FrozenSet[str]:
+        """Tokens of a set field that have no bit"""
+        return NO_EXTRAS if self.extras is None else self.extras.get(field, NO_EXTRAS)
+
+    def trait_values(self) -> Tuple[float, ...]:
+        return struct.unpack(TRAITS_FORMAT, self.traits)
+
+    def to_fields(self) -> dict:
+        """UserProfile fields of this profile (set fields in vocabulary order, then tokens without a bit)"""
+        traits = {
+            trait: value for trait, value in zip(TRAIT_NAMES, self.trait_values())
+            if not math.isnan(value)
+        }
+        return {
+            'id': self.id,
+            'personality_type': None if self.mbti == NO_TOKEN else personality_types.token(self.mbti),
+            'personality_traits': traits or None,
+            **{
+                field: vocabularies[field].tokens(getattr(self, field)) + sorted(self.extra(field))
+                for field in SET_FIELDS
+            },
+            'location': None if self.location == NO_TOKEN else locations.token(self.location),
+            'age': self.age,
+            'gender': self.gender,
+            'looking_for': self.looking_for
+        }
+
+    def __reduce__(self):
+        # Ids are process-local, so other processes recompile from the tokens
+        return _restore, (self.to_fields(),)
+
+
+def is_complete(compiled: CompiledProfile) -> bool:
+    """Whether every set token of a compiled profile has a bit"""
+    return compiled.extras is None
+
+
+def common_tokens(features1: CompiledProfile, features2: CompiledProfile, field: str) -> List[str]:
+    """Tokens of a set field shared by two compiled profiles"""
+    tokens = vocabularies[field].tokens(features1.bits(field) & features2.bits(field))
+    if features1.extras is not None and features2.extras is not None:
+        tokens += sorted(features1.extra(field) & features2.extra(field))
+    return tokens
+
+
+def _restore(fields: dict) -> CompiledProfile:
+    return build_features(SimpleNamespace(**fields))
+
+
+def profile_signature(profile) -> Tuple:
+    """Cheap content key for the compiled fields of a profile"""
+    traits = profile.personality_traits
+    return (
+        tuple(tuple(getattr(profile, field)) for field in SET_FIELDS),
+        profile.personality_type,
+        tuple(traits.get(trait) for trait in TRAIT_NAMES) if traits else None,
+        profile.location,
+        profile.age,
+        getattr(profile, 'gender', None),
+        getattr(profile, 'looking_for', None)
+    )
+
+
+def build_features(profile, intern: bool = False) -> CompiledProfile:
+    """
+    Compile a profile (UserProfile or any object with the same attributes).
+
+    Stored profiles pass ``intern`` so every token they hold gets an id;
+    request profiles keep unknown tokens in ``extras`` once a vocabulary
+    is full.
+    """
+    compiled = CompiledProfile()
+    compiled.id = profile.id
+    compiled.extras = None
+
+    sizes = []
+    for field in SET_FIELDS:
+        bits, extra = vocabularies[field].bitset(getattr(profile, field), intern)
+        setattr(compiled, field, bits)
+        sizes.append(bits.bit_count() + len(extra))
+        if extra:
+            if compiled.extras is None:
+                compiled.extras = {}
+            compiled.extras[field] = extra
+    sizes = tuple(sizes)
+    compiled.sizes = _shared_sizes.get(sizes)
+    if compiled.sizes is None:
+        compiled.sizes = _shared_sizes.setdefault(sizes, dict(zip(SET_FIELDS, sizes)))
+
+    compiled.mbti = personality_types.intern(profile.personality_type) if profile.personality_type else NO_TOKEN
+
+    traits = profile.personality_traits
+    if traits and any(trait in traits for trait in TRAIT_NAMES):
+        compiled.traits = struct.pack(
+            TRAITS_FORMAT, *(float(traits[trait]) if trait in traits else math.nan for trait in TRAIT_NAMES)
+        )
+    else:
+        compiled.traits = NO_TRAITS
+
+    location = profile.location
+    compiled.location = locations.intern(location) if location else NO_TOKEN
+    compiled.country = locations.intern(_country(location)) if location else NO_TOKEN
+
+    place = resolve_location(location)
+    if place is None:
+        compiled.latitude = compiled.longitude = math.nan
+        compiled.geo_country = NO_TOKEN
+    else:
+        compiled.latitude = place.latitude
+        compiled.longitude = place.longitude
+        compiled.geo_country = locations.intern(place.country)
+
+    compiled.age = profile.age
+    compiled.gender = getattr(profile, 'gender', None)
+    compiled.looking_for = getattr(profile, 'looking_for', None)
+    return compiled
+
+
+class FeatureCache:
+    """
+    Bounded cache of compiled features keyed by user id.
+
+    Lookups are lock-free; eviction is insertion ordered, which is close
+    enough to LRU since a changed profile is always re-inserted.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, Tuple[Tuple, CompiledProfile]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, profile) -> CompiledProfile:
+        """Return the cached compiled profile, recompiling when its content changed"""
+        signature = profile_signature(profile)
+        entry = self._entries.get(profile.id)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+        features = build_features(profile)
+        if not is_complete(features):
+            # Its unknown tokens may be interned later by a stored profile
+            return features
+        with self._lock:
+            self._entries[profile.id] = (signature, features)
+            self._entries.move_to_end(profile.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return features
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+feature_cache = FeatureCache(settings.MATCHING_FEATURE_CACHE_SIZE)
+
+
+def compile_profile(profile) -> CompiledProfile:
+    """
+    Compiled view of a profile (compiled profiles are returned as is).
+
+    Compiled profiles are memoized on the profile object itself (profiles
+    are not mutated once parsed) and otherwise served from the shared cache.
+    """
+    if type(profile) is CompiledProfile:
+        return profile
+
+    private = getattr(profile, '__pydantic_private__', None)
+    if private is None:
+        return feature_cache.get(profile)
+
+    features = private.get('_features')
+    if features is None:
+        features = private['_features'] = feature_cache.get(profile)
+    return features
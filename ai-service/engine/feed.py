@@ -0,0 +1,175 @@
+"""
+Keyset-paginated match feed
+
+Serves a user's persisted matches from terrabond_ai.matches ordered by
+compatibility_score DESC, id. Pages are addressed by an opaque cursor
+holding the (score, id) of the last row served, so every page is an
+index range scan on the partial (userN_id, compatibility_score DESC, id)
+WHERE is_active indexes instead of an OFFSET scan. A user appears in
+either column of a match, so both sides are read and merged.
+
+The first page of recently read feeds is kept in a small in-process LRU;
+entries expire after MATCHING_FEED_CACHE_TTL_SECONDS and are dropped as
+soon as the match writer flushes a row involving the user.
+"""
+
+import base64
+import json
+import time
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from core.config import settings
+
+# Above any DECIMAL(5, 2) score: the first page starts here
+FIRST_PAGE_SCORE = Decimal('1000')
+
+FEED_QUERY = text("""
+    SELECT id, partner_id, compatibility_score, match_reasons, common_interests,
+           common_destinations, viewed
+    FROM (
+        (SELECT id, user2_id AS partner_id, compatibility_score, match_reasons,
+                common_interests, common_destinations, user1_viewed AS viewed
+         FROM matches
+         WHERE user1_id = :user_id AND is_active
+           AND compatibility_score <= :score
+           AND (compatibility_score < :score OR id > :last_id)
+         ORDER BY compatibility_score DESC, id
+         LIMIT :limit)
+        UNION ALL
+        (SELECT id, user1_id AS partner_id, compatibility_score, match_reasons,
+                common_interests, common_destinations, user2_viewed AS viewed
+         FROM matches
+         WHERE user2_id = :user_id AND is_active
+           AND compatibility_score <= :score
+           AND (compatibility_score < :score OR id > :last_id)
+         ORDER BY compatibility_score DESC, id
+         LIMIT :limit)
+    ) feed
+    ORDER BY compatibility_score DESC, id
+    LIMIT :limit
+""")
+
+
+def encode_cursor(score: Decimal, match_id: int) -> str:
+    """Opaque cursor pointing after the row (score, match_id)"""
+    payload = json.dumps([str(score), match_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Decimal, int]:
+    """(score, match_id) of a cursor; raises ValueError when malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, match_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        score = Decimal(score)
+        if not score.is_finite():
+            raise ValueError(score)
+        return score, int(match_id)
+    except (ValueError, TypeError, InvalidOperation, UnicodeEncodeError):
+        raise ValueError(f"Invalid feed cursor: {cursor!r}")
+
+
+def feed_entry(row) -> dict:
+    return {
+        "match_id": row.id,
+        "user_id": row.partner_id,
+        "compatibility_score": float(row.compatibility_score),
+        "match_reasons": row.match_reasons or [],
+        "common_interests": row.common_interests or [],
+        "common_destinations": row.common_destinations or [],
+        "viewed": bool(row.viewed)
+    }
+
+
+class FeedCache:
+    """LRU of first feed pages (one row past the page size), with a TTL"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._pages: "OrderedDict[int, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def get(self, user_id: int) -> Optional[List[dict]]:
+        entry = self._pages.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._pages.pop(user_id, None)
+            self.stats["misses"] += 1
+            return None
+        self._pages.move_to_end(user_id)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def set(self, user_id: int, rows: List[dict]) -> None:
+        if self.maxsize <= 0:
+            return
+        self._pages[user_id] = (time.monotonic() + self.ttl, rows)
+        self._pages.move_to_end(user_id)
+        while len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+
+    def invalidate_rows(self, rows: List[dict]) -> None:
+        """Drop the pages of both users of every written matches row"""
+        for row in rows:
+            for user_id in (row["user1_id"], row["user2_id"]):
+                if self._pages.pop(user_id, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self._pages), "maxsize": self.maxsize}
+
+
+class MatchFeed:
+    """Keyset pages over persisted matches"""
+
+    def __init__(self, db_engine, cache: Optional[FeedCache] = None):
+        self.db_engine = db_engine
+        self.cache = cache
+
+    async def _fetch(self, user_id: int, score: Decimal, last_id: int, limit: int) -> List[dict]:
+        async with self.db_engine.connect() as conn:
+            result = await conn.execute(
+                FEED_QUERY, {"user_id": user_id, "score": score, "last_id": last_id, "limit": limit}
+            )
+            return [feed_entry(row) for row in result]
+
+    async def page(self, user_id: int, limit: int, cursor: Optional[str] = None) -> dict:
+        """
+        One page of a user's feed and the cursor of the next one (None on
+        the last page). Raises ValueError for a malformed cursor.
+        """
+        cached = False
+        first_page = settings.MATCHING_FEED_CACHE_PAGE_SIZE
+        if cursor is not None:
+            score, last_id = decode_cursor(cursor)
+            rows = await self._fetch(user_id, score, last_id, limit + 1)
+        elif self.cache is not None and limit <= first_page:
+            rows = self.cache.get(user_id)
+            cached = rows is not None
+            if rows is None:
+                rows = await self._fetch(user_id, FIRST_PAGE_SCORE, 0, first_page + 1)
+                self.cache.set(user_id, rows)
+        else:
+            rows = await self._fetch(user_id, FIRST_PAGE_SCORE, 0, limit + 1)
+
+        # One extra row tells whether another page exists
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            # DECIMAL(5, 2) scores round-trip exactly through float repr
+            last = page[-1]
+            next_cursor = encode_cursor(Decimal(repr(last["compatibility_score"])), last["match_id"])
+
+        return {
+            "user_id": user_id,
+            "matches": page,
+            "next_cursor": next_cursor,
+            "cached": cached
+        }
@@ -0,0 +1,146 @@
+"""
+Preference pre-filtering
+
+An AttributeIndex holds the filterable attributes of a candidate pool in
+columnar form: a sorted age array for range queries, one position bitmap
+per gender and per looking_for value, posting lists for languages,
+travel styles and dream countries, and a lat/lon grid for radius queries.
+MatchingPreferences are turned into a boolean mask over candidate
+positions before anything is scored.
+
+Rules:
+- candidates with an unknown age pass the age range;
+- with a gender preference, candidates of unknown gender are excluded;
+- candidates looking for "ALL" (or nothing stated) match any looking_for;
+- list preferences keep candidates holding at least one of the values;
+- max_distance_km only keeps candidates whose location was resolved, and
+  none at all when the user's location was not.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from engine.blocking import InvertedIndex
+from engine.features import compile_profile
+from engine.geo import GridIndex
+from engine.vocabulary import vocabularies
+
+ANY_LOOKING_FOR = "ALL"
+
+# MatchingPreferences field -> candidate profile field
+LIST_FILTERS = {
+    'languages': 'languages',
+    'travel_styles': 'travel_styles',
+    'preferred_destinations': 'dream_countries',
+}
+
+
+def _category(value: Optional[str]) -> Optional[str]:
+    return value.strip().upper() if value and value.strip() else None
+
+
+class AttributeIndex:
+    """Columnar candidate attributes, appended in candidate position order"""
+
+    def __init__(self, candidates=()):
+        self._size = 0
+        self._ages: List[float] = []
+        self._genders: Dict[Optional[str], List[int]] = defaultdict(list)
+        self._looking_for: Dict[Optional[str], List[int]] = defaultdict(list)
+        self._postings = InvertedIndex(fields=tuple(LIST_FILTERS.values()))
+        self._grid = GridIndex()
+        self._sorted = None
+        self._bitmaps: Dict[tuple, np.ndarray] = {}
+        for candidate in candidates:
+            self.add(candidate)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, profile) -> int:
+        """Index a candidate and return its position"""
+        position = self._size
+        compiled = compile_profile(profile)
+        self._ages.append(np.nan if compiled.age is None else float(compiled.age))
+        self._genders[_category(compiled.gender)].append(position)
+        self._looking_for[_category(compiled.looking_for)].append(position)
+        self._postings.add(compiled)
+        self._grid.add(compiled.latitude, compiled.longitude)
+        self._size += 1
+        self._sorted = None
+        self._bitmaps = {}
+        return position
+
+    def _bitmap(self, attribute: str, value: Optional[str]) -> np.ndarray:
+        key = (attribute, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            positions = getattr(self, attribute).get(value, ())
+            bitmap = np.zeros(self._size, dtype=bool)
+            bitmap[np.asarray(positions, dtype=np.int64)] = True
+            self._bitmaps[key] = bitmap
+        return bitmap
+
+    def _age_mask(self, min_age: Optional[int], max_age: Optional[int]) -> np.ndarray:
+        if self._sorted is None:
+            ages = np.asarray(self._ages, dtype=np.float64)
+            known = np.flatnonzero(~np.isnan(ages))
+            order = known[np.argsort(ages[known], kind='stable')]
+            self._sorted = (ages[order], order, np.isnan(ages))
+        sorted_ages, order, unknown = self._sorted
+
+        low = 0 if min_age is None else np.searchsorted(sorted_ages, min_age, side='left')
+        high = len(sorted_ages) if max_age is None else np.searchsorted(sorted_ages, max_age, side='right')
+        mask = unknown.copy()
+        mask[order[low:high]] = True
+        return mask
+
+    def _any_of(self, field: str, values: List[str]) -> np.ndarray:
+        mask = np.zeros(self._size, dtype=bool)
+        for value in values:
+            token_id = vocabularies[field].lookup(value)
+            if token_id is not None:
+                mask[self._postings.posting(field, token_id)] = True
+        return mask
+
+    def mask(self, preferences, user=None) -> np.ndarray:
+        """
+        Boolean mask of the candidate positions satisfying ``preferences``
+        (``user`` is the origin of max_distance_km)
+        """
+        mask = np.ones(self._size, dtype=bool)
+        if preferences is None or not self._size:
+            return mask
+
+        if preferences.min_age is not None or preferences.max_age is not None:
+            mask &= self._age_mask(preferences.min_age, preferences.max_age)
+
+        if preferences.gender_preference:
+            genders = np.zeros(self._size, dtype=bool)
+            for gender in {_category(value) for value in preferences.gender_preference} - {None}:
+                genders |= self._bitmap('_genders', gender)
+            mask &= genders
+
+        looking_for = _category(preferences.looking_for)
+        if looking_for and looking_for != ANY_LOOKING_FOR:
+            mask &= (
+                self._bitmap('_looking_for', looking_for)
+                | self._bitmap('_looking_for', ANY_LOOKING_FOR)
+                | self._bitmap('_looking_for', None)
+            )
+
+        for preference, field in LIST_FILTERS.items():
+            values = getattr(preferences, preference)
+            if values:
+                mask &= self._any_of(field, values)
+
+        if preferences.max_distance_km is not None:
+            nearby = np.zeros(self._size, dtype=bool)
+            if user is not None:
+                origin = compile_profile(user)
+                nearby[self._grid.within(origin.latitude, origin.longitude, preferences.max_distance_km)] = True
+            mask &= nearby
+
+        return mask
@@ -0,0 +1,228 @@
+"""
+Offline geocoding and radius queries
+
+Location strings ("city, country") are resolved once, when a profile is
+compiled, against the gazetteer shipped in data/gazetteer.csv (country
+names and aliases in data/countries.csv). Resolved profiles carry their
+coordinates, so location scoring becomes a vectorized haversine over
+candidate arrays, and a lat/lon grid answers "within N km" queries.
+Strings the gazetteer cannot resolve keep the string comparison rules.
+"""
+
+import csv
+import logging
+import math
+import os
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Grid cell size; one degree of latitude is ~111 km
+CELL_DEGREES = 1.0
+
+
+class Place(NamedTuple):
+    """A resolved location"""
+    city: str
+    country: str
+    latitude: float
+    longitude: float
+
+
+def normalize(name: str) -> str:
+    """Case-, accent- and punctuation-insensitive lookup key"""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    for separator in "-'.":
+        stripped = stripped.replace(separator, ' ')
+    return ' '.join(stripped.casefold().split())
+
+
+def _aliases(value: str) -> List[str]:
+    return [alias for alias in (value or '').split('|') if alias.strip()]
+
+
+class Gazetteer:
+    """City -> coordinates lookup loaded from the bundled CSV files"""
+
+    def __init__(self):
+        self._countries: Dict[str, str] = {}
+        self._places: Dict[Tuple[str, str], Place] = {}
+        self._by_city: Dict[str, List[Place]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self._places)
+
+    @classmethod
+    def load(cls, places_path: str, countries_path: str) -> "Gazetteer":
+        gazetteer = cls()
+        with open(countries_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                for name in [row['country'], *_aliases(row['aliases'])]:
+                    gazetteer._countries[normalize(name)] = row['country']
+
+        with open(places_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                place = Place(row['city'], row['country'], float(row['latitude']), float(row['longitude']))
+                country = normalize(place.country)
+                for name in {normalize(name) for name in [place.city, *_aliases(row['aliases'])]}:
+                    gazetteer._places[(name, country)] = place
+                    gazetteer._by_city[name].append(place)
+        return gazetteer
+
+    def country(self, name: str) -> Optional[str]:
+        """Canonical country name for a country name, alias or ISO code"""
+        return self._countries.get(normalize(name))
+
+    def resolve(self, location: Optional[str]) -> Optional[Place]:
+        """
+        Resolve "city, country" (or a bare, unambiguous city name).
+
+        Returns None when the city or country is unknown, so callers fall
+        back to string comparison.
+        """
+        if not location:
+            return None
+        parts = [part.strip() for part in location.split(',') if part.strip()]
+        if not parts:
+            return None
+
+        city = normalize(parts[0])
+        if len(parts) == 1:
+            places = self._by_city.get(city, ())
+            return places[0] if len(places) == 1 else None
+
+        country = self.country(parts[-1])
+        if country is None:
+            return None
+        return self._places.get((city, normalize(country)))
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def get_gazetteer() -> Gazetteer:
+    """Lazily load the bundled gazetteer"""
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer.load(
+            os.path.join(DATA_DIR, 'gazetteer.csv'),
+            os.path.join(DATA_DIR, 'countries.csv')
+        )
+        logger.info(f"Loaded gazetteer with {len(_gazetteer)} place names")
+    return _gazetteer
+
+
+def resolve_location(location: Optional[str]) -> Optional[Place]:
+    """Place of a profile location, or None (also when geo matching is off)"""
+    if not settings.MATCHING_GEO_ENABLED:
+        return None
+    return get_gazetteer().resolve(location)
+
+
+def haversine_km(latitude, longitude, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distance from one point to arrays of points (or, with
+    broadcastable origin arrays, between two sets of points)
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes - longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_pair_km(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """haversine_km between two points, with math instead of array setup"""
+    lat1 = math.radians(latitude1)
+    lat2 = math.radians(latitude2)
+    dlat = lat2 - lat1
+    dlon = math.radians(longitude2 - longitude1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Positions bucketed into CELL_DEGREES lat/lon cells.
+
+    Positions are appended in candidate order; NaN coordinates (unresolved
+    locations) are stored but never returned by radius queries.
+    """
+
+    LONGITUDE_CELLS = int(round(360 / CELL_DEGREES))
+
+    def __init__(self):
+        self._latitudes: List[float] = []
+        self._longitudes: List[float] = []
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._arrays = None
+
+    def __len__(self) -> int:
+        return len(self._latitudes)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (
+            math.floor(latitude / CELL_DEGREES),
+            math.floor((longitude + 180) / CELL_DEGREES) % self.LONGITUDE_CELLS
+        )
+
+    def add(self, latitude: float, longitude: float) -> int:
+        """Index a candidate and return its position"""
+        position = len(self._latitudes)
+        self._latitudes.append(latitude)
+        self._longitudes.append(longitude)
+        if not math.isnan(latitude):
+            self._cells[self._cell(latitude, longitude)].append(position)
+        self._arrays = None
+        return position
+
+    def within(self, latitude: float, longitude: float, radius_km: float) -> np.ndarray:
+        """Positions (ascending) of the candidates at most ``radius_km`` away"""
+        if math.isnan(latitude) or not self._cells:
+            return np.zeros(0, dtype=np.int64)
+        if self._arrays is None:
+            self._arrays = (np.asarray(self._latitudes), np.asarray(self._longitudes))
+        latitudes, longitudes = self._arrays
+
+        # Bounding box of the circle (exact for a sphere)
+        angle = radius_km / EARTH_RADIUS_KM
+        low_lat = latitude - math.degrees(angle)
+        high_lat = latitude + math.degrees(angle)
+        ratio = math.sin(angle) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else math.inf
+        if low_lat <= -90 or high_lat >= 90 or ratio >= 1:
+            lon_span = 180.0
+        else:
+            lon_span = math.degrees(math.asin(ratio))
+        low_lat = max(-90.0, low_lat)
+        high_lat = min(90.0, high_lat)
+
+        row_range = range(math.floor(low_lat / CELL_DEGREES), math.floor(high_lat / CELL_DEGREES) + 1)
+        if lon_span >= 180.0:
+            columns = range(self.LONGITUDE_CELLS)
+        else:
+            first = math.floor((longitude - lon_span + 180) / CELL_DEGREES)
+            last = math.floor((longitude + lon_span + 180) / CELL_DEGREES)
+            columns = {column % self.LONGITUDE_CELLS for column in range(first, last + 1)}
+
+        candidates = [
+            position
+            for row in row_range for column in columns
+            for position in self._cells.get((row, column), ())
+        ]
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.sort(np.asarray(candidates, dtype=np.int64))
+        distances = haversine_km(latitude, longitude, latitudes[positions], longitudes[positions])
+        return positions[distances <= radius_km]
@@ -0,0 +1,165 @@
+"""
+Travel group formation
+
+Splits a candidate pool into disjoint groups of a fixed size (the free
+seats of a travel offer) maximizing the mean pairwise compatibility
+inside each group. The full pairwise score matrix is computed once with
+the blocked kernels of engine/reciprocal.py; groups are then built
+greedily and improved by swap local search until no swap helps or the
+time budget runs out. The current solution is always valid, so the
+search can stop at any point (anytime).
+"""
+
+import time
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+from core.config import settings
+from engine.reciprocal import ProfileMatrix, block_totals
+
+# Swaps must improve the objective by more than float noise
+MIN_GAIN = 1e-9
+
+
+class GroupResult(NamedTuple):
+    """Groups as lists of pool positions, with the search statistics"""
+    groups: List[List[int]]
+    scores: np.ndarray
+    iterations: int
+    converged: bool
+
+
+def score_matrix(profiles: Sequence, block_size: int = None) -> np.ndarray:
+    """Symmetric (N, N) matrix of raw compatibility scores, 0 on the diagonal"""
+    block_size = block_size or settings.MATCHING_RECIPROCAL_BLOCK_SIZE
+    matrix = ProfileMatrix(profiles)
+    count = matrix.size
+    scores = np.zeros((count, count))
+    for row_start in range(0, count, block_size):
+        rows = slice(row_start, min(row_start + block_size, count))
+        for col_start in range(row_start, count, block_size):
+            cols = slice(col_start, min(col_start + block_size, count))
+            block = block_totals(matrix, rows, cols)
+            scores[rows, cols] = block
+            scores[cols, rows] = block.T
+    np.fill_diagonal(scores, 0.0)
+    return scores
+
+
+def _greedy(scores: np.ndarray, group_size: int, max_groups: int) -> np.ndarray:
+    """
+    Initial assignment (group number per position, -1 when unassigned).
+
+    Seeds are taken by decreasing sum of their best group_size - 1 scores;
+    each group then grows with the candidate closest to its members.
+    """
+    count = len(scores)
+    assignment = np.full(count, -1, dtype=np.int64)
+    if group_size > 1:
+        best = np.partition(scores, count - group_size + 1, axis=1)[:, count - group_size + 1:]
+        strength = best.sum(axis=1)
+    else:
+        strength = np.zeros(count)
+    seeds = np.argsort(-strength, kind='stable')
+
+    group = 0
+    for seed in seeds:
+        if group == max_groups or (assignment == -1).sum() < group_size:
+            break
+        if assignment[seed] != -1:
+            continue
+        assignment[seed] = group
+        affinity = scores[seed].copy()
+        for _ in range(group_size - 1):
+            affinity[assignment != -1] = -np.inf
+            member = int(np.argmax(affinity))
+            assignment[member] = group
+            affinity += scores[member]
+        group += 1
+    return assignment
+
+
+def _local_search(scores: np.ndarray, assignment: np.ndarray, groups: int, deadline: float) -> tuple:
+    """
+    Swap local search: exchange a group member with an unassigned
+    candidate or with a member of another group whenever that raises the
+    sum of intra-group scores. Returns (iterations, converged).
+    """
+    count = len(scores)
+    membership = np.zeros((count, groups))
+    assigned = np.flatnonzero(assignment != -1)
+    membership[assigned, assignment[assigned]] = 1.0
+    # affinity[v, g]: sum of the scores of v with the members of group g
+    affinity = scores @ membership
+
+    iterations = 0
+    improved = True
+    while improved:
+        improved = False
+        for member in np.flatnonzero(assignment != -1):
+            if time.perf_counter() >= deadline:
+                return iterations, False
+            group = assignment[member]
+            others = assignment.copy()
+            other_groups = np.maximum(others, 0)
+
+            gain = affinity[:, group] - affinity[member, group] - scores[member]
+            in_other = (others != -1) & (others != group)
+            gain = np.where(
+                in_other,
+                gain + affinity[member, other_groups] - affinity[np.arange(count), other_groups] - scores[member],
+                gain
+            )
+            gain[others == group] = -np.inf
+
+            candidate = int(np.argmax(gain))
+            iterations += 1
+            if gain[candidate] <= MIN_GAIN:
+                continue
+
+            target = assignment[candidate]
+            assignment[member], assignment[candidate] = target, group
+            affinity[:, group] += scores[:, candidate] - scores[:, member]
+            if target != -1:
+                affinity[:, target] += scores[:, member] - scores[:, candidate]
+            improved = True
+    return iterations, True
+
+
+def form_groups(
+    profiles: Sequence,
+    group_size: int,
+    max_groups: int = None,
+    time_budget_ms: float = None
+) -> GroupResult:
+    """
+    Disjoint groups of ``group_size`` profiles with a high mean pairwise
+    compatibility, best group first. ``scores`` holds each group's mean
+    raw compatibility.
+
+    ``time_budget_ms`` bounds the local search; the score matrix and the
+    greedy start are always computed.
+    """
+    time_budget_ms = settings.MATCHING_GROUP_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+    count = len(profiles)
+    group_size = min(group_size, count)
+    if group_size <= 0:
+        return GroupResult([], np.zeros(0), 0, True)
+    max_groups = count // group_size if max_groups is None else min(count // group_size, max_groups)
+
+    scores = score_matrix(profiles)
+    assignment = _greedy(scores, group_size, max_groups)
+    iterations, converged = 0, True
+    if group_size > 1:
+        deadline = time.perf_counter() + time_budget_ms / 1000
+        iterations, converged = _local_search(scores, assignment, max_groups, deadline)
+
+    groups = [np.flatnonzero(assignment == group) for group in range(max_groups)]
+    pairs = group_size * (group_size - 1)
+    means = np.array([
+        scores[np.ix_(members, members)].sum() / pairs if pairs else 0.0
+        for members in groups
+    ])
+    order = np.argsort(-means, kind='stable')
+    return GroupResult([groups[index].tolist() for index in order], means[order], iterations, converged)
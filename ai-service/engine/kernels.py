@@ -0,0 +1,135 @@
+"""
+Personality scoring kernels
+
+One-to-many kernels for the batch scorer, plus a scalar version of the
+same formula for single pairs, where array setup costs more than the
+arithmetic. MBTI bonuses come from a 16x16 table indexed by personality
+type id, and Big Five similarity is a masked L1 kernel over trait
+matrices (NaN marks a missing trait).
+"""
+
+import math
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from engine.vocabulary import MBTI_TYPES, NO_TOKEN
+
+COMPLEMENTARY_MBTI_PAIRS = frozenset([
+    ('INTJ', 'ENFP'), ('INTJ', 'ENTP'),
+    ('INTP', 'ENFJ'), ('INTP', 'ENTJ'),
+    ('ENTJ', 'INFP'), ('ENTJ', 'INTP'),
+    ('ENTP', 'INFJ'), ('ENTP', 'INTJ'),
+    ('INFJ', 'ENFP'), ('INFJ', 'ENTP'),
+    ('INFP', 'ENFJ'), ('INFP', 'ENTJ'),
+    ('ENFJ', 'INFP'), ('ENFJ', 'ISFP'),
+    ('ENFP', 'INFJ'), ('ENFP', 'INTJ'),
+    ('ISTJ', 'ESFP'), ('ISTJ', 'ESTP'),
+    ('ISFJ', 'ESFP'), ('ISFJ', 'ESTP'),
+    ('ESTJ', 'ISFP'), ('ESTJ', 'ISTP'),
+    ('ESFJ', 'ISFP'), ('ESFJ', 'ISTP'),
+    ('ISTP', 'ESFJ'), ('ISTP', 'ESTJ'),
+    ('ISFP', 'ESFJ'), ('ISFP', 'ESTJ'),
+    ('ESTP', 'ISFJ'), ('ESTP', 'ISTJ'),
+    ('ESFP', 'ISFJ'), ('ESFP', 'ISTJ')
+])
+
+COMPLEMENTARY_BONUS = 0.3
+SAME_TYPE_BONUS = 0.2
+OTHER_TYPE_BONUS = 0.1
+
+
+def mbti_bonus(mbti1: str, mbti2: str) -> float:
+    """MBTI bonus added to the 0.5 personality base score"""
+    if (mbti1, mbti2) in COMPLEMENTARY_MBTI_PAIRS or (mbti2, mbti1) in COMPLEMENTARY_MBTI_PAIRS:
+        return COMPLEMENTARY_BONUS
+    if mbti1 == mbti2:
+        return SAME_TYPE_BONUS
+    return OTHER_TYPE_BONUS
+
+
+# Bonus of every pair of standard types, indexed by personality type id
+MBTI_TABLE = np.array([[mbti_bonus(mbti1, mbti2) for mbti2 in MBTI_TYPES] for mbti1 in MBTI_TYPES])
+
+
+def mbti_bonuses(user_code: int, codes: np.ndarray) -> np.ndarray:
+    """
+    MBTI bonus of the user's type id against every candidate type id.
+
+    Ids past the table are non-standard strings: never complementary, so
+    they only get the same-type bonus against themselves. Candidates
+    without a type (NO_TOKEN) get 0.
+    """
+    bonus = np.where(codes == user_code, SAME_TYPE_BONUS, OTHER_TYPE_BONUS)
+    if 0 <= user_code < len(MBTI_TYPES):
+        standard = (codes >= 0) & (codes < len(MBTI_TYPES))
+        bonus[standard] = MBTI_TABLE[user_code, codes[standard]]
+    bonus[codes == NO_TOKEN] = 0.0
+    return bonus
+
+
+def trait_l1(user_traits: np.ndarray, traits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Masked L1 kernel between one trait vector and an (N, 4) trait matrix.
+
+    Returns the sum of |user - candidate| over the traits both sides have,
+    accumulated in trait order, and the number of such traits.
+    """
+    count = len(traits)
+    diff_sum = np.zeros(count)
+    diff_count = np.zeros(count, dtype=np.int64)
+    for column in np.flatnonzero(~np.isnan(user_traits)):
+        values = traits[:, column]
+        present = ~np.isnan(values)
+        diff_sum = np.where(present, diff_sum + np.abs(user_traits[column] - values), diff_sum)
+        diff_count += present
+    return diff_sum, diff_count
+
+
+def personality_kernel(
+    user_code: int,
+    user_traits: Optional[np.ndarray],
+    codes: np.ndarray,
+    traits: Optional[np.ndarray]
+) -> np.ndarray:
+    """
+    Personality score of one user against N candidates: 0.5 base, plus the
+    MBTI bonus when both have a type, plus (1 - mean trait distance) * 0.2
+    when they share at least one trait, capped at 1.
+
+    ``user_traits`` is None when the user has no traits; ``traits`` may
+    then be None too.
+    """
+    count = len(codes)
+    score = np.full(count, 0.5)
+
+    if user_code != NO_TOKEN:
+        score = np.where(codes != NO_TOKEN, 0.5 + mbti_bonuses(user_code, codes), score)
+
+    if user_traits is not None:
+        diff_sum, diff_count = trait_l1(user_traits, traits)
+        has_traits = diff_count > 0
+        avg_diff = np.divide(diff_sum, diff_count, out=np.zeros(count), where=has_traits)
+        score = np.where(has_traits, score + (1 - avg_diff) * 0.2, score)
+
+    return np.minimum(1.0, score)
+
+
+def personality_pair(user_code: int, user_traits: Sequence[float], code: int, traits: Sequence[float]) -> float:
+    """personality_kernel for a single candidate, in plain Python floats"""
+    score = 0.5
+    if user_code != NO_TOKEN and code != NO_TOKEN:
+        if 0 <= user_code < len(MBTI_TYPES) and 0 <= code < len(MBTI_TYPES):
+            score = 0.5 + float(MBTI_TABLE[user_code, code])
+        else:
+            score = 0.5 + (SAME_TYPE_BONUS if code == user_code else OTHER_TYPE_BONUS)
+
+    diff_sum = 0.0
+    diff_count = 0
+    for user_value, value in zip(user_traits, traits):
+        if not (math.isnan(user_value) or math.isnan(value)):
+            diff_sum += abs(user_value - value)
+            diff_count += 1
+    if diff_count:
+        score += (1 - diff_sum / diff_count) * 0.2
+    return min(1.0, score)
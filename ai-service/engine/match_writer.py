@@ -0,0 +1,191 @@
+"""
+Buffered bulk writer for the matches table
+
+Match results are buffered in memory (one entry per pair, last write
+wins) and flushed to terrabond_ai.matches with a pipelined
+INSERT ... ON CONFLICT DO UPDATE, either when the buffer reaches
+MATCHING_WRITER_BATCH_SIZE rows or every MATCHING_WRITER_FLUSH_INTERVAL
+seconds. Producers wait when MATCHING_WRITER_MAX_PENDING rows are
+already buffered, so a slow database pushes back instead of growing the
+buffer without bound.
+
+database/init.sql only runs on a fresh volume, so columns added to
+matches after the first release are created by ensure_schema, which the
+writer runs before its first flush.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Viewed flags are owned by the backend and never overwritten here
+UPSERT_MATCH = text("""
+    INSERT INTO matches (user1_id, user2_id, compatibility_score, match_reasons,
+                         common_interests, common_destinations, is_active, updated_at)
+    VALUES (:user1_id, :user2_id, :compatibility_score, :match_reasons,
+            :common_interests, :common_destinations, TRUE, CURRENT_TIMESTAMP)
+    ON CONFLICT (user1_id, user2_id) DO UPDATE SET
+        compatibility_score = EXCLUDED.compatibility_score,
+        match_reasons = EXCLUDED.match_reasons,
+        common_interests = EXCLUDED.common_interests,
+        common_destinations = EXCLUDED.common_destinations,
+        is_active = TRUE,
+        updated_at = CURRENT_TIMESTAMP
+""")
+
+# Columns added to matches since the first release (idempotent)
+MATCHES_MIGRATIONS = (
+    text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+)
+
+
+async def ensure_schema(db_engine) -> None:
+    """Bring an existing matches table up to date"""
+    async with db_engine.begin() as conn:
+        for statement in MATCHES_MIGRATIONS:
+            await conn.execute(statement)
+
+
+class WriterBackpressure(Exception):
+    """Raised when a row could not be buffered before the timeout"""
+
+
+def match_row(user_id: int, candidate_id: int, compatibility) -> dict:
+    """matches row for a pair, stored once with user1_id < user2_id"""
+    if not isinstance(compatibility, dict):
+        compatibility = compatibility.model_dump()
+    user1_id, user2_id = sorted((user_id, candidate_id))
+    return {
+        "user1_id": user1_id,
+        "user2_id": user2_id,
+        "compatibility_score": compatibility["compatibility_score"],
+        "match_reasons": compatibility["match_reasons"],
+        "common_interests": compatibility["common_interests"],
+        "common_destinations": compatibility["common_destinations"]
+    }
+
+
+class MatchWriter:
+    """Size- and time-triggered bulk upserts with bounded buffering"""
+
+    def __init__(
+        self,
+        db_engine,
+        batch_size: int = None,
+        flush_interval: float = None,
+        max_pending: int = None,
+        on_flush: Optional[Callable[[List[dict]], None]] = None
+    ):
+        self.db_engine = db_engine
+        # Called with every chunk of rows once it is written
+        self.on_flush = on_flush
+        self.batch_size = batch_size or settings.MATCHING_WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.MATCHING_WRITER_FLUSH_INTERVAL
+        self.max_pending = max(max_pending or settings.MATCHING_WRITER_MAX_PENDING, self.batch_size)
+        self._buffer: Dict[Tuple[int, int], dict] = {}
+        self._changed = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+        self.stats = {"written": 0, "flushes": 0, "failed_flushes": 0}
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def start(self) -> None:
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(raise_errors=False)
+
+    async def put(self, user_id: int, candidate_id: int, compatibility, timeout: float = None) -> None:
+        """
+        Buffer one result, waiting while the buffer is full.
+
+        Raises WriterBackpressure if no room frees up within ``timeout``.
+        """
+        row = match_row(user_id, candidate_id, compatibility)
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: len(self._buffer) < self.max_pending),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                raise WriterBackpressure(f"{len(self._buffer)} match rows pending")
+            self._buffer[(row["user1_id"], row["user2_id"])] = row
+            if len(self._buffer) >= self.batch_size:
+                self._changed.notify_all()
+
+    async def _run(self) -> None:
+        while True:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: len(self._buffer) >= self.batch_size),
+                        self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            failures = self.stats["failed_flushes"]
+            await self.flush(raise_errors=False)
+            if self.stats["failed_flushes"] > failures:
+                # Back off instead of hammering an unavailable database
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self, raise_errors: bool = True) -> int:
+        """Write every buffered row; returns the number of rows written"""
+        async with self._flush_lock:
+            async with self._changed:
+                rows = self._buffer
+                self._buffer = {}
+            if not rows:
+                return 0
+
+            pending = list(rows.values())
+            written = 0
+            try:
+                if not self._schema_ready:
+                    await ensure_schema(self.db_engine)
+                    self._schema_ready = True
+                for start in range(0, len(pending), self.batch_size):
+                    chunk = pending[start:start + self.batch_size]
+                    async with self.db_engine.begin() as conn:
+                        await conn.execute(UPSERT_MATCH, chunk)
+                    written += len(chunk)
+                    if self.on_flush is not None:
+                        self.on_flush(chunk)
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                logger.error(f"Match flush failed after {written} rows: {e}")
+                # Put back unwritten rows unless a newer result replaced them
+                async with self._changed:
+                    for row in pending[written:]:
+                        self._buffer.setdefault((row["user1_id"], row["user2_id"]), row)
+                if raise_errors:
+                    raise
+            finally:
+                self.stats["written"] += written
+                self.stats["flushes"] += 1
+                async with self._changed:
+                    self._changed.notify_all()
+            return written
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": len(self._buffer), "max_pending": self.max_pending}
@@ -0,0 +1,217 @@
+"""
+Multi-core sharded matching
+
+Large candidate pools are split into contiguous shards that are ranked in
+a process pool, so CPU-bound scoring neither holds the GIL nor stalls the
+event loop. Profiles are never pickled to the workers: the pool is
+compiled once into ProfileMatrix columns placed in one shared memory
+segment, and every worker ranks its slice of them in place.
+
+Before sharding, the k candidates with the best upper bounds are scored
+in-process; their k-th score is a lower bound of the global k-th score,
+so it is passed to every shard as the pruning threshold instead of each
+shard pruning against its own k-th score. The shard results are merged.
+
+A worker dying (OOM kill, crash) breaks the whole process pool; the pool
+is then dropped, so the next call starts a fresh one, and the interrupted
+work is redone in-process.
+
+Pools up to MATCHING_SHARD_SIZE are ranked in-process, in a worker
+thread so the event loop keeps serving other requests. The default only
+shards pools that take a few hundred milliseconds to rank; tune it with
+benchmarks/matching.py --shard-size on the target host (0 disables
+sharding).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from engine.batch import BatchScores, round_scores
+from engine.reciprocal import ProfileMatrix, pair_scores
+from engine.topk import TopKResult, matrix_top_k, matrix_upper_bounds, top_k
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Column name -> (byte offset, shape, dtype) inside a shared segment
+ColumnLayout = Dict[str, Tuple[int, tuple, str]]
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Lazily start the matching process pool"""
+    global _pool
+    if _pool is None:
+        workers = settings.MATCHING_WORKERS or os.cpu_count() or 1
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        logger.info(f"Started matching process pool with {workers} workers")
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the matching process pool, if it was started"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_pool(task, *args):
+    """
+    Run ``task(*args)`` in the matching process pool, or in a thread when
+    the pool turns out to be broken (the pool is restarted on next use).
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_pool(), task, *args)
+    except BrokenProcessPool:
+        logger.warning(f"Matching process pool is broken, restarting it; running {task.__name__} in a thread")
+        shutdown_pool()
+        return await asyncio.to_thread(task, *args)
+
+
+class SharedColumns:
+    """The columns of a ProfileMatrix copied into one shared memory segment"""
+
+    def __init__(self, matrix: ProfileMatrix):
+        columns = matrix.columns()
+        # Object columns (tokens without a bit) cannot be shared; they are sent with each shard
+        self.objects = {name: column for name, column in columns.items() if column.dtype == object}
+        columns = {name: column for name, column in columns.items() if name not in self.objects}
+        self.layout: ColumnLayout = {}
+        offset = 0
+        for name, column in columns.items():
+            self.layout[name] = (offset, column.shape, column.dtype.str)
+            # Keep every column 8-byte aligned
+            offset += (column.nbytes + 7) // 8 * 8
+        self._segment = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self._segment.name
+        for name, column in columns.items():
+            _view(self._segment, self.layout[name])[...] = column
+
+    def close(self) -> None:
+        """Release and remove the segment (workers still attached keep their mapping)"""
+        self._segment.close()
+        self._segment.unlink()
+
+
+def _view(segment: shared_memory.SharedMemory, spec: tuple) -> np.ndarray:
+    offset, shape, dtype = spec
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+
+
+def _rank_shard(
+    segment, layout: ColumnLayout, objects, user_columns, start: int, stop: int, k: int, min_score
+) -> TopKResult:
+    columns = {name: _view(segment, spec)[start:stop] for name, spec in layout.items()}
+    pool = ProfileMatrix.from_columns({**columns, **objects})
+    return matrix_top_k(ProfileMatrix.from_columns(user_columns), pool, k, min_score=min_score)
+
+
+def shard_top_k(
+    segment_name: str,
+    layout: ColumnLayout,
+    objects: Dict[str, np.ndarray],
+    user_columns: Dict[str, np.ndarray],
+    start: int,
+    stop: int,
+    k: int,
+    min_score: Optional[float]
+) -> TopKResult:
+    """
+    Worker task: top-k of rows [start, stop) of a shared pool matrix,
+    ``objects`` holding the object columns of those rows
+    """
+    segment = shared_memory.SharedMemory(name=segment_name)
+    try:
+        # Results are fresh arrays, so no view of the segment outlives this call
+        return _rank_shard(segment, layout, objects, user_columns, start, stop, k, min_score)
+    finally:
+        try:
+            segment.close()
+        except BufferError:
+            # A traceback still holds views; the mapping goes away with it
+            pass
+
+
+def merge_top_k(results: List[TopKResult], offsets: List[int], k: int) -> TopKResult:
+    """
+    Merge per-shard top-k results into the global top-k.
+
+    Shards are contiguous slices, so offset + local index preserves the
+    original candidate order used to break ties.
+    """
+    indices = np.concatenate([result.indices + offset for result, offset in zip(results, offsets)])
+    columns = [
+        np.concatenate([getattr(result.scores, field) for result in results])
+        for field in BatchScores._fields
+    ]
+    order = np.lexsort((indices, -round_scores(columns[-1])))[:k]
+    return TopKResult(
+        indices[order],
+        BatchScores(*(column[order] for column in columns)),
+        sum(result.scored for result in results)
+    )
+
+
+def prepare_shards(user, candidates, k: int) -> tuple:
+    """
+    Compile the user and the pool into matrices, copy the pool into shared
+    memory and score the k best-bounded candidates. Returns (user matrix,
+    shared columns, pruning threshold or None, candidates scored).
+    """
+    user_matrix = ProfileMatrix([user])
+    pool = ProfileMatrix(candidates)
+    bounds = round_scores(matrix_upper_bounds(user_matrix, pool))
+    seeds = np.argsort(-bounds, kind='stable')[:k]
+    min_score = None
+    if len(seeds) == k:
+        min_score = float(round_scores(pair_scores(user_matrix, pool.take(seeds)).total[0]).min())
+    return user_matrix, SharedColumns(pool), min_score, len(seeds)
+
+
+async def parallel_top_k(user, candidates, k: int) -> TopKResult:
+    """
+    Top-k of ``candidates`` for ``user``, sharded over the process pool
+    when sharding is enabled and the pool is larger than
+    MATCHING_SHARD_SIZE, ranked in a thread otherwise.
+    """
+    shard_size = settings.MATCHING_SHARD_SIZE
+    if not shard_size or len(candidates) <= shard_size or k <= 0:
+        return await asyncio.to_thread(top_k, user, candidates, k)
+
+    user_matrix, shared, min_score, seeded = await asyncio.to_thread(prepare_shards, user, candidates, k)
+    offsets = list(range(0, len(candidates), shard_size))
+    loop = asyncio.get_running_loop()
+    user_columns = user_matrix.columns()
+    try:
+        pool = get_pool()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                pool, shard_top_k, shared.name, shared.layout,
+                {name: column[offset:offset + shard_size] for name, column in shared.objects.items()},
+                user_columns, offset, min(offset + shard_size, len(candidates)), k, min_score
+            )
+            for offset in offsets
+        ))
+    except BrokenProcessPool:
+        logger.warning("Matching process pool is broken, restarting it; ranking in a thread")
+        shutdown_pool()
+        return await asyncio.to_thread(top_k, user, candidates, k)
+    finally:
+        shared.close()
+    result = merge_top_k(results, offsets, k)
+    return result._replace(scored=result.scored + seeded)
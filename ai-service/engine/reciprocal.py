@@ -0,0 +1,347 @@
+"""
+Reciprocal (mutual) top-k matching
+
+Compatibility is symmetric, so for a set of users the pairwise score
+matrix only needs its upper triangle. The matrix is computed in square
+blocks: every block scores B x B pairs with 2D versions of the batch
+kernels (set overlaps become one float32 matrix product per field), and
+each user keeps a running top-k of (rounded score, index) keys. A pair is
+mutual when each side is in the other's top-k.
+
+Every component follows engine/batch.py operation for operation, so a
+user's top-k is the one find-matches returns over the same pool order.
+"""
+
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.config import settings
+from engine.batch import (
+    TRAVEL_FIELD_WEIGHTS,
+    BatchScores,
+    mbti_codes,
+    round_scores,
+    set_sizes,
+    trait_matrix,
+    weighted_total,
+)
+from engine.features import compile_profile
+from engine.geo import haversine_km
+from engine.kernels import MBTI_TABLE, OTHER_TYPE_BONUS, SAME_TYPE_BONUS
+from engine.vocabulary import MBTI_TYPES, NO_TOKEN, SET_FIELDS, pack_bitsets, vocabularies
+
+# Rounded percentages have two decimals, so keys rank them as integers
+SCORE_STEPS = 10000
+
+
+class MutualMatches(NamedTuple):
+    """Mutual pairs as (N, 2) positions with each side's rank of the other"""
+    pairs: np.ndarray
+    ranks: np.ndarray
+    scored: int
+
+
+class ProfileMatrix:
+    """Columnar view of a set of compiled profiles for block scoring"""
+
+    def __init__(self, profiles: Sequence = ()):
+        compiled = [compile_profile(profile) for profile in profiles]
+        self.size = len(compiled)
+        self.mbti = mbti_codes(compiled)
+        self.traits = trait_matrix(compiled)
+        self.bits = {
+            field: pack_bitsets((profile.bits(field) for profile in compiled), vocabularies[field].word_count())
+            for field in SET_FIELDS
+        }
+        self.sizes = {field: set_sizes(compiled, field) for field in SET_FIELDS}
+        # Tokens without a bit, as object columns of the fields where any profile has some
+        self.extras = {}
+        for field in SET_FIELDS:
+            if any(profile.extras is not None and field in profile.extras for profile in compiled):
+                self.extras[field] = np.fromiter(
+                    (profile.extra(field) for profile in compiled), dtype=object, count=self.size
+                )
+
+        def column(attribute, dtype):
+            return np.fromiter((getattr(profile, attribute) for profile in compiled), dtype=dtype, count=self.size)
+
+        self.location = column('location', np.int64)
+        self.country = column('country', np.int64)
+        self.geo_country = column('geo_country', np.int64)
+        self.latitude = column('latitude', np.float64)
+        self.longitude = column('longitude', np.float64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Every column by name, e.g. to ship the matrix to another process"""
+        columns = {name: getattr(self, name) for name in COLUMNS}
+        for field in SET_FIELDS:
+            columns[f'bits_{field}'] = self.bits[field]
+            columns[f'sizes_{field}'] = self.sizes[field]
+        for field, extras in self.extras.items():
+            columns[f'extras_{field}'] = extras
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray]) -> "ProfileMatrix":
+        """Matrix over existing columns (as returned by columns()), without copying them"""
+        matrix = cls.__new__(cls)
+        for name in COLUMNS:
+            setattr(matrix, name, columns[name])
+        matrix.bits = {field: columns[f'bits_{field}'] for field in SET_FIELDS}
+        matrix.sizes = {field: columns[f'sizes_{field}'] for field in SET_FIELDS}
+        matrix.extras = {field: columns[f'extras_{field}'] for field in SET_FIELDS if f'extras_{field}' in columns}
+        matrix.size = len(matrix.mbti)
+        return matrix
+
+    def take(self, rows) -> "ProfileMatrix":
+        """Matrix of some rows (a slice gives views, an index array copies)"""
+        return ProfileMatrix.from_columns({name: column[rows] for name, column in self.columns().items()})
+
+    def indicators(self, field: str, words: int) -> np.ndarray:
+        """Dense 0/1 token matrix of the first ``words`` bitset words of one set field"""
+        as_bytes = np.ascontiguousarray(self.bits[field][:, :words]).view(np.uint8)
+        return np.unpackbits(as_bytes, axis=1, bitorder='little').astype(np.float32)
+
+
+# Per-profile columns besides the set field bitsets and sizes
+COLUMNS = ('mbti', 'traits', 'location', 'country', 'geo_country', 'latitude', 'longitude')
+
+
+def _personality(rows: ProfileMatrix, cols: ProfileMatrix) -> np.ndarray:
+    """personality_kernel for every (row, col) pair"""
+    row_codes = rows.mbti[:, None]
+    col_codes = cols.mbti[None, :]
+
+    bonus = np.where(row_codes == col_codes, SAME_TYPE_BONUS, OTHER_TYPE_BONUS)
+    standard = (row_codes >= 0) & (row_codes < len(MBTI_TYPES)) & (col_codes >= 0) & (col_codes < len(MBTI_TYPES))
+    table = MBTI_TABLE[
+        np.clip(row_codes, 0, len(MBTI_TYPES) - 1),
+        np.clip(col_codes, 0, len(MBTI_TYPES) - 1)
+    ]
+    bonus = np.where(standard, table, bonus)
+    score = np.where((row_codes != NO_TOKEN) & (col_codes != NO_TOKEN), 0.5 + bonus, 0.5)
+
+    # Masked L1 over the traits both sides have, accumulated in trait order
+    row_traits = rows.traits
+    col_traits = cols.traits
+    diff_sum = np.zeros(score.shape)
+    diff_count = np.zeros(score.shape, dtype=np.int64)
+    for column in range(row_traits.shape[1]):
+        user_values = row_traits[:, column][:, None]
+        values = col_traits[:, column][None, :]
+        present = ~np.isnan(user_values) & ~np.isnan(values)
+        diff_sum = np.where(present, diff_sum + np.abs(user_values - values), diff_sum)
+        diff_count += present
+
+    has_traits = diff_count > 0
+    avg_diff = np.divide(diff_sum, diff_count, out=np.zeros(score.shape), where=has_traits)
+    score = np.where(has_traits, score + (1 - avg_diff) * 0.2, score)
+    return np.minimum(1.0, score)
+
+
+def _common(rows: ProfileMatrix, cols: ProfileMatrix, field: str) -> np.ndarray:
+    """Shared token counts of one set field as a matrix product"""
+    # Matrices packed at different vocabulary sizes share no token past the narrower one
+    words = min(rows.bits[field].shape[1], cols.bits[field].shape[1])
+    common = rows.indicators(field, words) @ cols.indicators(field, words).T
+    common = common.astype(np.int64)
+    if field in rows.extras and field in cols.extras:
+        _add_extra_common(common, rows.extras[field], cols.extras[field])
+    return common
+
+
+def _add_extra_common(common: np.ndarray, row_extras: np.ndarray, col_extras: np.ndarray) -> None:
+    """Add the shared tokens without a bit (only request profiles have any) to ``common``"""
+    holders = [(col, extra) for col, extra in enumerate(col_extras) if extra]
+    for row, extra in enumerate(row_extras):
+        if extra:
+            for col, other in holders:
+                common[row, col] += len(extra & other)
+
+
+def _interests(rows: ProfileMatrix, cols: ProfileMatrix) -> np.ndarray:
+    """interests_scores for every (row, col) pair"""
+    common = _common(rows, cols, 'interests')
+    row_sizes = rows.sizes['interests'][:, None]
+    col_sizes = cols.sizes['interests'][None, :]
+
+    union = col_sizes + row_sizes - common
+    score = np.full(common.shape, 0.3)
+    scored = (row_sizes > 0) & (col_sizes > 0)
+    score[scored] = common[scored] / union[scored]
+    return score
+
+
+def _travel(rows: ProfileMatrix, cols: ProfileMatrix) -> np.ndarray:
+    """travel_scores for every (row, col) pair"""
+    score = np.zeros((rows.size, cols.size))
+    for field, weight in TRAVEL_FIELD_WEIGHTS:
+        common = _common(rows, cols, field)
+        largest = np.maximum(cols.sizes[field][None, :], rows.sizes[field][:, None])
+        ratio = np.zeros(common.shape)
+        shared = common > 0
+        ratio[shared] = common[shared] / largest[shared] * weight
+        score = score + ratio
+    return np.minimum(1.0, score)
+
+
+def location_block(rows: ProfileMatrix, cols: ProfileMatrix) -> np.ndarray:
+    """location_scores for every (row, col) pair"""
+    row_locations = rows.location[:, None]
+    col_locations = cols.location[None, :]
+
+    score = np.where(rows.country[:, None] == cols.country[None, :], 0.7, 0.3)
+    score[np.broadcast_to(row_locations == col_locations, score.shape)] = 1.0
+
+    row_latitudes = rows.latitude[:, None]
+    col_latitudes = cols.latitude[None, :]
+    resolved = ~np.isnan(row_latitudes) & ~np.isnan(col_latitudes)
+    if resolved.any():
+        distance = haversine_km(row_latitudes, rows.longitude[:, None], col_latitudes, cols.longitude[None, :])
+        same_country = rows.geo_country[:, None] == cols.geo_country[None, :]
+        by_distance = np.where(
+            distance <= settings.MATCHING_GEO_NEAR_KM,
+            1.0,
+            np.where(same_country | (distance <= settings.MATCHING_GEO_REGION_KM), 0.7, 0.3)
+        )
+        score = np.where(resolved, by_distance, score)
+
+    missing = (row_locations == NO_TOKEN) | (col_locations == NO_TOKEN)
+    return np.where(missing, 0.5, score)
+
+
+def pair_scores(rows: ProfileMatrix, cols: ProfileMatrix) -> BatchScores:
+    """Raw (0-1) component scores of every (row, col) pair, as (R, C) arrays"""
+    personality = _personality(rows, cols)
+    interests = _interests(rows, cols)
+    travel = _travel(rows, cols)
+    location = location_block(rows, cols)
+    return BatchScores(personality, interests, travel, location, weighted_total(personality, interests, travel, location))
+
+
+def block_totals(matrix: ProfileMatrix, rows: slice, cols: slice) -> np.ndarray:
+    """Raw (0-1) compatibility scores of a block of pairs"""
+    return pair_scores(matrix.take(rows), matrix.take(cols)).total
+
+
+def _rounded(total: np.ndarray) -> np.ndarray:
+    return round_scores(total.ravel()).reshape(total.shape)
+
+
+def block_scores(matrix: ProfileMatrix, rows: slice, cols: slice) -> np.ndarray:
+    """Rounded compatibility percentages of a block of pairs"""
+    return _rounded(block_totals(matrix, rows, cols))
+
+
+def _merge(best: np.ndarray, keys: np.ndarray, k: int) -> np.ndarray:
+    """Keep the k smallest keys of every row"""
+    merged = np.concatenate([best, keys], axis=1)
+    if merged.shape[1] <= k:
+        return merged
+    return np.partition(merged, k - 1, axis=1)[:, :k]
+
+
+def mutual_top_k(profiles: Sequence, k: int, block_size: int = None) -> MutualMatches:
+    """
+    Pairs of ``profiles`` that are in each other's top-k.
+
+    ``profiles`` may also be an already built ProfileMatrix, which is what
+    gets shipped to worker processes. Ties are broken by position in
+    ``profiles``, like find-matches with the other profiles as the
+    candidate pool in the same order.
+    """
+    block_size = block_size or settings.MATCHING_RECIPROCAL_BLOCK_SIZE
+    matrix = profiles if isinstance(profiles, ProfileMatrix) else ProfileMatrix(profiles)
+    count = matrix.size
+    empty = MutualMatches(np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64), 0)
+    if k <= 0 or count < 2:
+        return empty
+
+    # key = (SCORE_STEPS - score in hundredths) * count + position: ascending
+    # keys rank by score descending, then position ascending
+    no_match = (SCORE_STEPS + 1) * count
+    best = np.full((count, 0), no_match, dtype=np.int64)
+    best_rows = [best[start:start + block_size] for start in range(0, count, block_size)]
+    scored = 0
+
+    starts = list(range(0, count, block_size))
+    for row_block, row_start in enumerate(starts):
+        rows = slice(row_start, min(row_start + block_size, count))
+        for col_block in range(row_block, len(starts)):
+            col_start = starts[col_block]
+            cols = slice(col_start, min(col_start + block_size, count))
+            steps = SCORE_STEPS - np.rint(block_scores(matrix, rows, cols) * 100).astype(np.int64)
+
+            row_keys = steps * count + np.arange(cols.start, cols.stop)[None, :]
+            if row_block == col_block:
+                np.fill_diagonal(row_keys, no_match)
+                scored += (rows.stop - rows.start) * (rows.stop - rows.start - 1) // 2
+            else:
+                col_keys = steps.T * count + np.arange(rows.start, rows.stop)[None, :]
+                best_rows[col_block] = _merge(best_rows[col_block], col_keys, k)
+                scored += steps.size
+            best_rows[row_block] = _merge(best_rows[row_block], row_keys, k)
+
+    best = np.sort(np.concatenate(best_rows), axis=1)
+    users = np.repeat(np.arange(count), best.shape[1])
+    ranks = np.tile(np.arange(best.shape[1]), count)
+    keys = best.ravel()
+    found = keys != no_match
+    users, partners, ranks = users[found], keys[found] % count, ranks[found]
+
+    # Directed edge user -> partner; mutual when partner -> user exists too
+    edges = users * count + partners
+    order = np.argsort(edges)
+    edges, ranks_sorted = edges[order], ranks[order]
+    reverse = partners * count + users
+    positions = np.searchsorted(edges, reverse)
+    positions[positions == len(edges)] = 0
+    mutual = (edges[positions] == reverse) & (users < partners)
+    if not mutual.any():
+        return empty._replace(scored=scored)
+
+    pairs = np.stack([users[mutual], partners[mutual]], axis=1)
+    pair_ranks = np.stack([ranks[mutual], ranks_sorted[positions[mutual]]], axis=1)
+    return MutualMatches(pairs, pair_ranks, scored)
+
+
+def rows_top_k(
+    matrix: ProfileMatrix,
+    rows: np.ndarray,
+    k: int,
+    block_size: int = None,
+    visit: Optional[Callable[[slice, np.ndarray], None]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k of the profiles at positions ``rows`` against every other
+    profile of the matrix, ranked like find-matches over the matrix order.
+
+    Returns (R, k) positions (-1 past the last match) and their rounded
+    scores (NaN there). ``visit(cols, scores)`` is called with every
+    (R, B) block of rounded scores, self pairs included.
+    """
+    block_size = block_size or settings.MATCHING_RECIPROCAL_BLOCK_SIZE
+    count = matrix.size
+    no_match = (SCORE_STEPS + 1) * count
+    row_matrix = matrix.take(rows)
+    best = np.full((len(rows), k), no_match, dtype=np.int64)
+
+    for start in range(0, count, block_size):
+        cols = slice(start, min(start + block_size, count))
+        scores = _rounded(pair_scores(row_matrix, matrix.take(cols)).total)
+        if visit is not None:
+            visit(cols, scores)
+        positions = np.arange(cols.start, cols.stop)
+        keys = (SCORE_STEPS - np.rint(scores * 100).astype(np.int64)) * count + positions[None, :]
+        keys[rows[:, None] == positions[None, :]] = no_match
+        best = _merge(best, keys, k)
+
+    best = np.sort(best, axis=1)
+    found = best != no_match
+    positions = np.where(found, best % count, -1)
+    scores = np.where(found, (SCORE_STEPS - best // count) / 100, np.nan)
+    return positions, scores
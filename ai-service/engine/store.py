@@ -0,0 +1,299 @@
+"""
+Server-resident candidate profile store
+
+Keeps every matchable profile in process memory so find-matches can score
+a user against the whole pool without the caller shipping it in the
+request body. The store is loaded from the auth and AI databases at
+startup and kept current through upsert/delete calls. Profiles are held
+as CompiledProfile objects; get_profile() converts back to the API model.
+"""
+
+import json
+import logging
+import threading
+from collections import defaultdict
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from core.config import settings
+from engine.ann import AnnIndex, profile_vector
+from engine.blocking import InvertedIndex
+from engine.features import CompiledProfile, build_features, compile_profile
+from engine.filters import AttributeIndex
+from engine.vocabulary import SET_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Compact once this share of positions holds deleted or replaced profiles
+COMPACTION_RATIO = 0.25
+
+USERS_QUERY = text("""
+    SELECT id, date_of_birth, gender, city, country, personality_type,
+           personality_traits, dream_countries
+    FROM users
+    WHERE is_active = TRUE AND is_banned = FALSE
+""")
+
+USER_SET_QUERIES = {
+    'interests': text("SELECT user_id, interest FROM user_interests"),
+    'travel_styles': text("SELECT user_id, style FROM user_travel_styles"),
+    'languages': text("SELECT user_id, language FROM user_languages"),
+}
+
+PERSONALITY_QUERY = text("""
+    SELECT user_id, personality_type, openness, conscientiousness,
+           extraversion, agreeableness
+    FROM personality_tests
+""")
+
+
+def _parse_list(value: Optional[str]) -> List[str]:
+    """Parse a JSON array or comma separated TEXT column"""
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+        if isinstance(parsed, list):
+            return [str(item).strip() for item in parsed if str(item).strip()]
+    except ValueError:
+        pass
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _parse_traits(value: Optional[str]) -> Optional[dict]:
+    """Parse the users.personality_traits JSON column"""
+    if not value:
+        return None
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _normalize_trait(value) -> float:
+    """Trait columns are stored as 0-100 DECIMAL percentages; scoring expects 0-1"""
+    return float(value) / 100
+
+
+def _age(date_of_birth: Optional[date]) -> Optional[int]:
+    if not date_of_birth:
+        return None
+    today = date.today()
+    return today.year - date_of_birth.year - (
+        (today.month, today.day) < (date_of_birth.month, date_of_birth.day)
+    )
+
+
+def _location(city: Optional[str], country: Optional[str]) -> Optional[str]:
+    parts = [part for part in (city, country) if part]
+    return ', '.join(parts) if parts else None
+
+
+class ProfileStore:
+    """
+    In-memory profile pool with a persistent inverted index.
+
+    Positions are append-only: replacing or deleting a profile leaves a
+    tombstone so the index never has to be edited in place, and the pool
+    is compacted once tombstones pile up. With MATCHING_ANN_ENABLED the
+    store also maintains an ANN index keyed by user id.
+    """
+
+    def __init__(self, profile_factory: Callable[..., object]):
+        self.profile_factory = profile_factory
+        self._profiles: List[Optional[CompiledProfile]] = []
+        self._positions: Dict[int, int] = {}
+        self._index = InvertedIndex()
+        self._attributes = AttributeIndex()
+        self._dead = 0
+        self._lock = threading.RLock()
+        self.ann = AnnIndex() if settings.MATCHING_ANN_ENABLED else None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._positions
+
+    def get(self, user_id: int) -> Optional[CompiledProfile]:
+        position = self._positions.get(user_id)
+        return None if position is None else self._profiles[position]
+
+    def get_profile(self, user_id: int):
+        """Stored profile converted back with ``profile_factory``, or None"""
+        compiled = self.get(user_id)
+        return None if compiled is None else self.profile_factory(**compiled.to_fields())
+
+    def upsert(self, profile) -> None:
+        """Insert or replace a profile (only its compiled form is kept)"""
+        # Compiled directly: a shared feature cache entry would duplicate it
+        compiled = profile if isinstance(profile, CompiledProfile) else build_features(profile, intern=True)
+        with self._lock:
+            self._tombstone(compiled.id)
+            self._positions[compiled.id] = self._index.add(compiled)
+            self._attributes.add(compiled)
+            self._profiles.append(compiled)
+            if self.ann is not None:
+                self.ann.add(compiled.id, profile_vector(compiled))
+            self._maybe_compact()
+
+    def upsert_many(self, profiles) -> int:
+        count = 0
+        for profile in profiles:
+            self.upsert(profile)
+            count += 1
+        return count
+
+    def delete(self, user_id: int) -> bool:
+        """Remove a profile; returns False when it was not stored"""
+        with self._lock:
+            removed = self._tombstone(user_id)
+            if removed:
+                self._positions.pop(user_id)
+                if self.ann is not None:
+                    self.ann.remove(user_id)
+                self._maybe_compact()
+            return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles = []
+            self._positions = {}
+            self._index = InvertedIndex()
+            self._attributes = AttributeIndex()
+            self._dead = 0
+            if self.ann is not None:
+                self.ann = AnnIndex()
+
+    def candidates(
+        self,
+        exclude_id: Optional[int] = None,
+        min_overlap: int = 0,
+        user=None,
+        preferences=None
+    ) -> List[CompiledProfile]:
+        """
+        Live profiles in position order, optionally blocked on token overlap
+        with ``user`` through the store's inverted index and pre-filtered on
+        ``preferences`` through the attribute index.
+        """
+        with self._lock:
+            profiles = self._profiles
+            if min_overlap > 0 and user is not None:
+                positions = self._index.shortlist(compile_profile(user), min_overlap)
+            else:
+                positions = range(len(profiles))
+            if preferences is not None:
+                positions = np.asarray(positions, dtype=np.int64)
+                positions = positions[self._attributes.mask(preferences, user)[positions]].tolist()
+            return [
+                profiles[position] for position in positions
+                if profiles[position] is not None and profiles[position].id != exclude_id
+            ]
+
+    def nearest(
+        self,
+        user,
+        k: int,
+        exclude_id: Optional[int] = None,
+        min_overlap: int = 0,
+        preferences=None
+    ) -> List[CompiledProfile]:
+        """
+        The ``k`` profiles closest to ``user`` in the ANN index, in position
+        order so exact re-ranking breaks ties like a full-pool ranking.
+        """
+        with self._lock:
+            user_ids = self.ann.search(profile_vector(user), k, exclude_id)
+            positions = sorted(self._positions[user_id] for user_id in user_ids if user_id in self._positions)
+            if min_overlap > 0:
+                shortlist = set(self._index.shortlist(compile_profile(user), min_overlap).tolist())
+                positions = [position for position in positions if position in shortlist]
+            if preferences is not None:
+                allowed = self._attributes.mask(preferences, user)
+                positions = [position for position in positions if allowed[position]]
+            return [self._profiles[position] for position in positions]
+
+    def _tombstone(self, user_id: int) -> bool:
+        position = self._positions.get(user_id)
+        if position is None:
+            return False
+        self._profiles[position] = None
+        self._dead += 1
+        return True
+
+    def _maybe_compact(self) -> None:
+        if self._dead and self._dead >= COMPACTION_RATIO * len(self._profiles):
+            live = [profile for profile in self._profiles if profile is not None]
+            self._profiles = []
+            self._positions = {}
+            self._index = InvertedIndex()
+            self._attributes = AttributeIndex()
+            self._dead = 0
+            for profile in live:
+                self._positions[profile.id] = self._index.add(profile)
+                self._attributes.add(profile)
+                self._profiles.append(profile)
+
+    async def load(self, auth_engine, ai_engine) -> int:
+        """
+        (Re)load the store from terrabond_auth (users and their interests,
+        travel styles and languages) and terrabond_ai (personality_tests).
+        """
+        users = {}
+        sets: Dict[str, Dict[int, List[str]]] = {field: defaultdict(list) for field in SET_FIELDS}
+
+        async with auth_engine.connect() as conn:
+            result = await conn.stream(USERS_QUERY)
+            async for row in result:
+                users[row.id] = row
+            for field, query in USER_SET_QUERIES.items():
+                result = await conn.stream(query)
+                async for user_id, value in result:
+                    sets[field][user_id].append(value)
+
+        personality = {}
+        async with ai_engine.connect() as conn:
+            result = await conn.stream(PERSONALITY_QUERY)
+            async for row in result:
+                personality[row.user_id] = row
+
+        profiles = []
+        for user_id, row in users.items():
+            test = personality.get(user_id)
+            traits = _parse_traits(row.personality_traits)
+            personality_type = row.personality_type
+            if test is not None:
+                personality_type = test.personality_type or personality_type
+                test_traits = {
+                    trait: _normalize_trait(getattr(test, trait))
+                    for trait in ('openness', 'conscientiousness', 'extraversion', 'agreeableness')
+                    if getattr(test, trait) is not None
+                }
+                traits = test_traits or traits
+
+            profiles.append(self.profile_factory(
+                id=user_id,
+                personality_type=personality_type,
+                personality_traits=traits,
+                interests=sets['interests'].get(user_id, []),
+                travel_styles=sets['travel_styles'].get(user_id, []),
+                languages=sets['languages'].get(user_id, []),
+                dream_countries=_parse_list(row.dream_countries),
+                location=_location(row.city, row.country),
+                gender=row.gender,
+                age=_age(row.date_of_birth)
+            ))
+
+        with self._lock:
+            self.clear()
+            self.upsert_many(profiles)
+            self.loaded = True
+
+        logger.info(f"Profile store loaded {len(self)} profiles")
+        return len(self)
@@ -0,0 +1,55 @@
+"""
+Streaming top-k
+
+Candidates that arrive as a stream (NDJSON request bodies) are ranked in
+fixed-size chunks: each chunk gets its exact top-k and is merged into the
+running result, then dropped. Only the k best candidates are kept, so
+memory stays flat however many candidates are sent, and the final ranking
+is the one top_k would give over the whole stream.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+from engine.batch import BatchScores, round_scores
+from engine.parallel import merge_top_k
+from engine.topk import TopKResult, top_k
+
+
+class StreamingTopK:
+    """Bounded top-k over candidate chunks, in stream order"""
+
+    def __init__(self, user, k: int):
+        empty = np.zeros(0)
+        self.user = user
+        self.k = k
+        self.seen = 0
+        self._result = TopKResult(np.zeros(0, dtype=np.int64), BatchScores(empty, empty, empty, empty, empty), 0)
+        self._kept: Dict[int, object] = {}
+
+    @property
+    def scored(self) -> int:
+        return self._result.scored
+
+    def push(self, candidates: List) -> None:
+        """Rank a chunk and merge it into the running top-k"""
+        offset = self.seen
+        self.seen += len(candidates)
+        if self.k <= 0 or not candidates:
+            return
+
+        # Candidates whose bound is below the current k-th score cannot enter
+        min_score = None
+        if len(self._result.indices) == self.k:
+            min_score = float(round_scores(self._result.scores.total[-1:])[0])
+        chunk = top_k(self.user, candidates, self.k, min_score=min_score)
+
+        self._result = merge_top_k([self._result, chunk], [0, offset], self.k)
+        for index in chunk.indices:
+            self._kept[offset + int(index)] = candidates[index]
+        self._kept = {int(index): self._kept[int(index)] for index in self._result.indices}
+
+    def result(self) -> tuple:
+        """Ranked candidates and their component scores"""
+        return [self._kept[int(index)] for index in self._result.indices], self._result.scores
@@ -0,0 +1,200 @@
+"""
+Top-k matching with upper-bound pruning
+
+Every candidate gets a cheap upper bound on its overall score: the MBTI
+part of the personality score plus the best possible Big Five term, the
+exact location score, and set-overlap ratios computed from set sizes
+alone (an intersection is never larger than the smaller set). Candidates
+are then scored exactly in chunks, best bound first, and the scan stops
+as soon as no remaining bound can beat the current k-th score.
+
+matrix_top_k does the same over ProfileMatrix columns, for callers that
+compiled the pool once (worker shards, the precompute job).
+"""
+
+import heapq
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from core.config import settings
+from engine.batch import (
+    TRAVEL_FIELD_WEIGHTS,
+    BatchScores,
+    location_scores,
+    mbti_codes,
+    round_scores,
+    score_candidates,
+    set_sizes,
+    weighted_total,
+)
+from engine.features import compile_profile
+from engine.kernels import personality_kernel
+from engine.reciprocal import ProfileMatrix, location_block, pair_scores
+
+
+class TopKResult(NamedTuple):
+    """Best candidates in rank order with their raw component scores"""
+    indices: np.ndarray
+    scores: BatchScores
+    scored: int
+
+
+def _ratio_bound(user_size: int, sizes: np.ndarray, weight: float) -> np.ndarray:
+    """Upper bound of len(common) / max(len(a), len(b)) * weight"""
+    bound = np.zeros(len(sizes))
+    if user_size:
+        both = sizes > 0
+        bound[both] = np.minimum(sizes[both], user_size) / np.maximum(sizes[both], user_size) * weight
+    return bound
+
+
+def _bounds(
+    user_mbti: int,
+    user_sizes: Dict[str, int],
+    codes: np.ndarray,
+    sizes: Dict[str, np.ndarray],
+    location: np.ndarray
+) -> np.ndarray:
+    """
+    Upper bound of every candidate's overall score from its personality
+    type id, set sizes and exact location score.
+
+    Each bound component is >= the exact component under the same float
+    operations, so the weighted bound is >= the exact weighted total.
+    """
+    # (1 - avg_diff) * 0.2 is at most 0.2 since trait differences are >= 0
+    personality = np.minimum(1.0, personality_kernel(user_mbti, None, codes, None) + 0.2)
+
+    interests = np.full(len(codes), 0.3)
+    user_size = user_sizes['interests']
+    if user_size:
+        both = sizes['interests'] > 0
+        interests[both] = (
+            np.minimum(sizes['interests'][both], user_size) / np.maximum(sizes['interests'][both], user_size)
+        )
+
+    travel = np.zeros(len(codes))
+    for field, weight in TRAVEL_FIELD_WEIGHTS:
+        travel = travel + _ratio_bound(user_sizes[field], sizes[field], weight)
+    travel = np.minimum(1.0, travel)
+
+    return weighted_total(personality, interests, travel, location)
+
+
+def upper_bounds(user, candidates) -> np.ndarray:
+    """Upper bound of every candidate's overall score"""
+    user_features = compile_profile(user)
+    candidate_features = [compile_profile(candidate) for candidate in candidates]
+    return _bounds(
+        user_features.mbti,
+        user_features.sizes,
+        mbti_codes(candidate_features),
+        {field: set_sizes(candidate_features, field) for field in user_features.sizes},
+        location_scores(user_features, candidate_features)
+    )
+
+
+def matrix_upper_bounds(user: ProfileMatrix, pool: ProfileMatrix) -> np.ndarray:
+    """upper_bounds over the columns of a one-row user matrix and a pool matrix"""
+    return _bounds(
+        int(user.mbti[0]),
+        {field: int(sizes[0]) for field, sizes in user.sizes.items()},
+        pool.mbti,
+        pool.sizes,
+        location_block(user, pool)[0]
+    )
+
+
+def _select(
+    bounds: np.ndarray,
+    score: Callable[[np.ndarray], BatchScores],
+    k: int,
+    chunk_size: int,
+    min_score: float
+) -> TopKResult:
+    """
+    Exact top-k given the rounded bound of every candidate and a scorer
+    returning the component scores of an array of candidate indices.
+    """
+    order = np.argsort(-bounds, kind='stable')
+    if min_score is not None:
+        order = order[bounds[order] >= min_score]
+
+    # Min-heap on (rounded score, -index): the root is the current k-th match
+    heap: List[Tuple[float, int]] = []
+    components = {}
+    scored = 0
+
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        if len(heap) == k:
+            chunk = chunk[bounds[chunk] >= heap[0][0]]
+            if not len(chunk):
+                # Bounds are sorted, so nothing further can qualify either
+                break
+
+        scores = score(chunk)
+        rounded = round_scores(scores.total)
+        scored += len(chunk)
+
+        # Only the chunk's own top-k can enter the heap
+        best = np.lexsort((chunk, -rounded))[:k]
+        for position in best:
+            entry = (float(rounded[position]), -int(chunk[position]))
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                components.pop(-heapq.heapreplace(heap, entry)[1], None)
+            else:
+                continue
+            components[int(chunk[position])] = tuple(
+                float(values[position]) for values in scores
+            )
+
+    ranked = sorted(heap, key=lambda entry: (-entry[0], -entry[1]))
+    indices = np.array([-entry[1] for entry in ranked], dtype=np.int64)
+    columns = list(zip(*(components[index] for index in indices))) or [()] * 5
+    return TopKResult(indices, BatchScores(*(np.array(column) for column in columns)), scored)
+
+
+def _empty() -> TopKResult:
+    empty = np.zeros(0)
+    return TopKResult(np.zeros(0, dtype=np.int64), BatchScores(empty, empty, empty, empty, empty), 0)
+
+
+def top_k(user, candidates, k: int, chunk_size: int = None, min_score: float = None) -> TopKResult:
+    """
+    Exact top-k of ``candidates`` for ``user``, ordered like a stable sort
+    on the rounded compatibility score, without scoring candidates that
+    cannot make the cut.
+
+    With ``min_score``, candidates whose rounded bound is below it are
+    skipped as well (the caller already holds k matches at that score).
+    """
+    if k <= 0 or not candidates:
+        return _empty()
+
+    def score(chunk):
+        return score_candidates(user, [candidates[index] for index in chunk])
+
+    bounds = round_scores(upper_bounds(user, candidates))
+    return _select(bounds, score, k, chunk_size or settings.MATCHING_TOPK_CHUNK_SIZE, min_score)
+
+
+def matrix_top_k(
+    user: ProfileMatrix,
+    pool: ProfileMatrix,
+    k: int,
+    chunk_size: int = None,
+    min_score: float = None
+) -> TopKResult:
+    """top_k of a one-row user matrix against the rows of a pool matrix"""
+    if k <= 0 or not len(pool):
+        return _empty()
+
+    def score(chunk):
+        return BatchScores(*(values[0] for values in pair_scores(user, pool.take(chunk))))
+
+    bounds = round_scores(matrix_upper_bounds(user, pool))
+    return _select(bounds, score, k, chunk_size or settings.MATCHING_TOPK_CHUNK_SIZE, min_score)
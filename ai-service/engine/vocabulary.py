@@ -0,0 +1,137 @@
+"""
+Interned token vocabularies for profile fields
+
+Every interest, travel style, language and dream country string is mapped
+once to a small integer id, so profile sets can be stored as bitsets and
+compared with AND + popcount instead of rebuilding Python sets per pair.
+Personality types and locations are interned the same way and stored as
+plain ids.
+
+Tokens of stored profiles are always interned. Tokens only seen in request
+profiles are interned while a set vocabulary holds fewer than
+MATCHING_VOCABULARY_MAX_SIZE tokens, so request payloads cannot widen the
+bitsets without bound; past that, unknown tokens get no bit and are kept
+as a small frozenset next to the bitset. No stored profile can hold them,
+but other request profiles (inline candidates) can.
+"""
+
+import threading
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+
+SET_FIELDS = ('interests', 'travel_styles', 'languages', 'dream_countries')
+
+MBTI_TYPES = (
+    'INTJ', 'INTP', 'ENTJ', 'ENTP', 'INFJ', 'INFP', 'ENFJ', 'ENFP',
+    'ISTJ', 'ISFJ', 'ESTJ', 'ESFJ', 'ISTP', 'ISFP', 'ESTP', 'ESFP'
+)
+
+# Id of a missing personality type or location
+NO_TOKEN = -1
+
+# Shared empty set of tokens without a bit
+NO_EXTRAS: FrozenSet[str] = frozenset()
+
+# Number of set bits in every byte value, used when np.bitwise_count is unavailable
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class Vocabulary:
+    """Thread-safe token <-> id mapping for one profile field"""
+
+    def __init__(self, name: str, max_size: Optional[int] = None):
+        self.name = name
+        # Size past which bitset(..., intern=False) stops interning
+        self.max_size = max_size
+        self._ids: Dict[str, int] = {}
+        self._tokens: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def intern(self, token: str) -> int:
+        """Return the id of a token, assigning a new one if needed"""
+        token_id = self._ids.get(token)
+        if token_id is None:
+            with self._lock:
+                token_id = self._ids.get(token)
+                if token_id is None:
+                    token_id = len(self._tokens)
+                    self._tokens.append(token)
+                    self._ids[token] = token_id
+        return token_id
+
+    def lookup(self, token: str) -> Optional[int]:
+        """Return the id of a token without interning it"""
+        return self._ids.get(token)
+
+    def token(self, token_id: int) -> str:
+        """Return the token for an id"""
+        return self._tokens[token_id]
+
+    def bitset(self, tokens: Iterable[str], intern: bool = True) -> Tuple[int, FrozenSet[str]]:
+        """
+        Encode tokens as (bitset, tokens left without a bit), duplicates
+        collapsing like in a set. Without ``intern``, unknown tokens are
+        only interned below ``max_size``; past it they are returned apart.
+        """
+        bits = 0
+        unknown = set()
+        for token in tokens:
+            token_id = self._ids.get(token)
+            if token_id is None:
+                if not intern and self.max_size is not None and len(self._tokens) >= self.max_size:
+                    unknown.add(token)
+                    continue
+                token_id = self.intern(token)
+            bits |= 1 << token_id
+        return bits, frozenset(unknown) if unknown else NO_EXTRAS
+
+    def tokens(self, bits: int) -> List[str]:
+        """Decode a bitset back to its tokens, in id order"""
+        return [self._tokens[token_id] for token_id in bit_ids(bits)]
+
+    def word_count(self) -> int:
+        """Number of 64-bit words needed to pack any bitset of this vocabulary"""
+        return max(1, (len(self._tokens) + 63) // 64)
+
+
+# Global vocabularies shared by every request of this process
+vocabularies: Dict[str, Vocabulary] = {
+    field: Vocabulary(field, settings.MATCHING_VOCABULARY_MAX_SIZE) for field in SET_FIELDS
+}
+
+# The 16 MBTI types always get ids 0-15; any other string is interned after them
+personality_types = Vocabulary('personality_type')
+for _mbti in MBTI_TYPES:
+    personality_types.intern(_mbti)
+
+# Full location strings and their country part share one vocabulary
+locations = Vocabulary('location')
+
+
+def bit_ids(bits: int) -> Iterator[int]:
+    """Yield the ids of the set bits of a bitset, lowest first"""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def pack_bitsets(bitsets: Iterable[int], words: int) -> np.ndarray:
+    """Pack Python int bitsets into an (N, words) uint64 matrix"""
+    width = words * 8
+    buffer = b''.join(bits.to_bytes(width, 'little') for bits in bitsets)
+    return np.frombuffer(buffer, dtype='<u8').reshape(-1, words)
+
+
+def popcount_rows(matrix: np.ndarray) -> np.ndarray:
+    """Number of set bits in every row of a uint64 matrix"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(matrix).sum(axis=1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(matrix).view(np.uint8)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=1, dtype=np.int64)
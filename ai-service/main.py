@@ -17,12 +17,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from api.face_recognition import router as face_router
-from api.matching import router as matching_router
+from api.matching import router as matching_router, profile_store, match_writer
 from api.recommendations import router as recommendations_router
 from api.risk_analysis import router as risk_router
 from api.chatbot import router as chatbot_router
 from core.config import settings
-from core.database import engine, Base
+from core.database import engine, auth_engine, Base
+from engine.cache import compatibility_cache
+from engine.face_compute import face_pool
+from engine.face_index import face_index
+from engine.parallel import shutdown_pool
 
 # Configure logging
 logging.basicConfig(
@@ -42,12 +46,33 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     
+    # Load matching candidates into memory
+    if settings.MATCHING_STORE_PRELOAD:
+        try:
+            await profile_store.load(auth_engine, engine)
+        except Exception as e:
+            logger.error(f"Profile store preload failed: {e}")
+    
+    # Load enrolled face encodings for identification
+    if settings.FACE_INDEX_PRELOAD:
+        try:
+            await face_index.load(auth_engine)
+        except Exception as e:
+            logger.error(f"Face index preload failed: {e}")
+    
+    await match_writer.start()
+    
     logger.info("AI Service started successfully!")
     yield
     
     # Shutdown
     logger.info("Shutting down AI Service...")
+    shutdown_pool()
+    face_pool.shutdown()
+    await match_writer.stop()
+    await compatibility_cache.close()
     await engine.dispose()
+    await auth_engine.dispose()
 
 
 # Create FastAPI application
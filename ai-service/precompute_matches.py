@@ -0,0 +1,326 @@
+"""
+Nightly match precomputation job
+
+Computes the top-K matches of every user and bulk-writes them into
+terrabond_ai.matches, so feeds are served from the table instead of
+calling find-matches per user.
+
+The first run (or --full) recomputes everyone. Later runs only recompute
+rows involving users whose profile changed since the previous completed
+run: each changed user gets a fresh top-K, and every other user gains
+the changed users that now beat its stored K-th score. Users whose top-K
+lost a changed user, or a user that left the pool, are re-ranked too.
+Rows involving re-ranked users that were not refreshed, and every row of
+users that left the pool, are deactivated.
+
+The pool is compiled once per run into ProfileMatrix columns, and each
+batch of users is ranked against it with the blocked pairwise kernels of
+engine/reciprocal.py. Progress is checkpointed after every batch, so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python precompute_matches.py [--full] [--top-k 50] [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from api.matching import UserProfile, explain_match
+from core.config import settings
+from core.database import auth_engine, engine
+from engine.batch import score_candidates
+from engine.features import CompiledProfile
+from engine.match_writer import MatchWriter, ensure_schema
+from engine.reciprocal import ProfileMatrix, block_scores, rows_top_k
+from engine.store import ProfileStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("precompute_matches")
+
+CHANGED_USERS_QUERY = text("""
+    SELECT id FROM users WHERE updated_at > :since OR created_at > :since
+""")
+
+CHANGED_TESTS_QUERY = text("""
+    SELECT user_id FROM personality_tests WHERE completed_at > :since
+""")
+
+DATABASE_NOW = text("SELECT LOCALTIMESTAMP")
+
+ACTIVE_MATCH_USERS = text("""
+    SELECT user1_id FROM matches WHERE is_active
+    UNION
+    SELECT user2_id FROM matches WHERE is_active
+""")
+
+ACTIVE_MATCHES_OF = text("""
+    SELECT user1_id, user2_id, compatibility_score FROM matches
+    WHERE is_active AND (user1_id IN :user_ids OR user2_id IN :user_ids)
+""").bindparams(bindparam("user_ids", expanding=True))
+
+DEACTIVATE_STALE = text("""
+    UPDATE matches SET is_active = FALSE
+    WHERE is_active AND updated_at < :run_started_at
+""")
+
+DEACTIVATE_STALE_CHANGED = text("""
+    UPDATE matches SET is_active = FALSE
+    WHERE is_active AND updated_at < :run_started_at
+      AND (user1_id IN :user_ids OR user2_id IN :user_ids)
+""").bindparams(bindparam("user_ids", expanding=True))
+
+
+class Checkpoint:
+    """Run state persisted between batches and between runs"""
+
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, "state.json")
+        self.thresholds_path = os.path.join(state_dir, "thresholds.npz")
+        self.state: Dict = {}
+
+    def load(self) -> Dict:
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+        return self.state
+
+    def save(self) -> None:
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def load_thresholds(self) -> Dict[int, float]:
+        """K-th best score of every user at the end of the previous run"""
+        if not os.path.exists(self.thresholds_path):
+            return {}
+        data = np.load(self.thresholds_path)
+        return dict(zip(data["user_ids"].tolist(), data["scores"].tolist()))
+
+    def save_thresholds(self, thresholds: Dict[int, float]) -> None:
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self.thresholds_path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            user_ids=np.fromiter(thresholds.keys(), dtype=np.int64, count=len(thresholds)),
+            scores=np.fromiter(thresholds.values(), dtype=np.float64, count=len(thresholds))
+        )
+        os.replace(tmp_path, self.thresholds_path)
+
+
+async def changed_user_ids(since: str) -> set:
+    """Users whose profile or personality test changed after ``since``"""
+    since_at = datetime.fromisoformat(since)
+    changed = set()
+    async with auth_engine.connect() as conn:
+        result = await conn.execute(CHANGED_USERS_QUERY, {"since": since_at})
+        changed.update(row[0] for row in result)
+    async with engine.connect() as conn:
+        result = await conn.execute(CHANGED_TESTS_QUERY, {"since": since_at})
+        changed.update(row[0] for row in result)
+    return changed
+
+
+async def incremental_user_ids(
+    since: str,
+    matrix: ProfileMatrix,
+    position_by_id: Dict[int, int],
+    thresholds: Dict[int, float]
+) -> Tuple[List[int], List[int]]:
+    """
+    (users to re-rank, users whose rows must all go) of an incremental run.
+
+    Users that left the pool (banned, deleted, hidden) are removed. Besides
+    the changed users, an unchanged user is re-ranked when a stored match
+    that made its top-K involves a removed user, or a changed user that no
+    longer beats its K-th score: the row is deactivated and its list
+    would otherwise stay one short.
+    """
+    changed = await changed_user_ids(since)
+    async with engine.connect() as conn:
+        matched = {row[0] for row in await conn.execute(ACTIVE_MATCH_USERS)}
+        removed = sorted((changed | matched) - position_by_id.keys())
+        changed = sorted(changed & position_by_id.keys())
+        if not changed and not removed:
+            return changed, removed
+        rows = (await conn.execute(ACTIVE_MATCHES_OF, {"user_ids": changed + removed})).all()
+
+    changed_ids = set(changed)
+    backfill = set()
+    # Unchanged partners whose top-K held a changed user, grouped by that user
+    partners_of: Dict[int, List[int]] = {}
+    for user1_id, user2_id, score in rows:
+        for user_id, partner_id in ((user1_id, user2_id), (user2_id, user1_id)):
+            if user_id in changed_ids or user_id not in position_by_id:
+                continue
+            if float(score) < thresholds.get(user_id, np.inf):
+                continue
+            if partner_id in changed_ids:
+                partners_of.setdefault(partner_id, []).append(user_id)
+            elif partner_id not in position_by_id:
+                backfill.add(user_id)
+
+    for partner_id, user_ids in partners_of.items():
+        positions = np.array([position_by_id[user_id] for user_id in user_ids], dtype=np.int64)
+        scores = block_scores(matrix, positions, np.array([position_by_id[partner_id]]))[:, 0]
+        below = scores < np.array([thresholds[user_id] for user_id in user_ids])
+        backfill.update(user_id for user_id, lost in zip(user_ids, below.tolist()) if lost)
+
+    return sorted(changed_ids | backfill), removed
+
+
+async def write_matches(writer: MatchWriter, user: CompiledProfile, candidates: List[CompiledProfile]) -> None:
+    """Queue the rows of a user's matches, with their reasons and common items"""
+    scores = score_candidates(user, candidates)
+    for rank, candidate in enumerate(candidates):
+        await writer.put(
+            user.id, candidate.id, explain_match(user, candidate, scores, rank),
+            timeout=settings.MATCHING_WRITER_PUT_TIMEOUT
+        )
+
+
+async def run(full: bool, top_k_size: int, batch_size: int, state_dir: str) -> None:
+    checkpoint = Checkpoint(state_dir)
+    state = checkpoint.load()
+    thresholds = checkpoint.load_thresholds()
+    # Stale-row deactivation reads matches.updated_at
+    await ensure_schema(engine)
+
+    store = ProfileStore(UserProfile)
+    await store.load(auth_engine, engine)
+    profiles: List[CompiledProfile] = store.candidates()
+    position_by_id = {profile.id: position for position, profile in enumerate(profiles)}
+    matrix = ProfileMatrix(profiles)
+
+    if state.get("in_progress") and not full:
+        logger.info(f"Resuming {state['mode']} run started at {state['run_started_at']}")
+    else:
+        previous_run = state.get("last_completed_run_at")
+        mode = "incremental" if previous_run and thresholds and not full else "full"
+        # Use the database clock: rows are stamped with its CURRENT_TIMESTAMP
+        async with engine.connect() as conn:
+            run_started_at = (await conn.execute(DATABASE_NOW)).scalar()
+        state = {
+            "in_progress": True,
+            "mode": mode,
+            "run_started_at": run_started_at.isoformat(),
+            "last_completed_run_at": previous_run,
+            "top_k": top_k_size,
+            "cursor": 0
+        }
+        if mode == "incremental":
+            state["user_ids"], state["removed_ids"] = await incremental_user_ids(
+                previous_run, matrix, position_by_id, thresholds
+            )
+        else:
+            state["user_ids"] = sorted(position_by_id)
+        checkpoint.state = state
+        checkpoint.save()
+
+    mode = state["mode"]
+    user_ids: List[int] = state["user_ids"]
+    removed_ids: List[int] = state.get("removed_ids", [])
+    top_k_size = state["top_k"]
+    incremental = mode == "incremental"
+    threshold_array = np.array([thresholds.get(profile.id, np.inf) for profile in profiles])
+
+    total = len(user_ids)
+    started = time.monotonic()
+    processed = 0
+    # The flush loop writes whenever the buffer fills; every batch is still
+    # flushed explicitly before the checkpoint advances
+    writer = MatchWriter(engine, max_pending=batch_size * (top_k_size + 1) * 4)
+    logger.info(f"{mode.capitalize()} run: {total} users to process, pool of {len(profiles)}")
+
+    await writer.start()
+    try:
+        while state["cursor"] < total:
+            batch = user_ids[state["cursor"]:state["cursor"] + batch_size]
+            rows = np.array([position_by_id[user_id] for user_id in batch if user_id in position_by_id], dtype=np.int64)
+            qualifying = [[] for _ in rows]
+
+            def collect(cols: slice, scores: np.ndarray) -> None:
+                # Unchanged users gain a changed user that now beats their K-th score
+                hit_rows, hit_cols = np.nonzero(scores >= threshold_array[cols][None, :])
+                hit_cols += cols.start
+                others = hit_cols != rows[hit_rows]
+                for row, col in zip(hit_rows[others].tolist(), hit_cols[others].tolist()):
+                    qualifying[row].append(col)
+
+            indices, scores = rows_top_k(matrix, rows, top_k_size, visit=collect if incremental else None)
+            for row, position in enumerate(rows.tolist()):
+                user = profiles[position]
+                ranked = indices[row][indices[row] >= 0]
+                await write_matches(writer, user, [profiles[index] for index in ranked])
+                # Fewer than K matches: any newcomer qualifies
+                thresholds[user.id] = float(scores[row, -1]) if len(ranked) == top_k_size else -np.inf
+                if qualifying[row]:
+                    await write_matches(writer, user, [profiles[index] for index in qualifying[row]])
+
+            await writer.flush()
+            processed += len(batch)
+            state["cursor"] += len(batch)
+            checkpoint.save_thresholds(thresholds)
+            checkpoint.save()
+
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed else 0.0
+            remaining = (total - state["cursor"]) / rate if rate else 0.0
+            logger.info(
+                f"{state['cursor']}/{total} users ({state['cursor'] / total:.1%}), "
+                f"{rate:.1f} users/s, {writer.stats['written']} pairs written, ETA {remaining:.0f}s"
+            )
+    finally:
+        await writer.stop()
+
+    # Drop rows that were not refreshed by this run
+    async with engine.begin() as conn:
+        params = {"run_started_at": datetime.fromisoformat(state["run_started_at"])}
+        if not incremental:
+            await conn.execute(DEACTIVATE_STALE, params)
+        elif user_ids or removed_ids:
+            await conn.execute(DEACTIVATE_STALE_CHANGED, {**params, "user_ids": user_ids + removed_ids})
+
+    state["in_progress"] = False
+    state["last_completed_run_at"] = state["run_started_at"]
+    checkpoint.state = state
+    checkpoint.save()
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"{mode.capitalize()} run finished: {total} users, "
+        f"{writer.stats['written']} pairs in {elapsed:.1f}s"
+    )
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Precompute top-K matches into the matches table")
+    parser.add_argument("--full", action="store_true", help="recompute every user instead of changed ones")
+    parser.add_argument("--top-k", type=int, default=settings.MATCHING_PRECOMPUTE_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=settings.MATCHING_PRECOMPUTE_BATCH_SIZE)
+    parser.add_argument("--state-dir", default=settings.MATCHING_PRECOMPUTE_STATE_DIR)
+    args = parser.parse_args(argv)
+
+    try:
+        await run(args.full, args.top_k, args.batch_size, args.state_dir)
+    finally:
+        await engine.dispose()
+        await auth_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Face encoding payloads
+
+Stored encodings may be legacy (1024 raw float64 bytes, no header) or
+versioned (format byte + values). Both must decode without being told
+which is which, and every format must round-trip within its precision.
+"""
+
+import base64
+
+import numpy as np
+import pytest
+
+from engine.face_encoding import (
+    FACE_ENCODING_SIZE,
+    FORMAT_CODES,
+    FORMATS,
+    LEGACY_FORMAT,
+    REFERENCE_SEPARATOR,
+    format_encoding,
+    parse_encoding,
+    parse_encodings,
+)
+
+# Largest round-trip error per value, relative to the largest |value|
+TOLERANCES = {'float64': 0.0, 'float32': 1e-7, 'float16': 1e-3, 'int8': 0.5 / 127}
+
+PAYLOAD_SIZES = {'float64': 1024, 'float32': 513, 'float16': 257, 'int8': 133}
+
+
+def encoding(seed: int = 0) -> np.ndarray:
+    # dlib encodings are small values around zero
+    return np.random.default_rng(seed).normal(0, 0.1, FACE_ENCODING_SIZE)
+
+
+@pytest.mark.parametrize("encoding_format", FORMATS)
+def test_round_trip(encoding_format):
+    values = encoding()
+    text = format_encoding(values, encoding_format)
+    assert len(base64.b64decode(text)) == PAYLOAD_SIZES[encoding_format]
+
+    decoded = parse_encoding(text)
+    assert decoded.dtype == np.float64 and decoded.shape == (FACE_ENCODING_SIZE,)
+    assert np.abs(decoded - values).max() <= TOLERANCES[encoding_format] * np.abs(values).max() * 1.0001
+
+
+def test_legacy_payload_is_raw_float64():
+    values = encoding()
+    legacy = base64.b64encode(values.astype('<f8').tobytes()).decode('ascii')
+    assert format_encoding(values, LEGACY_FORMAT) == legacy
+    assert parse_encoding(legacy).tolist() == values.tolist()
+
+
+def test_legacy_payload_starting_with_a_format_byte():
+    # 1024 bytes are always legacy, whatever the first byte looks like
+    values = encoding()
+    payload = bytearray(values.astype('<f8').tobytes())
+    payload[0] = FORMAT_CODES['float32']
+    decoded = parse_encoding(base64.b64encode(bytes(payload)).decode('ascii'))
+    assert decoded.tolist() == np.frombuffer(bytes(payload), dtype='<f8').tolist()
+
+
+def test_zero_encoding_in_int8():
+    assert parse_encoding(format_encoding(np.zeros(FACE_ENCODING_SIZE), 'int8')).tolist() == [0.0] * FACE_ENCODING_SIZE
+
+
+def test_mixed_reference_formats():
+    values = [encoding(seed) for seed in range(3)]
+    text = REFERENCE_SEPARATOR.join(
+        format_encoding(value, encoding_format)
+        for value, encoding_format in zip(values, (LEGACY_FORMAT, 'float32', 'int8'))
+    )
+    decoded = parse_encodings(text)
+    assert decoded.shape == (3, FACE_ENCODING_SIZE)
+    assert decoded[0].tolist() == values[0].tolist()
+
+
+@pytest.mark.parametrize("payload", [
+    b"",
+    bytes([0x09]) + bytes(512),
+    bytes([FORMAT_CODES['float32']]) + bytes(100),
+    bytes([FORMAT_CODES['int8']]) + np.float32(np.inf).tobytes() + bytes(FACE_ENCODING_SIZE),
+    np.full(FACE_ENCODING_SIZE, np.nan).tobytes(),
+])
+def test_invalid_payloads(payload):
+    with pytest.raises(ValueError):
+        parse_encoding(base64.b64encode(payload).decode('ascii'))
+
+
+def test_invalid_base64():
+    with pytest.raises(ValueError):
+        parse_encoding("not base64!")
+    with pytest.raises(ValueError):
+        parse_encodings(REFERENCE_SEPARATOR)
@@ -0,0 +1,79 @@
+"""
+Mutual top-k vs brute force
+
+mutual_top_k scores the upper triangle of the pair matrix in blocks and
+keeps a running top-k per user. Its pairs must be exactly the pairs found
+by ranking every user against all the others with find-matches ordering
+and intersecting the two directions.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from api.matching import UserProfile
+from core.config import settings
+from engine.batch import round_scores, score_candidates
+from engine.features import feature_cache
+from engine.reciprocal import ProfileMatrix, mutual_top_k
+
+INTERESTS = ['hiking', 'food', 'art', 'music', 'surf', 'yoga']
+LOCATIONS = ['Paris, France', 'Lyon, France', 'Tokyo, Japan', None]
+
+
+def random_profile(rng: random.Random, user_id: int) -> UserProfile:
+    return UserProfile(
+        id=user_id,
+        personality_type=rng.choice(['INTJ', 'ENFP', 'ISTJ', None]),
+        personality_traits=rng.choice([None, {'openness': round(rng.random(), 1)}]),
+        interests=rng.sample(INTERESTS, rng.randint(0, 3)),
+        languages=rng.sample(['fr', 'en', 'es'], rng.randint(0, 2)),
+        location=rng.choice(LOCATIONS),
+        age=30
+    )
+
+
+def brute_force_mutual(profiles, k: int) -> dict:
+    """{(i, j): (rank of j for i, rank of i for j)} for i < j in each other's top-k"""
+    top = []
+    for position, user in enumerate(profiles):
+        others = [index for index in range(len(profiles)) if index != position]
+        rounded = round_scores(score_candidates(user, [profiles[index] for index in others]).total)
+        top.append([others[index] for index in np.argsort(-rounded, kind='stable')[:k]])
+    return {
+        (i, j): (top[i].index(j), top[j].index(i))
+        for i in range(len(profiles)) for j in top[i]
+        if i < j and i in top[j]
+    }
+
+
+@pytest.fixture(autouse=True)
+def geo_off(monkeypatch):
+    monkeypatch.setattr(settings, "MATCHING_GEO_ENABLED", False)
+    feature_cache.clear()
+    yield
+    feature_cache.clear()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_mutual_top_k_matches_brute_force(seed):
+    rng = random.Random(seed)
+    profiles = [random_profile(rng, user_id) for user_id in range(rng.randint(2, 120))]
+    k = rng.choice([1, 3, 10, 200])
+    expected = brute_force_mutual(profiles, k)
+
+    # Small blocks so pairs span diagonal and off-diagonal blocks
+    for source in (profiles, ProfileMatrix(profiles)):
+        result = mutual_top_k(source, k, block_size=16)
+        pairs = {
+            tuple(pair): tuple(ranks)
+            for pair, ranks in zip(result.pairs.tolist(), result.ranks.tolist())
+        }
+        assert pairs == expected
+
+
+def test_mutual_top_k_without_pairs():
+    assert len(mutual_top_k([], 5).pairs) == 0
+    assert len(mutual_top_k([UserProfile(id=1)], 5).pairs) == 0
+    assert len(mutual_top_k([UserProfile(id=1), UserProfile(id=2)], 0).pairs) == 0
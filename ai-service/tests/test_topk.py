@@ -0,0 +1,96 @@
+"""
+Pruned top-k vs a full stable sort
+
+top_k skips candidates whose upper bound cannot reach the current k-th
+score and keeps the best ones in a heap. Whatever it prunes, it must
+return exactly what a stable sort of every rounded score returns, ties
+and short pools included.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from api.matching import UserProfile
+from core.config import settings
+from engine.batch import round_scores, score_candidates
+from engine.features import feature_cache
+from engine.reciprocal import ProfileMatrix
+from engine.streaming import StreamingTopK
+from engine.topk import matrix_top_k, top_k
+
+INTERESTS = ['hiking', 'food', 'art', 'music', 'surf']
+STYLES = ['backpack', 'luxury', 'culture']
+LOCATIONS = ['Paris, France', 'Lyon, France', 'Tokyo, Japan', None]
+
+
+def small_profile(rng: random.Random, user_id: int) -> UserProfile:
+    """Profiles drawn from few values, so many candidates tie"""
+    return UserProfile(
+        id=user_id,
+        personality_type=rng.choice(['INTJ', 'ENFP', None]),
+        personality_traits=rng.choice([None, {'openness': 0.5}, {'openness': 0.5, 'extraversion': 0.25}]),
+        interests=rng.sample(INTERESTS, rng.randint(0, 2)),
+        travel_styles=rng.sample(STYLES, rng.randint(0, 1)),
+        location=rng.choice(LOCATIONS),
+        age=30
+    )
+
+
+def sorted_top(user, candidates, k: int) -> list:
+    """Reference: stable sort of every candidate on its rounded score"""
+    rounded = round_scores(score_candidates(user, candidates).total)
+    return np.argsort(-rounded, kind='stable')[:k].tolist()
+
+
+@pytest.fixture(autouse=True)
+def geo_off(monkeypatch):
+    monkeypatch.setattr(settings, "MATCHING_GEO_ENABLED", False)
+    feature_cache.clear()
+    yield
+    feature_cache.clear()
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_top_k_matches_stable_sort(seed):
+    rng = random.Random(seed)
+    user = small_profile(rng, -1)
+    candidates = [small_profile(rng, user_id) for user_id in range(rng.randint(1, 400))]
+    scores = score_candidates(user, candidates)
+
+    for k in (1, 3, 10, len(candidates) - 1, len(candidates), len(candidates) + 5):
+        if k <= 0:
+            continue
+        # Small chunks so pruning and heap replacement both happen
+        result = top_k(user, candidates, k, chunk_size=16)
+        expected = sorted_top(user, candidates, k)
+        assert result.indices.tolist() == expected, f"k={k}"
+        for component, values in zip(scores, result.scores):
+            assert values.tolist() == component[expected].tolist()
+
+
+def test_top_k_breaks_ties_by_position():
+    user = UserProfile(id=0, interests=['hiking'])
+    candidates = [UserProfile(id=user_id, interests=['hiking']) for user_id in range(1, 50)]
+    assert top_k(user, candidates, 5, chunk_size=4).indices.tolist() == [0, 1, 2, 3, 4]
+    assert top_k(user, candidates, 100).indices.tolist() == list(range(49))
+    assert top_k(user, candidates, 0).indices.tolist() == []
+    assert top_k(user, [], 5).indices.tolist() == []
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matrix_and_streaming_top_k_match_top_k(seed):
+    rng = random.Random(seed)
+    user = small_profile(rng, -1)
+    candidates = [small_profile(rng, user_id) for user_id in range(300)]
+    expected = sorted_top(user, candidates, 10)
+
+    result = matrix_top_k(ProfileMatrix([user]), ProfileMatrix(candidates), 10, chunk_size=16)
+    assert result.indices.tolist() == expected
+
+    streaming = StreamingTopK(user, 10)
+    for start in range(0, len(candidates), 37):
+        streaming.push(candidates[start:start + 37])
+    ranked, _ = streaming.result()
+    assert [candidate.id for candidate in ranked] == [candidates[index].id for index in expected]
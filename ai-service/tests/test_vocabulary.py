@@ -0,0 +1,97 @@
+"""
+Request tokens past the vocabulary cap
+
+Once a vocabulary holds MATCHING_VOCABULARY_MAX_SIZE tokens, tokens only
+seen in request profiles get no bit. Two inline profiles sharing such
+tokens must still score them as shared, everywhere.
+"""
+
+import asyncio
+import itertools
+
+import pytest
+
+from api import matching
+from api.matching import UserProfile
+from core.config import settings
+from engine.batch import score_candidates
+from engine.blocking import overlap_shortlist
+from engine.features import compile_profile, feature_cache, is_complete
+from engine.reciprocal import ProfileMatrix, mutual_top_k, pair_scores
+from engine.vocabulary import SET_FIELDS, vocabularies
+
+_fresh = itertools.count()
+
+
+def fresh_tokens(count: int) -> list:
+    """Tokens no vocabulary has seen yet"""
+    return [f"capped-{next(_fresh)}" for _ in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def full_vocabularies(monkeypatch):
+    monkeypatch.setattr(settings, "MATCHING_GEO_ENABLED", False)
+    monkeypatch.setattr(settings, "MATCHING_CACHE_ENABLED", False)
+    for field in SET_FIELDS:
+        vocabulary = vocabularies[field]
+        monkeypatch.setattr(vocabulary, "max_size", len(vocabulary) + 2)
+        for token in fresh_tokens(2):
+            vocabulary.intern(token)
+    feature_cache.clear()
+    yield
+    feature_cache.clear()
+
+
+def profile(user_id: int, **fields) -> UserProfile:
+    return UserProfile(id=user_id, personality_type='INTJ', location='Paris, France', age=30, **fields)
+
+
+def test_unknown_tokens_get_no_bit():
+    interests = fresh_tokens(2)
+    compiled = compile_profile(profile(1, interests=interests))
+    assert compiled.interests == 0
+    assert compiled.sizes['interests'] == 2
+    assert compiled.extra('interests') == frozenset(interests)
+    assert not is_complete(compiled)
+    assert sorted(compiled.to_fields()['interests']) == sorted(interests)
+
+
+def test_shared_unknown_tokens_count_as_common():
+    interests = fresh_tokens(2)
+    destinations = fresh_tokens(1)
+    user = profile(1, interests=interests, dream_countries=destinations, languages=['fr'])
+    candidate = profile(2, interests=list(reversed(interests)), dream_countries=destinations, languages=['fr'])
+
+    score, common = matching.calculate_interests_compatibility(user, candidate)
+    assert score == 1.0
+    assert common == sorted(interests)
+    travel, reasons, common_destinations = matching.calculate_travel_compatibility(user, candidate)
+    assert common_destinations == destinations
+
+    result = asyncio.run(matching.find_matches(user, [candidate], 10))
+    compatibility = result["matches"][0]["compatibility"]
+    assert compatibility.interests_compatibility == 100
+    assert compatibility.common_interests == sorted(interests)
+    assert compatibility.common_destinations == destinations
+
+
+def test_kernels_agree_on_unknown_tokens():
+    shared = fresh_tokens(3)
+    user = profile(0, interests=shared[:2] + ['hiking'], travel_styles=shared[2:])
+    candidates = [
+        profile(1, interests=shared[:1], travel_styles=shared[2:]),
+        profile(2, interests=shared[:2] + ['hiking']),
+        profile(3, interests=fresh_tokens(2)),
+        profile(4, interests=['hiking'])
+    ]
+
+    expected = score_candidates(user, candidates)
+    assert list(overlap_shortlist(compile_profile(user), [compile_profile(c) for c in candidates])) == [0, 1, 3]
+    assert expected.interests[1] == 1.0
+
+    block = pair_scores(ProfileMatrix([user]), ProfileMatrix(candidates))
+    for component, values in zip(expected, block):
+        assert values[0].tolist() == component.tolist()
+
+    matches = mutual_top_k([user] + candidates, 1)
+    assert [0, 2] in matches.pairs.tolist()
@@ -311,6 +311,8 @@ CREATE TABLE IF NOT EXISTS matches (
     user2_viewed BOOLEAN DEFAULT FALSE,
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Existing databases get this column from ai-service (engine/match_writer.py ensure_schema)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(user1_id, user2_id)
 );
 
@@ -348,6 +350,9 @@ CREATE TABLE IF NOT EXISTS ai_recommendations (
 -- Create indexes
 CREATE INDEX idx_matches_user1 ON matches(user1_id);
 CREATE INDEX idx_matches_user2 ON matches(user2_id);
+-- Keyset match feeds: WHERE userN_id = ? AND is_active ORDER BY compatibility_score DESC, id
+CREATE INDEX IF NOT EXISTS idx_matches_user1_feed ON matches(user1_id, compatibility_score DESC, id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_matches_user2_feed ON matches(user2_id, compatibility_score DESC, id) WHERE is_active;
 CREATE INDEX idx_connections_requester ON connections(requester_id);
 CREATE INDEX idx_connections_receiver ON connections(receiver_id);
 CREATE INDEX idx_recommendations_user ON ai_recommendations(user_id);